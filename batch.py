@@ -0,0 +1,135 @@
+import os
+import sys
+import time
+import traceback
+from multiprocessing import Pool
+from rates import ExchangeRates
+from exchange_parsers import parsers
+from errors import OversellError
+from taxes import Taxes
+
+# The rate tables shared by the parent process, installed in each worker by init_worker()
+_table = None
+_hourly = None
+
+
+def init_worker(table, hourly=None):
+    global _table, _hourly
+    _table = table
+    _hourly = hourly
+
+
+def run_client(task):
+    """
+      Runs Taxes for one client inside its data root and returns its summary (see Batch.summary).
+      Module-level so pool workers can run it. Everything the client prints goes to run.log in its output dir.
+    """
+    root, output_dir, options = task
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    log = None
+    start = time.time()
+    summary = {'client': root, 'output_dir': output_dir}
+    try:
+        os.chdir(root)
+        # Parsers look the table up by the path of the client's exchange_rates.csv
+        ExchangeRates().install_table(_table, _hourly)
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        log = sys.stdout = open(os.path.join(output_dir, 'run.log'), 'w')
+        # Clients already run on the batch pool, whose workers cannot start pools of their own
+        taxes = Taxes(output_dir=output_dir, update_rates=False, workers=None, output_workers=None, **options)
+        trades, errors, pnl, total_pnl, tax_reporting_data, remaining_funds = taxes.run()
+        summary.update(Batch.summary(trades, errors, tax_reporting_data))
+        summary['status'] = 'ok'
+    except OversellError:
+        # The oversell has already been explained in run.log
+        summary['status'] = 'oversell'
+    except Exception as exc:
+        traceback.print_exc(file=sys.stdout)
+        summary['status'] = 'failed: {}: {}'.format(type(exc).__name__, exc)
+    finally:
+        sys.stdout = stdout
+        if log:
+            log.close()
+        ExchangeRates().reset_table()
+        os.chdir(cwd)
+    summary['seconds'] = time.time() - start
+    return summary
+
+
+class Batch(object):
+    """
+      Runs the tax report of many client portfolios, one after another or on a process pool.
+
+      Each client is a data root (the folder holding its data/ folder) and an output dir. A relative output
+      dir is inside the client's root. Every client runs in its own root, so its caches and checkpoints
+      stay with its data, and writes run.log (everything the run printed) next to its output files.
+
+      The exchange rates are updated once for the whole batch, loaded once, and handed to the workers in
+      shared memory, and every parser is imported before the pool starts, so workers share one rate table
+      and one parser registry rather than loading them again for each client. A client that fails
+      (e.g. an oversell) is reported in the summary and does not stop the batch.
+
+      params
+      clients      : (data root, output dir) pairs
+      workers      : Number of processes running clients at once. Clients run in this process if unset.
+      rates        : The exchange_rates.csv used for every client, instead of each client's own
+      update_rates : Update the rates file from the API before running the clients
+      options      : Keyword arguments of Taxes for every client (year, currencies, formats, cache, ...)
+    """
+    summary_columns = ['client', 'status', 'trades', 'errors', 'sales', 'pnl', 'seconds']
+
+    def __init__(self, clients, workers=None, rates=os.path.join('data', 'exchange_rates.csv'), update_rates=True,
+                 **options):
+        self.clients = [(os.path.abspath(root), output_dir) for root, output_dir in clients]
+        self.workers = workers
+        self.rates = ExchangeRates(path=rates, hourly=options.get('hourly_rates', False))
+        self.update_rates = update_rates
+        self.options = options
+
+    def run(self):
+        """
+          Returns the summary of every client, in client order.
+        """
+        if self.update_rates:
+            self.rates.update_exchange_rates()
+        table = self.rates.table()
+        hourly = self.rates.hourly_table() if self.rates.hourly else None
+        # Import every parser now, so forked workers inherit them as they inherit pandas and Taxes
+        parsers.items()
+
+        tasks = [(root, output_dir, self.options) for root, output_dir in self.clients]
+        if self.workers and self.workers > 1:
+            pool = Pool(self.workers, initializer=init_worker, initargs=(table.share(), hourly))
+            try:
+                summaries = pool.map(run_client, tasks, chunksize=1)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            init_worker(table, hourly)
+            summaries = [run_client(_) for _ in tasks]
+        self.print_summaries(summaries)
+        return summaries
+
+    @staticmethod
+    def summary(trades, errors, tax_reporting_data):
+        return {
+            'trades': len(trades),
+            'errors': len(errors),
+            'sales': len(tax_reporting_data),
+            'pnl': round(tax_reporting_data['pnl'].sum(), 2) if len(tax_reporting_data) else 0,
+        }
+
+    def print_summaries(self, summaries):
+        print "\nBatch summary"
+        print "{:<40} {:<10} {:>8} {:>8} {:>8} {:>14} {:>9}".format(*self.summary_columns)
+        for _ in summaries:
+            print "{:<40} {:<10} {:>8} {:>8} {:>8} {:>14} {:>8.1f}s".format(
+                _['client'][-40:], _['status'][:10], _.get('trades', ''), _.get('errors', ''), _.get('sales', ''),
+                _.get('pnl', ''), _['seconds'])
+        failed = [_ for _ in summaries if _['status'] != 'ok']
+        for _ in failed:
+            print "{}: {} (see {})".format(_['client'], _['status'], os.path.join(_['client'], _['output_dir'], 'run.log'))
+        print "{} clients, {} failed".format(len(summaries), len(failed))
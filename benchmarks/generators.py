@@ -0,0 +1,494 @@
+import csv
+import math
+import os
+import random
+import tempfile
+import zipfile
+import zlib
+from itertools import chain, islice
+from datetime import datetime, timedelta
+from xml.sax.saxutils import escape
+
+# Prices in USD the random walks start from. They are also used as the "current" prices when
+# benchmarking the SalesCalculator, so no API is called.
+START_PRICES = {
+    'BTC': 1000.0,
+    'ETH': 10.0,
+    'LTC': 5.0,
+    'BCH': 300.0,
+    'BNB': 0.1,
+    'XRP': 0.007,
+}
+FIAT = ('USD', 'USDT')
+
+# Exchange rates in data/exchange_rates.csv cover BTC and ETH for every day of this range, so trades
+# quoted in either can be valued.
+START = datetime(2017, 1, 1)
+END = datetime(2020, 6, 30)
+
+# The parts of a one sheet xlsx workbook besides the sheet itself, which is all XlsxReader needs
+XLSX_PARTS = {
+    '[Content_Types].xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>',
+    '_rels/.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="xl/workbook.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument"/>'
+        '</Relationships>',
+    'xl/workbook.xml':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+        '<sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/></sheets></workbook>',
+    'xl/_rels/workbook.xml.rels':
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Target="worksheets/sheet1.xml" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet"/>'
+        '</Relationships>',
+}
+
+
+def column_name(index):
+    # 27 -> "AB", the inverse of xlsx_reader.column_index
+    name = ''
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        name = chr(65 + remainder) + name
+    return name
+
+
+def xlsx_cell(reference, value):
+    # Numbers are numeric cells and text is inline strings. Empty values are left out.
+    if value is None or value == '':
+        return ''
+    if isinstance(value, (int, long, float)):
+        return '<c r="{}"><v>{!r}</v></c>'.format(reference, value)
+    return '<c r="{}" t="inlineStr"><is><t>{}</t></is></c>'.format(reference, escape(str(value)))
+
+
+class SyntheticTrade(object):
+    __slots__ = ('number', 'created_at', 'base', 'quote', 'side', 'amount', 'price', 'total', 'fee', 'trade')
+
+    def __init__(self, number, created_at, base, quote, side, amount, price, fee, trade=True):
+        self.number = number
+        self.created_at = created_at
+        self.base = base
+        self.quote = quote
+        self.side = side
+        self.amount = amount
+        self.price = price
+        self.total = round(amount * price, 8)
+        self.fee = fee
+        self.trade = trade
+
+
+class TradeStream(object):
+    """
+      A seeded, reproducible stream of trades on one exchange.
+
+      Prices follow a random walk per currency, with a daily volatility of a few percent whatever the
+      number of trades. Trade sizes are log-normal around a few hundred
+      dollars, and timestamps are evenly spread between START and END with sub-second jitter, so no
+      two trades of a stream share a timestamp.
+
+      Holdings are tracked so a stream never sells, or pays with, more of a currency than it bought.
+      Crypto paid or received on the quote side is tracked pessimistically (fees against the stream,
+      plus a margin) because some parsers recompute it from the rounded price. When a trade needs a currency the stream does not hold, it is funded by a deposit: a fiat buy
+      one second earlier, kept in "deposits" to be written as manual trades.
+
+      A "non_trades" share of rows are not trades (see ExportGenerator), counted in "non_trade_rows".
+    """
+    def __init__(self, seed, pairs, non_trades=0, rated_days=None):
+        self.random = random.Random(seed)
+        self.pairs = pairs
+        self.non_trades = non_trades
+        self.rated_days = rated_days
+        self.prices = dict(START_PRICES)
+        self.holdings = dict((_, 0.0) for _ in START_PRICES)
+        self.deposits = []
+        self.non_trade_rows = 0
+
+    def price(self, currency):
+        return 1.0 if currency in FIAT else self.prices[currency]
+
+    def step_prices(self, volatility):
+        for currency in self.prices:
+            self.prices[currency] *= math.exp(self.random.gauss(0, volatility))
+
+    def trades(self, n):
+        r = self.random
+        step = max(2, int((END - START).total_seconds() / max(n, 1)))
+        volatility = 0.035 * math.sqrt(step / 86400.)
+        for i in range(n):
+            self.step_prices(volatility)
+            created_at = START + timedelta(seconds=i * step, microseconds=r.randint(0, 999999))
+            base, quote = self.pair(created_at)
+            price = self.price(base) / self.price(quote)
+            amount = round(r.lognormvariate(5.5, 1.2) / self.price(base), 8) or 1E-6
+            fee = round(amount * price * 0.0025, 8)
+
+            if r.random() < self.non_trades:
+                self.non_trade_rows += 1
+                yield SyntheticTrade(i, created_at, base, quote, 'receive', amount, price, 0, trade=False)
+                continue
+
+            side = 'sell' if self.holdings.get(base, 0) >= amount and r.random() < 0.45 else 'buy'
+            trade = SyntheticTrade(i, created_at, base, quote, side, amount, price, fee)
+            paid = (trade.total + fee) * 1.001 + 1E-7
+            if side == 'buy' and quote not in FIAT and self.holdings[quote] < paid:
+                self.deposit(created_at, quote, paid * 1.5)
+            if side == 'buy':
+                self.holdings[base] += amount
+                if quote not in FIAT:
+                    self.holdings[quote] -= paid
+            else:
+                self.holdings[base] -= amount
+                if quote not in FIAT:
+                    self.holdings[quote] += max(0, (trade.total - fee) * 0.999 - 1E-7)
+            yield trade
+
+    def pair(self, created_at):
+        # Trades quoted in crypto need that day's exchange rate, so on the few days the rates file lacks
+        # one, only pairs which can be valued are traded
+        base, quote = self.random.choice(self.pairs)
+        if self.rated_days is None or quote in FIAT or (created_at.date(), quote) in self.rated_days:
+            return base, quote
+        pairs = [_ for _ in self.pairs if _[1] in FIAT or (created_at.date(), _[1]) in self.rated_days]
+        return self.random.choice(pairs) if pairs else (base, 'USD')
+
+    def deposit(self, created_at, currency, amount):
+        amount = round(amount, 8)
+        created_at = created_at.replace(microsecond=0) - timedelta(seconds=1)
+        self.deposits.append(
+            SyntheticTrade(len(self.deposits), created_at, currency, 'USD', 'buy', amount, self.price(currency), 0))
+        self.holdings[currency] += amount
+
+
+class ExportGenerator(object):
+    """
+      Writes synthetic trade history exports in the format one exchange parser reads.
+
+      Sub-classes set the data/<exchange>/ folder, the file "extension", any "preamble" lines before
+      the header, the "columns" and the traded "pairs", and implement row() to turn a SyntheticTrade
+      into the exchange's columns. Exports are split into files of at most rows_per_file rows.
+
+      params
+      seed       : Seed of the trade stream. The same seed, exchange and size always write the same trades.
+      rated_days : Set of (date, currency) with an exchange rate (see rated_days()). Crypto-quoted trades
+                   are only generated on those days. Unchecked if None.
+      non_trades : Share of rows which are not trades (deposits and the like) the parser must reject. They show
+                   up as parse errors on purpose, so the benchmark times the parsers' error path too.
+    """
+    exchange = None
+    extension = 'csv'
+    preamble = []
+    columns = []
+    pairs = []
+    non_trades = 0
+
+    def __init__(self, seed=0, rated_days=None):
+        self.seed = seed
+        self.rated_days = rated_days
+
+    def stream(self):
+        seed = zlib.crc32('{}-{}'.format(self.seed, self.exchange))
+        return TradeStream(seed, self.pairs, self.non_trades, self.rated_days)
+
+    def write(self, data_dir, rows, rows_per_file=100000):
+        """
+          Writes "rows" rows to data_dir/<exchange>/ and returns the stream, whose "deposits" hold the
+          manual trades which fund it.
+        """
+        folder = os.path.join(data_dir, self.exchange)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        stream = self.stream()
+        trades = stream.trades(rows)
+        for number, start in enumerate(range(0, rows, rows_per_file)):
+            filename = os.path.join(folder, '{}_{}.{}'.format(self.exchange, number, self.extension))
+            chunk = (self.row(_) for _ in islice(trades, rows_per_file))
+            if self.extension == 'xlsx':
+                self.write_xlsx(filename, chunk)
+            else:
+                self.write_csv(filename, chunk)
+        return stream
+
+    def write_csv(self, filename, rows):
+        with open(filename, 'wb') as f:
+            for line in self.preamble:
+                f.write(line + '\n')
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            writer.writerows(rows)
+
+    def write_xlsx(self, filename, rows):
+        # The sheet is streamed to a temporary file, as zipfile can only add a member from a string or a file
+        sheet = tempfile.NamedTemporaryFile(suffix='.xml', delete=False)
+        try:
+            sheet.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                        '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+            for number, row in enumerate(chain([self.columns], rows), 1):
+                sheet.write('<row r="{}">{}</row>'.format(number, ''.join(
+                    xlsx_cell('{}{}'.format(column_name(i), number), _) for i, _ in enumerate(row))))
+            sheet.write('</sheetData></worksheet>')
+            sheet.close()
+            with zipfile.ZipFile(filename, 'w', zipfile.ZIP_DEFLATED) as workbook:
+                for name, xml in sorted(XLSX_PARTS.items()):
+                    workbook.writestr(name, xml)
+                workbook.write(sheet.name, 'xl/worksheets/sheet1.xml')
+        finally:
+            os.remove(sheet.name)
+
+    def row(self, trade):
+        raise NotImplementedError()
+
+    def number(self, value):
+        return '{:.8f}'.format(value)
+
+
+class CoinbaseGenerator(ExportGenerator):
+    exchange = 'coinbase'
+    preamble = [
+        'Transactions',
+        'User,synthetic@example.com,00000000-0000-0000-0000-000000000000',
+        '',
+        'Account,Type,Currency',
+        'Synthetic,wallet,USD',
+        '',
+        '',
+    ]
+    columns = [
+        'Timestamp', 'Transaction Type', 'Asset', 'Quantity Transacted', 'USD Spot Price at Transaction',
+        'USD Subtotal', 'USD Total (inclusive of fees)', 'USD Fees', 'Notes',
+    ]
+    pairs = [('BTC', 'USD'), ('ETH', 'USD'), ('LTC', 'USD'), ('BCH', 'USD')]
+    # "Receive" rows, which CoinbaseParser rejects as not a buy or sell
+    non_trades = 0.03
+
+    def row(self, trade):
+        side = trade.side.capitalize() if trade.trade else 'Receive'
+        total = trade.total + trade.fee if trade.side == 'buy' else trade.total - trade.fee
+        return [
+            trade.created_at.strftime('%Y-%m-%dT%H:%M:%SZ'), side, trade.base, self.number(trade.amount),
+            '{:.2f}'.format(trade.price), '{:.2f}'.format(trade.total), '{:.2f}'.format(total),
+            '{:.2f}'.format(trade.fee), '{} {} {}'.format(side, trade.amount, trade.base),
+        ]
+
+
+class CoinbaseProGenerator(ExportGenerator):
+    exchange = 'coinbase_pro'
+    columns = [
+        'portfolio', 'trade id', 'product', 'side', 'created at', 'size', 'size unit', 'price', 'fee',
+        'total', 'price/fee/total unit',
+    ]
+    pairs = [('BTC', 'USD'), ('ETH', 'USD'), ('LTC', 'USD'), ('ETH', 'BTC'), ('LTC', 'BTC')]
+
+    def row(self, trade):
+        total = -(trade.total + trade.fee) if trade.side == 'buy' else trade.total - trade.fee
+        return [
+            'default', trade.number, '{}-{}'.format(trade.base, trade.quote), trade.side.upper(),
+            trade.created_at.strftime('%Y-%m-%dT%H:%M:%S.%fZ')[:-4] + 'Z', self.number(trade.amount),
+            trade.base, self.number(trade.price), self.number(trade.fee), self.number(total), trade.quote,
+        ]
+
+
+class BinanceCsvGenerator(ExportGenerator):
+    exchange = 'binance_csv'
+    columns = ['created_at', 'amount', 'fill_amount', 'currency_pair', 'type', 'price']
+    pairs = [('BTC', 'USDT'), ('ETH', 'USDT'), ('ETH', 'BTC'), ('LTC', 'BTC'), ('BNB', 'BTC')]
+
+    def row(self, trade):
+        return [
+            trade.created_at.strftime('%Y-%m-%d %H:%M:%S'), self.number(trade.amount), self.number(trade.total),
+            '{}-{}'.format(trade.base, trade.quote), trade.side.upper(), self.number(trade.price),
+        ]
+
+
+class BinanceXlsxGenerator(ExportGenerator):
+    exchange = 'binance_xlsx'
+    extension = 'xlsx'
+    columns = ['Date(UTC)', 'Market', 'Type', 'Price', 'Amount', 'Total', 'Fee', 'Fee Coin']
+    pairs = [('BTC', 'USDT'), ('ETH', 'USDT'), ('BNB', 'USDT'), ('ETH', 'BTC'), ('XRP', 'BTC')]
+
+    def row(self, trade):
+        return [
+            trade.created_at.strftime('%Y-%m-%d %H:%M:%S'), trade.base + trade.quote, trade.side.upper(),
+            self.number(trade.price), self.number(trade.amount), self.number(trade.total),
+            self.number(trade.fee), trade.quote,
+        ]
+
+
+class BitfinexGenerator(ExportGenerator):
+    exchange = 'bitfinex'
+    columns = ['#', 'Pair', 'Amount', 'Price', 'Fee', 'Fee Currency', 'Date']
+    pairs = [('BTC', 'USD'), ('ETH', 'USD'), ('LTC', 'USD'), ('ETH', 'BTC')]
+
+    def row(self, trade):
+        amount = trade.amount if trade.side == 'buy' else -trade.amount
+        return [
+            trade.number, '{}/{}'.format(trade.base, trade.quote), self.number(amount),
+            self.number(trade.price), self.number(-trade.fee), trade.quote,
+            trade.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        ]
+
+
+class BittrexGenerator(ExportGenerator):
+    exchange = 'bittrex'
+    columns = [
+        'Uuid', 'Exchange', 'TimeStamp', 'OrderType', 'Limit', 'Quantity', 'QuantityRemaining',
+        'Commission', 'Price', 'PricePerUnit', 'IsConditional', 'Condition', 'ConditionTarget',
+        'ImmediateOrCancel', 'Closed',
+    ]
+    pairs = [('BTC', 'USDT'), ('ETH', 'BTC'), ('LTC', 'BTC'), ('XRP', 'BTC')]
+
+    def row(self, trade):
+        timestamp = trade.created_at.strftime('%m/%d/%Y %I:%M:%S %p')
+        return [
+            trade.number, '{}-{}'.format(trade.quote, trade.base), timestamp,
+            'LIMIT_{}'.format(trade.side.upper()), self.number(trade.price), self.number(trade.amount),
+            '0.00000000', self.number(trade.fee), self.number(trade.total + trade.fee), self.number(trade.price),
+            'False', 'NONE', '', 'False', timestamp,
+        ]
+
+
+class CircleGenerator(ExportGenerator):
+    exchange = 'circle'
+    columns = ['created_at', 'amount', 'fill_amount', 'currency_pair', 'type', 'price']
+    pairs = [('BTC', 'USD'), ('ETH', 'USD')]
+
+    def row(self, trade):
+        return [
+            trade.created_at.strftime('%m/%d/%Y %H:%M:%S'), self.number(trade.amount), self.number(trade.total),
+            '{}-{}'.format(trade.base, trade.quote), trade.side, self.number(trade.price),
+        ]
+
+
+class GeminiGenerator(ExportGenerator):
+    exchange = 'gemini'
+    extension = 'xlsx'
+    currencies = ['USD', 'BTC', 'ETH', 'LTC']
+    columns = ['Date', 'Time (UTC)', 'Type', 'Symbol', 'Specification', 'Liquidity Indicator',
+               'Trading Fee Rate (bps)'] + ['{c} Amount {c}'.format(c=_) for _ in currencies]
+    pairs = [('BTC', 'USD'), ('ETH', 'USD'), ('LTC', 'USD'), ('ETH', 'BTC'), ('LTC', 'BTC')]
+    # "Credit" rows, which GeminiParser rejects as not a buy or sell
+    non_trades = 0.03
+
+    def row(self, trade):
+        # Gemini dates are spreadsheet serial numbers, in Pacific time (see GeminiParser.process_date)
+        serial = (trade.created_at + timedelta(hours=7) - datetime(1900, 1, 1)).total_seconds() / 86400 + 2
+        amounts = dict((_, '') for _ in self.currencies)
+        sign = 1 if trade.side == 'buy' else -1
+        amounts[trade.base] = sign * trade.amount
+        amounts[trade.quote] = -sign * trade.total
+        return [
+            serial, trade.created_at.strftime('%H:%M:%S.%f'),
+            trade.side.capitalize() if trade.trade else 'Credit', trade.base + trade.quote,
+            'Synthetic', 'Taker', 25,
+        ] + [amounts[_] for _ in self.currencies]
+
+
+class KrakenGenerator(ExportGenerator):
+    exchange = 'kraken'
+    columns = ['txid', 'ordertxid', 'pair', 'time', 'type', 'ordertype', 'price', 'cost', 'fee', 'vol',
+               'margin', 'misc', 'ledgers']
+    pairs = [('ETH', 'BTC'), ('LTC', 'BTC')]
+
+    def row(self, trade):
+        # Kraken's X-prefixed asset codes, e.g. XETHXXBT (KrakenParser.process_currency_pair)
+        pair = 'X{}X{}'.format(trade.base, trade.quote.replace('BTC', 'XBT'))
+        return [
+            'T{:08d}'.format(trade.number), 'O{:08d}'.format(trade.number), pair,
+            trade.created_at.strftime('%Y-%m-%d %H:%M:%S.%f')[:-2], trade.side, 'limit',
+            self.number(trade.price), self.number(trade.total), self.number(trade.fee),
+            self.number(trade.amount), '0.00000000', '', '',
+        ]
+
+
+class PoloniexGenerator(ExportGenerator):
+    exchange = 'poloniex'
+    columns = ['Date', 'Market', 'Category', 'Type', 'Price', 'Amount', 'Total', 'Fee', 'Order Number',
+               'Base Total Less Fee', 'Quote Total Less Fee']
+    pairs = [('BTC', 'USDT'), ('ETH', 'BTC'), ('LTC', 'BTC'), ('XRP', 'BTC')]
+
+    def row(self, trade):
+        return [
+            trade.created_at.strftime('%Y-%m-%d %H:%M:%S'), '{}/{}'.format(trade.base, trade.quote), 'Exchange',
+            trade.side.capitalize(), self.number(trade.price), self.number(trade.amount),
+            self.number(trade.total), '0.25%', trade.number, self.number(trade.total - trade.fee),
+            self.number(trade.amount),
+        ]
+
+
+class ManualTradesGenerator(ExportGenerator):
+    exchange = 'manual_trades'
+    columns = ['created_at', 'platform', 'amount', 'type', 'currency_pair', 'fill_amount', 'price']
+    pairs = [('BTC', 'USD'), ('ETH', 'USD')]
+    platform = 'in-person'
+
+    def row(self, trade):
+        return [
+            trade.created_at.strftime('%m/%d/%Y %H:%M:%S'), self.platform, self.number(trade.amount),
+            trade.side, '{}-{}'.format(trade.base, trade.quote), self.number(trade.total), '',
+        ]
+
+    def write_deposits(self, data_dir, name, deposits):
+        folder = os.path.join(data_dir, self.exchange)
+        if not os.path.isdir(folder):
+            os.makedirs(folder)
+        self.platform = '{} deposit'.format(name)
+        self.write_csv(os.path.join(folder, '{}_deposits.csv'.format(name)), (self.row(_) for _ in deposits))
+        self.platform = ManualTradesGenerator.platform
+
+
+generators = {
+    'binance_csv': BinanceCsvGenerator,
+    'binance_xlsx': BinanceXlsxGenerator,
+    'bitfinex': BitfinexGenerator,
+    'bittrex': BittrexGenerator,
+    'circle': CircleGenerator,
+    'coinbase': CoinbaseGenerator,
+    'coinbase_pro': CoinbaseProGenerator,
+    'gemini': GeminiGenerator,
+    'kraken': KrakenGenerator,
+    'poloniex': PoloniexGenerator,
+    'manual_trades': ManualTradesGenerator,
+}
+
+
+def rated_days(rates_file):
+    """
+      Returns the set of (date, currency) with a rate in an exchange_rates.csv file.
+    """
+    with open(rates_file, 'r') as f:
+        return set((datetime.strptime(_['date'], '%Y-%m-%d').date(), _['currency']) for _ in csv.DictReader(f))
+
+
+def generate(data_dir, rows, exchanges=None, seed=0, rows_per_file=100000, rates_file=None):
+    """
+      Writes "rows" synthetic trade rows split evenly across exchanges (all of them by default) into
+      data_dir, plus the manual trades which fund them. Returns the number of rows written per exchange,
+      and the number of those rows which are not trades, that the parsers reject on purpose (see non_trades).
+      With rates_file, crypto-quoted trades are only generated on days it has a rate for.
+    """
+    exchanges = sorted(exchanges or generators.keys())
+    days = rated_days(rates_file) if rates_file else None
+    counts = {}
+    non_trade_rows = {}
+    for i, exchange in enumerate(exchanges):
+        counts[exchange] = rows // len(exchanges) + (1 if i < rows % len(exchanges) else 0)
+        stream = generators[exchange](seed, days).write(data_dir, counts[exchange], rows_per_file)
+        non_trade_rows[exchange] = stream.non_trade_rows
+        if stream.deposits:
+            ManualTradesGenerator(seed).write_deposits(data_dir, exchange, stream.deposits)
+    return counts, non_trade_rows
@@ -0,0 +1,191 @@
+"""
+  Times the stages of a tax run on synthetic exchange exports.
+
+  For each size, exports in every parser's format are generated into <workdir>/<rows>/data (see
+  generators.py) and these stages are timed separately, each on the output of the one before:
+
+    Trades.run, LIFO.run, LIFO.aggregate_pnl, SalesCalculator.sales_data, Taxes.write_files
+
+  Results are saved as JSON. When a baseline results file exists, every stage slower than its
+  baseline by more than the tolerance is reported as a regression and the exit code is 1.
+
+  Usage, from the repository root:
+    python -m benchmarks.run --rows 1000,100000
+    python -m benchmarks.run --rows 1000000 --exchanges coinbase_pro,kraken --workers 4
+    python -m benchmarks.run --rows 1000 --save-baseline
+"""
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+from decimal import Decimal
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.generators import generate, START_PRICES
+from trades import Trades
+from lifo import LIFO
+from sales_calculator import SalesCalculator
+from taxes import Taxes
+
+STAGES = ['Trades.run', 'LIFO.run', 'LIFO.aggregate_pnl', 'SalesCalculator.sales_data', 'Taxes.write_files']
+
+
+class OfflineSalesCalculator(SalesCalculator):
+    # Uses the generators' prices instead of calling the current prices API
+    def current_exchange_rates(self, currencies=None):
+        rates = dict(('{}_USD'.format(k), Decimal(str(v))) for k, v in START_PRICES.items())
+        rates['USD_USD'] = Decimal(1)
+        return rates
+
+
+def run_size(rows, workdir, exchanges, seed, workers, rows_per_file, pnl_threshold, fixed_point=False):
+    """
+      Generates the exports for one size and returns {stage: seconds}.
+    """
+    folder = os.path.join(workdir, str(rows))
+    if os.path.isdir(folder):
+        shutil.rmtree(folder)
+    os.makedirs(os.path.join(folder, 'output'))
+    data_dir = os.path.join(folder, 'data')
+    print "Generating {} rows in {}".format(rows, data_dir)
+    rates_file = os.path.join(ROOT, 'data', 'exchange_rates.csv')
+    counts, non_trade_rows = generate(data_dir, rows, exchanges, seed, rows_per_file, rates_file)
+    shutil.copy(rates_file, data_dir)
+
+    timings = {}
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        start = time.time()
+        trades, errors = Trades(workers=workers).run()
+        timings['Trades.run'] = time.time() - start
+        print_rejected(errors, non_trade_rows)
+
+        start = time.time()
+        pnl, remaining_funds = LIFO(fixed_point=fixed_point).run(trades)
+        timings['LIFO.run'] = time.time() - start
+
+        start = time.time()
+        total_pnl = LIFO(fixed_point=fixed_point).aggregate_pnl(pnl)
+        timings['LIFO.aggregate_pnl'] = time.time() - start
+
+        start = time.time()
+        OfflineSalesCalculator(datetime.now().year).sales_data(pnl, remaining_funds, pnl_threshold)
+        timings['SalesCalculator.sales_data'] = time.time() - start
+
+        taxes = Taxes()
+        tax_reporting_data = taxes.tax_reporting_data(pnl)
+        start = time.time()
+        taxes.write_files(trades, errors, pnl, total_pnl, tax_reporting_data)
+        timings['Taxes.write_files'] = time.time() - start
+    finally:
+        os.chdir(cwd)
+    return timings
+
+
+def print_rejected(errors, non_trade_rows):
+    # Non-trade rows are generated on purpose, so only errors beyond them point at a generator or parser bug
+    expected = sum(non_trade_rows.values())
+    print "{} rows rejected, {} of them non-trade rows generated on purpose ({})".format(
+        len(errors), expected, ', '.join('{} {}'.format(k, v) for k, v in sorted(non_trade_rows.items()) if v))
+    if len(errors) != expected:
+        for name, count in sorted(Counter(type(_).__name__ for _ in errors).items()):
+            print "{:<28} {}".format(name, count)
+
+
+def regressions(results, baseline, tolerance, min_seconds):
+    """
+      Returns (rows, stage, seconds, baseline seconds) for every stage slower than baseline * (1 + tolerance).
+      Stages which take less than min_seconds in both runs are too noisy to compare and are ignored.
+    """
+    slower = []
+    for rows, timings in sorted(results['results'].items(), key=lambda _: int(_[0])):
+        for stage in STAGES:
+            before = baseline.get('results', {}).get(rows, {}).get(stage)
+            after = timings.get(stage)
+            if before is None or after is None or max(before, after) < min_seconds:
+                continue
+            if after > before * (1 + tolerance):
+                slower.append((rows, stage, after, before))
+    return slower
+
+
+def print_results(results, baseline):
+    for rows, timings in sorted(results['results'].items(), key=lambda _: int(_[0])):
+        print "\n{} rows".format(rows)
+        for stage in STAGES:
+            before = baseline.get('results', {}).get(rows, {}).get(stage)
+            print "{s:<28} {t:>10.3f}s {b}".format(
+                s=stage,
+                t=timings[stage],
+                b='(baseline {:.3f}s)'.format(before) if before is not None else '',
+            )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark a tax run on synthetic exchange exports")
+    parser.add_argument('--rows', default='1000,10000',
+                        help="Comma separated sizes, in total rows across exchanges (1000 to 10000000)")
+    parser.add_argument('--exchanges', default=None, help="Comma separated exchanges (default: all)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=None, help="Processes for Trades.run (default: serial)")
+    parser.add_argument('--rows-per-file', type=int, default=100000)
+    parser.add_argument('--pnl-threshold', type=float, default=0)
+    parser.add_argument('--fixed-point', action='store_true', help="Run LIFO in fixed-point mode")
+    parser.add_argument('--workdir', default=os.path.join(ROOT, 'benchmarks', 'workspace'))
+    parser.add_argument('--output', default=os.path.join(ROOT, 'benchmarks', 'results.json'))
+    parser.add_argument('--baseline', default=os.path.join(ROOT, 'benchmarks', 'baseline.json'))
+    parser.add_argument('--save-baseline', action='store_true', help="Also save the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="Allowed slowdown before a regression")
+    parser.add_argument('--min-seconds', type=float, default=0.05)
+    args = parser.parse_args(argv)
+
+    sizes = [int(_) for _ in args.rows.split(',')]
+    exchanges = args.exchanges.split(',') if args.exchanges else None
+    results = {
+        'meta': {
+            'date': datetime.now().isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor(),
+            'seed': args.seed,
+            'exchanges': exchanges or 'all',
+            'workers': args.workers,
+            'fixed_point': args.fixed_point,
+        },
+        'results': {},
+    }
+    for rows in sizes:
+        results['results'][str(rows)] = run_size(
+            rows, args.workdir, exchanges, args.seed, args.workers, args.rows_per_file, args.pnl_threshold,
+            args.fixed_point)
+
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+    print_results(results, baseline)
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+    print "\nResults saved to {}".format(args.output)
+    if args.save_baseline:
+        shutil.copy(args.output, args.baseline)
+        print "Baseline saved to {}".format(args.baseline)
+        return 0
+
+    slower = regressions(results, baseline, args.tolerance, args.min_seconds)
+    for rows, stage, after, before in slower:
+        print "REGRESSION {} rows {}: {:.3f}s, baseline {:.3f}s".format(rows, stage, after, before)
+    return 1 if slower else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,183 @@
+"""
+  Command line entry point. Run it from the folder holding data/ (or point --directory at it):
+
+    python cli.py run     Update exchange rates, parse every file, calculate LIFO and write all output files
+    python cli.py parse   Parse every file and write trades and errors
+    python cli.py lifo    Parse and calculate LIFO, and write pnl and total_pnl
+    python cli.py sales   Parse, calculate LIFO, and report the sales that lower a year's capital gains
+    python cli.py batch   Run the full tax report of many client folders, sharing one rates file (see Batch)
+
+  Only the standard library is imported up front. Each command imports pandas, the parsers and the other
+  modules it needs when it runs, and the parser registry only imports the parsers of exchanges that have
+  files, so --help and small runs start quickly.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime
+
+
+def build_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--directory', '-C', default=None, help="Folder holding data/ (default: current folder)")
+    common.add_argument('--workers', type=int, default=None, help="Processes used to parse files (default: serial)")
+    common.add_argument('--cache', action='store_true', help="Reuse parsed files from cache/parsed")
+    common.add_argument('--offline', action='store_true',
+                        help="Do not update exchange_rates.csv or current prices from the APIs (use cached ones)")
+    common.add_argument('--instrument', action='store_true', help="Print the time and memory of every stage")
+    common.add_argument('--currencies', default=None,
+                        help="Comma separated currencies to compute (default: all). Trades filling them are kept.")
+    common.add_argument('--exchanges', default=None, help="Comma separated exchanges to parse (default: all)")
+    common.add_argument('--hourly-rates', action='store_true',
+                        help="Value crypto fills at the rate of their hour (see: python rates.py hourly <start date>)")
+
+    year = argparse.ArgumentParser(add_help=False)
+    year.add_argument('--year', type=int, default=None,
+                      help="Only compute this tax year: later trades are skipped (default: every year)")
+
+    lifo = argparse.ArgumentParser(add_help=False)
+    lifo.add_argument('--checkpoints', action='store_true', help="Resume LIFO from year-end checkpoints in cache/lifo")
+    lifo.add_argument('--fixed-point', action='store_true', help="Match lots with exact integer amounts")
+
+    output = argparse.ArgumentParser(add_help=False)
+    output.add_argument('--output-dir', default='output')
+    output.add_argument('--formats', default='csv', help="Comma separated output formats: csv, csv.gz, columnar")
+    output.add_argument('--output-workers', type=int, default=None, help="Processes writing files at once")
+
+    parser = argparse.ArgumentParser(prog='simple-taxes', description="Crypto tax reporting from exchange exports")
+    commands = parser.add_subparsers(dest='command')
+    run = commands.add_parser('run', parents=[common, year, lifo, output], help="Run the full tax report")
+    run.add_argument('--form-8949', action='store_true', help="Also write form_8949.csv")
+    commands.add_parser('parse', parents=[common, year, output], help="Parse exchange files into trades")
+    commands.add_parser('lifo', parents=[common, year, lifo, output], help="Calculate LIFO profit and loss")
+    sales = commands.add_parser('sales', parents=[common, lifo], help="Report sales that lower a year's PNL")
+    # The sales year is the year the sales are made in, not a filter: current holdings need every trade
+    sales.add_argument('--year', type=int, default=datetime.now().year)
+    sales.add_argument('--pnl-threshold', type=float, default=0,
+                       help="PNL increase allowed before a currency stops selling (see SalesCalculator)")
+    sales.add_argument('--optimize', action='store_true', help="Plan sales across currencies (see TaxLossOptimizer)")
+    sales.add_argument('--pnl-target', type=float, default=None)
+    sales.add_argument('--pnl-cap', type=float, default=None)
+    sales.add_argument('--min-sales', type=float, default=0)
+    batch = commands.add_parser('batch', parents=[common, year, lifo, output],
+                                help="Run the full tax report of many clients (--workers clients at once)")
+    batch.add_argument('clients', nargs='+', metavar='ROOT[=OUTPUT]',
+                       help="Folder holding a client's data/, and optionally its output folder (default: --output-dir)")
+    batch.add_argument('--rates', default=os.path.join('data', 'exchange_rates.csv'),
+                       help="exchange_rates.csv shared by every client")
+    batch.add_argument('--form-8949', action='store_true', help="Also write form_8949.csv")
+    return parser
+
+
+def make_taxes(args):
+    from taxes import Taxes
+    from lifo_checkpoints import LotCheckpoints
+    return Taxes(
+        workers=args.workers,
+        cache=args.cache or None,
+        checkpoints=LotCheckpoints() if getattr(args, 'checkpoints', False) else None,
+        instrumentation=args.instrument or None,
+        output_dir=getattr(args, 'output_dir', 'output'),
+        formats=getattr(args, 'formats', 'csv').split(','),
+        form_8949=getattr(args, 'form_8949', False),
+        output_workers=getattr(args, 'output_workers', None),
+        fixed_point=getattr(args, 'fixed_point', False),
+        update_rates=not args.offline,
+        year=args.year if args.command != 'sales' else None,
+        currencies=args.currencies.upper().split(',') if args.currencies else None,
+        exchanges=args.exchanges.split(',') if args.exchanges else None,
+        hourly_rates=args.hourly_rates,
+    )
+
+
+def parse_trades(taxes):
+    if taxes.update_rates:
+        from rates import ExchangeRates
+        with taxes.instrumentation.stage('rates.update'):
+            ExchangeRates(hourly=taxes.hourly_rates).update_exchange_rates()
+    with taxes.instrumentation.stage('trades') as stage:
+        trades, errors = taxes.run_trades()
+        stage.rows = len(trades)
+    taxes.print_trade_info(trades)
+    taxes.print_errors(errors)
+    return trades, errors
+
+
+def run(taxes, args):
+    taxes.run()
+
+
+def batch(taxes, args):
+    from batch import Batch
+    from lifo_checkpoints import LotCheckpoints
+    clients = [(_.partition('=')[0], _.partition('=')[2] or args.output_dir) for _ in args.clients]
+    summaries = Batch(
+        clients,
+        workers=args.workers,
+        rates=args.rates,
+        update_rates=not args.offline,
+        cache=args.cache or None,
+        checkpoints=LotCheckpoints() if args.checkpoints else None,
+        formats=args.formats.split(','),
+        form_8949=args.form_8949,
+        fixed_point=args.fixed_point,
+        year=args.year,
+        currencies=args.currencies.upper().split(',') if args.currencies else None,
+        exchanges=args.exchanges.split(',') if args.exchanges else None,
+        hourly_rates=args.hourly_rates,
+    ).run()
+    return 1 if any(_['status'] != 'ok' for _ in summaries) else 0
+
+
+def parse(taxes, args):
+    trades, errors = parse_trades(taxes)
+    taxes.write_frames([('trades', trades)], errors)
+
+
+def lifo(taxes, args):
+    trades, errors = parse_trades(taxes)
+    pnl, total_pnl, remaining_funds = taxes.run_lifo(trades)
+    print total_pnl
+    taxes.write_frames([('pnl', pnl), ('total_pnl', total_pnl)])
+
+
+def sales(taxes, args):
+    trades, errors = parse_trades(taxes)
+    pnl, total_pnl, remaining_funds = taxes.run_lifo(trades)
+    if args.optimize:
+        from tax_loss_optimizer import TaxLossOptimizer
+        TaxLossOptimizer(args.year, pnl_target=args.pnl_target, pnl_cap=args.pnl_cap,
+                         min_sales=args.min_sales, offline=args.offline).run(pnl, remaining_funds)
+    else:
+        from sales_calculator import SalesCalculator
+        calculator = SalesCalculator(args.year, offline=args.offline)
+        calculator.find_min_max_pnl(calculator.sales_data(pnl, remaining_funds, args.pnl_threshold))
+
+
+commands = {
+    'run': run,
+    'parse': parse,
+    'lifo': lifo,
+    'sales': sales,
+    'batch': batch,
+}
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.directory:
+        os.chdir(args.directory)
+    taxes = make_taxes(args)
+    from errors import OversellError
+    try:
+        status = commands[args.command](taxes, args)
+    except OversellError:
+        # The oversell has already been explained above
+        return 1
+    if taxes.instrumentation.enabled and args.command != 'run':
+        taxes.instrumentation.print_report()
+    return status or 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,45 +1,167 @@
-import requests
+import json
+import os
 import time
+import requests
 from decimal import Decimal
+from errors import ApiError
 
 
 CMC_API_KEY = None
 
+# Symbols which CoinMarketCap lists under another name
+ALIASES = {'IOTA': 'MIOTA', 'XRB': 'NANO'}
+
+# Prices fetched by this process, shared by every ExchangeRates: {cache path: {symbol: (fetched at, price)}}
+_prices = {}
+
+
 class ExchangeRates():
-    def __init__(self):
-        self.limit = 200
-        self.cmc_url = 'https://pro-api.coinmarketcap.com/'
-        self.cmc_endpoint = 'v1/cryptocurrency/listings/latest?sort=market_cap&start=1&limit={}'.format(self.limit)
+    """
+      Current USD prices from the CoinMarketCap listings API, as {"<SYMBOL>_USD": Decimal}.
+
+      run() returns the prices of the symbols it is given. A price fetched less than "ttl" seconds ago is
+      taken from memory or from the cache file. The other symbols are fetched by paging through the
+      listings (by market cap, "limit" per page) until all of them are found or the listings end, so coins
+      outside the top "limit" are priced too. Every price on a fetched page is cached.
+
+      If the API cannot be reached (or "offline" is set), a symbol falls back to its latest cached price,
+      however old, and then to its latest rate in exchange_rates.csv. Symbols without any price are left
+      out of the result.
+
+      params
+      api        : Base URL of the CoinMarketCap API. Point it at a local server to test against a stub.
+      ttl        : Seconds a fetched price stays current
+      cache_path : JSON file of fetched prices, kept across runs. None keeps them in memory only.
+      limit      : Listings per page
+      max_pages  : Most pages fetched by one run()
+      offline    : Never call the API
+    """
+    def __init__(self, api='https://pro-api.coinmarketcap.com/', ttl=300,
+                 cache_path=os.path.join('cache', 'current_prices.json'), limit=200, max_pages=25,
+                 offline=False, timeout=30):
+        self.limit = limit
+        self.max_pages = max_pages
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self.offline = offline
+        self.timeout = timeout
+        self.cmc_url = api
+        self.cmc_endpoint = 'v1/cryptocurrency/listings/latest?sort=market_cap&start={start}&limit={limit}'
         self.cmc_header = {'X-CMC_PRO_API_KEY': CMC_API_KEY}
+        self.prices = _prices.setdefault(cache_path, {})
+        self.load_cache()
 
-    def run(self):
-        rates = self.get_cmc_rates()
-        rates = self.add_manual_rates(rates)
-        return rates
+    def run(self, symbols=None):
+        """
+          Returns the current prices of symbols, or of the first page of listings without symbols.
+        """
+        if symbols is None:
+            rates = dict(('{}_USD'.format(k), v) for k, v in self.get_cmc_rates().items())
+            return self.add_manual_rates(rates)
+
+        listed = dict((_, ALIASES.get(_, _)) for _ in symbols if _ != 'USD')
+        wanted = set(listed.values())
+        missing = set(_ for _ in wanted if not self.is_current(_))
+        if missing and not self.offline:
+            try:
+                self.get_cmc_rates(missing)
+            except (requests.RequestException, ApiError, ValueError) as exc:
+                print "Could not fetch current prices ({}), using the latest known prices".format(exc)
+        prices = dict((_, self.prices[_][1]) for _ in wanted if _ in self.prices)
+        prices.update(self.historical_rates(wanted - set(prices)))
+
+        rates = {}
+        for symbol, _ in listed.items():
+            if _ in prices:
+                rates['{}_USD'.format(symbol)] = prices[_]
+        return self.add_manual_rates(rates)
 
     def decode(self, arg):
         if isinstance(arg, unicode):
             return arg.encode()
         return arg
 
-    def get_cmc_rates(self):
-        url = self.cmc_url + self.cmc_endpoint
-        response = requests.get(url, headers=self.cmc_header)
-        r = response.json()
-        self.check_api_status(r)
+    def is_current(self, symbol):
+        return symbol in self.prices and time.time() - self.prices[symbol][0] < self.ttl
 
+    def get_cmc_rates(self, symbols=None):
+        """
+          Fetches pages of listings until every symbol has a price (only the first page without symbols),
+          caches every price seen and returns them as {symbol: Decimal}.
+        """
+        session = requests.Session()
         rates = {}
-        for _ in r['data']:
-            rates['{}_USD'.format(_['symbol'])] = Decimal(_['quote']['USD']['price'])
-        rates = {self.decode(k): v for k,v in rates.items()}
+        for page in range(self.max_pages if symbols else 1):
+            url = self.cmc_url + self.cmc_endpoint.format(start=page * self.limit + 1, limit=self.limit)
+            response = session.get(url, headers=self.cmc_header, timeout=self.timeout)
+            r = response.json()
+            self.check_api_status(r)
+
+            fetched = time.time()
+            for _ in r['data']:
+                symbol = self.decode(_['symbol'])
+                # Symbols are not unique, the listing with the largest market cap comes first
+                if symbol not in rates:
+                    rates[symbol] = Decimal(_['quote']['USD']['price'])
+                    self.prices[symbol] = (fetched, rates[symbol])
+            if len(r['data']) < self.limit or symbols and symbols.issubset(rates):
+                break
+        self.save_cache()
         return rates
 
+    def historical_rates(self, symbols):
+        # Prices from the latest rate of each symbol in exchange_rates.csv, which holds units per USD
+        rates = {}
+        if not symbols:
+            return rates
+        import rates as historical
+        try:
+            table = historical.ExchangeRates().table()
+        except (IOError, OSError):
+            return rates
+        for symbol in symbols:
+            try:
+                day, rate = table.latest(symbol)
+            except KeyError:
+                continue
+            print "Using the {} price of {} from exchange_rates.csv".format(day, symbol)
+            rates[symbol] = 1 / rate
+        return rates
+
+    def load_cache(self):
+        if not self.cache_path:
+            return
+        try:
+            with open(self.cache_path, 'r') as f:
+                stored = json.load(f)
+        except (IOError, ValueError):
+            return
+        for symbol, (fetched, price) in stored.items():
+            symbol = self.decode(symbol)
+            if symbol not in self.prices or self.prices[symbol][0] < fetched:
+                self.prices[symbol] = (fetched, Decimal(price))
+
+    def save_cache(self):
+        if not self.cache_path:
+            return
+        directory = os.path.dirname(self.cache_path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.cache_path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict((k, [t, str(v)]) for k, (t, v) in self.prices.items()), f, indent=2, sort_keys=True)
+        os.rename(tmp, self.cache_path)
+
     def add_manual_rates(self, rates):
         rates['USD_USD'] = Decimal(1.0)
-        rates['IOTA_USD'] = rates['MIOTA_USD']
-        rates['XRB_USD'] = rates['NANO_USD']
+        for symbol, listed in ALIASES.items():
+            if '{}_USD'.format(listed) in rates:
+                rates.setdefault('{}_USD'.format(symbol), rates['{}_USD'.format(listed)])
         return rates
 
     def check_api_status(self, response):
-        if str(response['status']['error_message']) == "API key missing.":
-                raise Exception("API Key Missing. Get free API key from https://coinmarketcap.com/api/ and enter on current_exchange_rates.py")
+        status = response.get('status', {})
+        if str(status.get('error_message')) == "API key missing.":
+            raise ApiError("API Key Missing. Get free API key from https://coinmarketcap.com/api/ and enter on current_exchange_rates.py")
+        if status.get('error_code'):
+            raise ApiError("CoinMarketCap error {}: {}".format(status['error_code'], status.get('error_message')))
@@ -1,8 +1,13 @@
 import csv
-import xlrd
 import os
+from itertools import islice
+import numpy as np
+import pandas as pd
 from cached_property import cached_property
 from rates import ExchangeRates
+from trade_record import Trade
+from field_pipeline import ParserType
+from xlsx_reader import XlsxReader
 from decimal import Decimal
 from datetime import datetime
 from errors import MissingHeaderElementError, InvalidTradeException, \
@@ -23,17 +28,46 @@ class DocumentParser(object):
 
     params
     required fields.     : Mapping of name of required fields for each trade and data type. See README.md for more.
+    extras               : Keep the unused columns of each row in Trade._extras. Dropped by default to save memory.
+    since                : Skip the rows made at or before this datetime (already ingested, see Watermarks) as soon
+                           as their date is parsed.
+    hourly_rates         : Value fills in crypto currencies at the rate of the trade's time from the hourly rate
+                           table (see HourlyRateTable), instead of the day's rate. Trades without an hourly rate
+                           near them keep the daily rate.
     include_small_trades : We remove small trades based on a threshold. A trade is "small" if either side of the trade
                            is less than the threshold. Some trades are technically small but very meaningful, namely
                            ICOs, Fork, Airdrops, and Gifts. For these trades, the "fill amount" (e.g., the amount you paid)
                            is effectively zero (they are free transactions), so they qualify as small.
                            Include all small trades that are included in the "include_small_trades" list.
 
+    version              : Bump when a change alters the parsed output, so cached results (see ParseCache) are
+                           not reused. Sub-classes inherit it and may bump their own.
+
     errors
     MissingHeaderElementError  : If an exchange parser does not supply the required fields, this exception is thrown
     NotATradeException         : If an exchange returns extraneous non-trade data (deposits, withdrawals, etc)
     TradeTooSmallException     : If the amount (on either side of a trade) is below a theshold, it is omitted
+
+    vectorized parsing
+    Sub-classes whose process_row only transforms columns can set "vectorized = True" to use bulk_parser() instead
+    of parsing row by row. The bulk path reads the whole file into columns, maps them with the same "header",
+    parses "created_at" with "date_format", lower-cases "type", converts "decimal_fields" with abs(Decimal(...)),
+    and runs each method named in "column_transforms" once per distinct value of its field. Implied fields are
+    calculated per column too, so vectorized sub-classes must not override the generate_*_field methods.
+    Any row the bulk path cannot handle is parsed with the per-row code, and the output is identical either way.
+
+    per-row parsing
+    Each sub-class gets a "pipeline" (a FieldPipeline) when it is created, holding its map_row, process_row and
+    generate_*_field methods and its type and small trade checks. parse_trade() runs it on one row, and
+    parse_rows() on a batch of rows.
+
+    xlsx files
+    Workbooks are streamed with XlsxReader, "xlsx_chunk_rows" rows at a time. Cells are returned like xlrd
+    returned them (spreadsheet dates as serial numbers) unless "xlsx_dates = True", which returns cells with
+    a date format as datetimes.
     """
+    __metaclass__ = ParserType
+
     required_fields = {
         'created_at': datetime,
         'amount': Decimal,
@@ -44,16 +78,34 @@ class DocumentParser(object):
     }
     include_small_trades = ['fork', 'ico', 'airdrop', 'gift', 'staking rewards', 'coinbase staking', 'coinbase earn']
     small_trade_threshold = Decimal(1E-7)
+    usd_currencies = ['USD', 'USDC', 'USDT', 'TUSD', 'BUSD', 'DAI']
+    version = 2
+
+    vectorized = False
+    date_format = None
+    decimal_fields = ('amount', 'fill_amount', 'price')
+    column_transforms = {}
+
+    xlsx_dates = False
+    xlsx_chunk_rows = 50000
 
-    def __init__(self, exchange_name=None, header=None, header_rows=None):
+    def __init__(self, exchange_name=None, header=None, header_rows=None, extras=False, since=None,
+                 hourly_rates=False):
         self.exchange_name = exchange_name
         self.header = header
         self.header_rows = header_rows
+        self.extras = extras
+        self.since = since
+        self.hourly_rates = hourly_rates
         self._validate_header()
 
     @cached_property
     def rates(self):
-        return ExchangeRates().parse_file(os.path.join('data', 'exchange_rates.csv'))
+        return ExchangeRates().table()
+
+    @cached_property
+    def hourly(self):
+        return ExchangeRates().hourly_table() if self.hourly_rates else None
 
     def _validate_header(self):
         for field in self.required_fields.keys():
@@ -72,24 +124,33 @@ class DocumentParser(object):
             raise ValueError("Filetype is neither csv or xlsx: %s" % filetype)
 
     def open_xlsx(self, filename):
-        workbook = xlrd.open_workbook(filename)
-        sheet_index = 0
-        sheet = workbook.sheet_by_index(sheet_index)
-        headers = dict((_, sheet.cell_value(0, _)) for _ in range(sheet.ncols) )
-        reader = (dict((headers[j], sheet.cell_value(i, j)) for j in headers) for i in range(1, sheet.nrows))
-        return self.xlsx_parser(reader)
-
-    def xlsx_parser(self, reader):
+        """
+          Streams the rows of every sheet (see XlsxReader) and parses them "xlsx_chunk_rows" at a time, so
+          memory is bounded by the chunk size rather than the size of the workbook. The first sheet is always
+          parsed; later sheets only when their header has every required column (e.g. trade history split
+          across tabs), so notes or summary tabs are skipped.
+        """
+        reader = XlsxReader(filename, dates=self.xlsx_dates)
         trades = []
         errors = []
-        for row in reader:
-            dict_row = {self.decode(k): self.decode(v) for k,v in row.items()}
-            try:
-                trade = self.parse_trade(dict_row)
-            except InvalidTradeException as exc:
-                errors.append(exc)
-            else:
-                trades.append(trade)
+        try:
+            for index, (name, path) in enumerate(reader.sheets()):
+                rows = reader.rows(path)
+                header = [self.decode(_) for _ in next(rows, [])]
+                if index and self.bulk_fields(header) is None:
+                    continue
+                while True:
+                    chunk = [[self.decode(_) for _ in row] for row in islice(rows, self.xlsx_chunk_rows)]
+                    if not chunk:
+                        break
+                    if self.vectorized:
+                        _trades, _errors = self.bulk_parser(header, chunk)
+                        trades.extend(_trades)
+                        errors.extend(_errors)
+                    else:
+                        self.parse_rows((dict(zip(header, _)) for _ in chunk), trades, errors)
+        finally:
+            reader.close()
         return trades, errors
 
     def decode(self, arg):
@@ -99,6 +160,8 @@ class DocumentParser(object):
 
     def open_csv(self, filename):
         with open(filename, 'r') as f:
+            if self.vectorized:
+                return self.bulk_csv_parser(self.skip_headers(f))
             return self.csv_parser(self.skip_headers(f))
 
     def skip_headers(self, f_obj):
@@ -108,18 +171,206 @@ class DocumentParser(object):
 
     def csv_parser(self, f_obj):
         reader = csv.DictReader(_.replace('\0', '') for _ in f_obj)
+        return self.parse_rows(reader)
+
+    def bulk_csv_parser(self, f_obj):
+        reader = csv.reader(_.replace('\0', '') for _ in f_obj)
+        try:
+            header = next(reader)
+        except StopIteration:
+            return [], []
+        # csv.DictReader skips blank lines
+        return self.bulk_parser(header, [_ for _ in reader if _])
+
+    def bulk_parser(self, header, rows):
+        """
+          Vectorized parse path (see "vectorized parsing" above). Takes the header and the rows of a file as
+          lists and returns the same (trades, errors) as parsing each row with parse_trade().
+        """
+        fields = self.bulk_fields(header)
+        if fields is not None and self.since is not None:
+            rows = self.bulk_since(rows, len(header) - 1 - header[::-1].index(fields['created_at']))
+        good = [i for i, _ in enumerate(rows) if len(_) == len(header)]
+        if fields is None or not good:
+            return self.parse_rows(self.row_dict(header, _) for _ in rows)
+
+        raw = dict(zip(header, zip(*[rows[_] for _ in good])))
+        bad = np.zeros(len(good), dtype=bool)
+        cols = self.bulk_columns(raw, fields, bad)
+        extras = [_ for _ in raw if _ not in fields.values()]
+
         trades = []
         errors = []
-        for row in reader:
-            try:
-                trade = self.parse_trade(row)
-            except InvalidTradeException as exc:
-                errors.append(exc)
+        position = dict((i, j) for j, i in enumerate(good))
+        for i, row in enumerate(rows):
+            j = position.get(i)
+            if j is None or bad[j]:
+                self.parse_rows([self.row_dict(header, row)], trades, errors)
+                continue
+            trade = Trade(**dict((_, cols[_][j]) for _ in cols))
+            if self.extras:
+                trade._extras = dict((_, raw[_][j]) for _ in extras)
+            if (trade.amount < self.small_trade_threshold or \
+                trade.fill_amount < self.small_trade_threshold) and \
+                (trade.platform not in self.include_small_trades):
+                errors.append(TradeTooSmallException("Trade amount is too low", trade))
             else:
                 trades.append(trade)
         return trades, errors
 
+    def bulk_since(self, rows, column):
+        """
+          Returns the rows made after "since", reading only their date column. Rows whose date does not parse
+          here are kept for the per-row code.
+        """
+        parsed = self.bulk_dates([_[column] if column < len(_) else None for _ in rows])
+        old = (parsed <= self.since).values
+        return [row for row, is_old in zip(rows, old) if not is_old]
+
+    def bulk_dates(self, dates):
+        # Parses a column of dates with "date_format", NaT where a value does not parse
+        strings = np.array([isinstance(_, str) for _ in dates], dtype=bool)
+        parsed = pd.to_datetime(pd.Series(dates).where(strings), format=self.date_format, errors='coerce')
+        # Date cells of xlsx files (see "xlsx_dates") are already datetimes
+        cells = np.array([isinstance(_, datetime) for _ in dates], dtype=bool)
+        if cells.any():
+            parsed[cells] = pd.to_datetime(pd.Series(dates)[cells])
+        return parsed
+
+    def bulk_fields(self, header):
+        """
+          Returns a mapping of native field name to the file's column name, or None if the bulk path cannot
+          map every required field from the header.
+        """
+        fields = {}
+        for native_name, vendor_name in self.header.items():
+            names = vendor_name if isinstance(vendor_name, list) else [vendor_name]
+            names = [_ for _ in names if _ and _ in header]
+            if not names:
+                return None
+            fields[native_name] = names[0]
+        return fields
+
+    def bulk_columns(self, raw, fields, bad):
+        """
+          Returns a dict of field name to a list of values for every native and implied field. Rows whose
+          values the bulk path cannot produce are flagged in "bad" and left to the per-row code.
+        """
+        cols = {}
+        parsed = self.bulk_dates(raw[fields['created_at']])
+        bad |= parsed.isnull().values
+        cols['created_at'] = list(parsed.dt.to_pydatetime())
+
+        cols['type'] = self.bulk_map(raw[fields['type']], lambda _: _.lower(), bad)
+        bad |= np.array([_ not in ('buy', 'sell') for _ in cols['type']], dtype=bool)
+
+        pairs = raw[fields['currency_pair']]
+        if 'currency_pair' in self.column_transforms:
+            method = getattr(self, self.column_transforms['currency_pair'])
+            pairs = self.bulk_map(pairs, lambda _: method({'currency_pair': _}), bad)
+        cols['currency_pair'] = pairs
+        bad |= np.array([not isinstance(_, str) for _ in pairs], dtype=bool)
+
+        for _ in self.decimal_fields:
+            cols[_] = self.bulk_map(raw[fields[_]], lambda value: abs(Decimal(value)), bad)
+
+        cols['platform'] = [self.exchange_name] * len(bad)
+        cols['currency'] = self.bulk_map(pairs, lambda _: _.split('-')[0], bad)
+        cols['fill_currency'] = self.bulk_map(pairs, lambda _: _.split('-')[1], bad)
+        cols['fill_type'] = [{'buy': 'sell', 'sell': 'buy'}.get(_) for _ in cols['type']]
+        cols['native_currency'] = ['USD'] * len(bad)
+        cols['native_value'] = self.bulk_native_value(cols, bad)
+
+        basis = []
+        fill_basis = []
+        for amount, fill_amount, native_value, is_bad in zip(
+                cols['amount'], cols['fill_amount'], cols['native_value'], bad):
+            if is_bad or not amount:
+                basis.append(None)
+                fill_basis.append(None)
+                continue
+            basis.append(native_value / amount)
+            try:
+                fill_basis.append(native_value / fill_amount)
+            except:
+                fill_basis.append(Decimal('0'))
+        bad |= np.array([_ is None for _ in basis], dtype=bool)
+        cols['basis'] = basis
+        cols['fill_basis'] = fill_basis
+        return cols
+
+    def bulk_native_value(self, cols, bad):
+        hourly = self.bulk_hourly_rates(cols, bad) if self.hourly is not None else {}
+        rates = {}
+        values = []
+        for i, (created_at, fill_currency, fill_amount, is_bad) in enumerate(zip(
+                cols['created_at'], cols['fill_currency'], cols['fill_amount'], bad)):
+            if is_bad:
+                values.append(None)
+            elif fill_currency in self.usd_currencies:
+                values.append(fill_amount)
+            elif i in hourly:
+                values.append(fill_amount / hourly[i])
+            else:
+                key = (created_at.date(), fill_currency)
+                if key not in rates:
+                    try:
+                        rates[key] = self.rates.get(*key)
+                    except KeyError:
+                        rates[key] = None
+                values.append(fill_amount / rates[key] if rates[key] is not None else None)
+        bad |= np.array([_ is None for _ in values], dtype=bool)
+        return values
+
+    def bulk_hourly_rates(self, cols, bad):
+        # {row: hourly rate} of the rows with one, looking up all the rows of a fill currency at once
+        positions = {}
+        for i, (fill_currency, is_bad) in enumerate(zip(cols['fill_currency'], bad)):
+            if not is_bad and fill_currency not in self.usd_currencies and fill_currency in self.hourly:
+                positions.setdefault(fill_currency, []).append(i)
+        rates = {}
+        for currency, rows in positions.items():
+            found = self.hourly.rates(currency, [cols['created_at'][_] for _ in rows])
+            rates.update((i, rate) for i, rate in zip(rows, found) if rate is not None)
+        return rates
+
+    def bulk_map(self, values, func, bad):
+        """
+          Applies func once per distinct value and returns the mapped list. Values func raises on are
+          flagged in "bad".
+        """
+        failed = object()
+        mapping = {}
+        for value in set(values):
+            try:
+                mapping[value] = func(value)
+            except Exception:
+                mapping[value] = failed
+        mapped = [mapping[_] for _ in values]
+        bad |= np.array([_ is failed for _ in mapped], dtype=bool)
+        return mapped
+
+    def row_dict(self, header, row):
+        # The same dict csv.DictReader builds for a row
+        if len(row) > len(header):
+            _dict = dict(zip(header, row))
+            _dict[None] = row[len(header):]
+            return _dict
+        return dict(zip(header, list(row) + [None] * (len(header) - len(row))))
+
+    def parse_rows(self, rows, trades=None, errors=None):
+        return self.pipeline.run_batch(self, rows, trades, errors)
+
+    def compact_error(self, exc):
+        # Exceptions keep the offending trade; store it as a Trade rather than the full row dict
+        exc.args = tuple(Trade.from_dict(_, self.extras) if isinstance(_, dict) else _ for _ in exc.args)
+        return exc
+
     def parse_trade(self, row):
+        return self.pipeline(self, row)
+
+    def map_row(self, row):
+        # Moves the "header" columns of row to their native names, leaving the rest in "_extras"
         trade = {}
         for native_name, vendor_name in self.header.items():
             if not vendor_name:
@@ -136,34 +387,7 @@ class DocumentParser(object):
             else:
                 trade[native_name] = row.pop(vendor_name)
         trade['_extras'] = row
-
-        processed_trade = self.process_row(trade)
-        self.validate_trade_type(processed_trade)
-        processed_trade.update(self.generate_implied_fields(processed_trade))
-        self.validate_trade(processed_trade)
-        return processed_trade
-
-    def validate_trade_type(self, trade):
-        if trade['type'] not in ['buy', 'sell']:
-            raise NotATradeException("Trade is not a buy or sell", trade)
-
-    def validate_trade(self, trade):
-        self.validate_row(trade)
-        if (trade['amount'] < self.small_trade_threshold or \
-            trade['fill_amount'] < self.small_trade_threshold) and \
-            (trade['platform'] not in self.include_small_trades):
-            raise TradeTooSmallException("Trade amount is too low", trade)
-
-    def generate_implied_fields(self, trade):
-        fields = [
-            'platform', 'currency', 'fill_currency', 'fill_type',
-            'native_value', 'native_currency', 'basis', 'fill_basis'
-        ]
-        implied_fields = {}
-        for _ in fields:
-            implied_fields[_] = eval('self.generate_{}_field(trade)'.format(_))
-            trade.update({_: implied_fields[_]})
-        return implied_fields
+        return trade
 
     def generate_platform_field(self, trade):
         return self.exchange_name
@@ -188,13 +412,18 @@ class DocumentParser(object):
         created_at = trade['created_at'].date()
 
         # TODO: Incorporate real USD value 
-        if fill_currency in ['USD', 'USDC', 'USDT', 'TUSD', 'BUSD', 'DAI']:
+        if fill_currency in self.usd_currencies:
             return fill_amount
-        else:
+        if self.hourly is not None and fill_currency in self.hourly:
             try:
-                rate = self.rates[created_at][fill_currency]
-            except:
-                raise ValueError('Native Value could not find exchange rate {}'.format(trade))
+                return fill_amount / self.hourly.get(trade['created_at'], fill_currency)
+            except KeyError:
+                # No candle near the trade, use the day's rate
+                pass
+        try:
+            rate = self.rates.get(created_at, fill_currency)
+        except:
+            raise ValueError('Native Value could not find exchange rate {}'.format(trade))
         return fill_amount / rate
 
     def generate_native_currency_field(self, trade):
@@ -212,8 +441,3 @@ class DocumentParser(object):
 
     def process_row(self, row):
         raise NotImplemented()
-
-    def validate_row(self, row):
-        for key, _type in self.required_fields.items():
-            if not isinstance(row[key], _type):
-                raise TypeError("%s should be %s, got %s" % (key, _type, type(row[key])))
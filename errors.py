@@ -24,3 +24,20 @@ class NoNewExchangeRatesException(UpdateExchangeRateException):
 
 class ExchangeRatesAlreadyUpToDateException(UpdateExchangeRateException):
     pass
+
+class CheckpointError(Exception):
+    pass
+
+class FrozenYearChangedError(CheckpointError):
+    pass
+
+class OversellError(AssertionError):
+    def __init__(self, message, oversell=None):
+        super(OversellError, self).__init__(message)
+        self.oversell = oversell
+
+class FixedPointOverflowError(OverflowError):
+    pass
+
+class DuplicateTradeException(InvalidTradeException):
+    pass
@@ -0,0 +1,51 @@
+from importlib import import_module
+
+
+class ParserRegistry(object):
+    """
+      Maps each exchange name (its data/<exchange> folder) to its DocumentParser class, importing the
+      parser's module the first time the exchange is looked up. Listing the exchanges imports nothing, so
+      a run only loads the parsers of the exchanges it has files for.
+
+      params
+      paths : Mapping of exchange name to "<module>.<class>" of its parser
+    """
+    def __init__(self, paths):
+        self.paths = paths
+        self.loaded = {}
+
+    def __getitem__(self, exchange):
+        if exchange not in self.loaded:
+            module, _, name = self.paths[exchange].rpartition('.')
+            self.loaded[exchange] = getattr(import_module(module), name)
+        return self.loaded[exchange]
+
+    def __contains__(self, exchange):
+        return exchange in self.paths
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.paths)
+
+    def keys(self):
+        return self.paths.keys()
+
+    def items(self):
+        return [(_, self[_]) for _ in self.keys()]
+
+
+parsers = ParserRegistry({
+    'binance_csv': 'exchange_parsers.binance_csv.BinanceCsvParser',
+    'binance_xlsx': 'exchange_parsers.binance_xlsx.BinanceXlsxParser',
+    'bitfinex': 'exchange_parsers.bitfinex.BitfinexParser',
+    'bittrex': 'exchange_parsers.bittrex.BittrexParser',
+    'circle': 'exchange_parsers.circle.CircleParser',
+    'coinbase': 'exchange_parsers.coinbase.CoinbaseParser',
+    'coinbase_pro': 'exchange_parsers.coinbase_pro.CoinbaseProParser',
+    'gemini': 'exchange_parsers.gemini.GeminiParser',
+    'kraken': 'exchange_parsers.kraken.KrakenParser',
+    'poloniex': 'exchange_parsers.poloniex.PoloniexParser',
+    'manual_trades': 'exchange_parsers.manual_trades.ManualTradesParser',
+})
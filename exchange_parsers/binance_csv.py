@@ -4,6 +4,9 @@ from document_parser import DocumentParser
 
 
 class BinanceCsvParser(DocumentParser):
+    vectorized = True
+    date_format = '%Y-%m-%d %H:%M:%S'
+
     def __init__(self, *args, **kwargs):
         kwargs['exchange_name'] = 'binance'
         kwargs['header'] = {
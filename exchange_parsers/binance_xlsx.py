@@ -1,11 +1,16 @@
 from decimal import Decimal
-from datetime import datetime
+from datetime import date, datetime
 from document_parser import DocumentParser
 
 
 class BinanceXlsxParser(DocumentParser):
     # WARNING: You must download your "Trade History" from Binance, **NOT** "Order History"  
     # Order History has a completely different formatting which will not work. 
+    vectorized = True
+    date_format = '%Y-%m-%d %H:%M:%S'
+    column_transforms = {'currency_pair': 'process_currency_pair'}
+    xlsx_dates = True
+
     def __init__(self, *args, **kwargs):
         kwargs['exchange_name'] = 'binance'
         kwargs['header'] = {
@@ -32,6 +37,8 @@ class BinanceXlsxParser(DocumentParser):
         _date = row['created_at']
         if isinstance(_date, str):
             return datetime.strptime(_date, '%Y-%m-%d %H:%M:%S')
+        if isinstance(_date, datetime):
+            return _date
         if isinstance(_date, date):
             return datetime(_date.year, _date.month, _date.day)
         else:
@@ -4,6 +4,10 @@ from document_parser import DocumentParser
 
 
 class KrakenParser(DocumentParser):
+    vectorized = True
+    date_format = '%Y-%m-%d %H:%M:%S.%f'
+    column_transforms = {'currency_pair': 'process_currency_pair'}
+
     def __init__(self, *args, **kwargs):
         kwargs['exchange_name'] = 'kraken'
         kwargs['header'] = {
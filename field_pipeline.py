@@ -0,0 +1,73 @@
+from datetime import datetime
+from errors import InvalidTradeException, NotATradeException, TradeTooSmallException
+from trade_record import Trade
+
+# Fields generated from the required fields, in the order they are generated. Later generators read the
+# fields generated before them (e.g. basis reads native_value).
+IMPLIED_FIELDS = (
+    'platform', 'currency', 'fill_currency', 'fill_type', 'native_value', 'native_currency', 'basis', 'fill_basis',
+)
+
+
+class FieldPipeline(object):
+    """
+      The per-row parse steps of a DocumentParser class, resolved once when the class is created (see ParserType).
+
+      The pipeline holds the class's map_row, process_row and generate_<field>_field functions (so overrides
+      in sub-classes, like ManualTradesParser.generate_platform_field, are kept), the isinstance checks of
+      its "required_fields", and its small trade rules. Calling it with a parser and a row runs every step
+      with no further attribute or name lookups and returns the Trade, raising the same exceptions as the
+      parser's validate_* methods. Rows made at or before the parser's "since" return None as soon as
+      process_row has read their date. run_batch() does the same for many rows.
+    """
+    def __init__(self, parser_class):
+        method = lambda name: getattr(parser_class, name).im_func
+        self.map_row = method('map_row')
+        self.process_row = method('process_row')
+        self.generators = tuple((_, method('generate_{}_field'.format(_))) for _ in IMPLIED_FIELDS)
+        self.checks = tuple(parser_class.required_fields.items())
+        self.threshold = parser_class.small_trade_threshold
+        self.small_trades = frozenset(parser_class.include_small_trades)
+
+    def __call__(self, parser, row):
+        trade = self.process_row(parser, self.map_row(parser, row))
+        if parser.since is not None and isinstance(trade['created_at'], datetime) and trade['created_at'] <= parser.since:
+            # Ingested by an earlier run (see Watermarks)
+            return None
+        if trade['type'] not in ('buy', 'sell'):
+            raise NotATradeException("Trade is not a buy or sell", trade)
+        for field, generate in self.generators:
+            trade[field] = generate(parser, trade)
+        for key, _type in self.checks:
+            if not isinstance(trade[key], _type):
+                raise TypeError("%s should be %s, got %s" % (key, _type, type(trade[key])))
+        if (trade['amount'] < self.threshold or trade['fill_amount'] < self.threshold) and \
+                trade['platform'] not in self.small_trades:
+            raise TradeTooSmallException("Trade amount is too low", trade)
+        return Trade.from_dict(trade, parser.extras)
+
+    def run_batch(self, parser, rows, trades=None, errors=None):
+        """
+          Parses every row, in order. Returns the Trades, and the InvalidTradeExceptions of the rows that
+          are not trades.
+        """
+        trades = [] if trades is None else trades
+        errors = [] if errors is None else errors
+        add_trade = trades.append
+        for row in rows:
+            try:
+                trade = self(parser, row)
+                if trade is not None:
+                    add_trade(trade)
+            except InvalidTradeException as exc:
+                errors.append(parser.compact_error(exc))
+        return trades, errors
+
+
+class ParserType(type):
+    """
+      Metaclass of DocumentParser. Compiles each parser class's FieldPipeline into its "pipeline" attribute.
+    """
+    def __init__(cls, name, bases, attrs):
+        super(ParserType, cls).__init__(name, bases, attrs)
+        cls.pipeline = FieldPipeline(cls)
@@ -0,0 +1,71 @@
+import numpy as np
+from decimal import Decimal
+from errors import FixedPointOverflowError
+
+INT64_MAX = np.iinfo(np.int64).max
+
+# USD values (profit and loss) are aggregated as int64 numbers of cents
+USD_PLACES = 2
+
+
+class UnitScale(object):
+    """
+      Exact int64 fixed-point units for the amounts of one currency, like satoshis for BTC: with "places"
+      decimal places, an amount is stored as the integer amount * 10 ** places.
+
+      for_amounts() picks the fewest places that hold every amount of the currency exactly, so converting
+      amounts to units and back never rounds. Amounts too large for int64 at that scale raise
+      FixedPointOverflowError instead of wrapping around.
+
+      Only amounts have a scale. Basis and USD values are Decimal quotients of the parsed values, which a fixed
+      scale cannot hold without changing results.
+    """
+    def __init__(self, currency, places):
+        self.currency = currency
+        self.places = places
+
+    def __repr__(self):
+        return 'UnitScale({!r}, {})'.format(self.currency, self.places)
+
+    @classmethod
+    def for_amounts(cls, currency, amounts):
+        places = 0
+        for amount in amounts:
+            places = max(places, -amount.as_tuple().exponent)
+        return cls(currency, places)
+
+    def to_units(self, amounts):
+        """
+          Returns amounts (Decimals) as an int64 array of units.
+        """
+        units = [int(_.scaleb(self.places)) for _ in amounts]
+        for amount, unit in zip(amounts, units):
+            if abs(unit) > INT64_MAX:
+                raise FixedPointOverflowError("{} amount {} does not fit in int64 with {} decimal places".format(
+                    self.currency, amount, self.places))
+        return np.array(units, dtype=np.int64)
+
+    def rescale(self, units, places):
+        """
+          Returns units, an amount in units of "places" decimal places, in the units of this scale. Scaling down is
+          exact as long as this scale holds the amount.
+        """
+        if places <= self.places:
+            return int(units) * 10 ** (self.places - places)
+        return int(units) // 10 ** (places - self.places)
+
+    def to_decimal(self, units):
+        return Decimal(int(units)).scaleb(-self.places)
+
+    def to_decimals(self, units):
+        return [self.to_decimal(_) for _ in units]
+
+
+def to_cents(values):
+    """
+      Returns USD values already rounded to cents (floats, NaN for none) as an int64 array of cents, 0 for NaN.
+    """
+    values = np.nan_to_num(np.asarray(values, dtype=float) * 10 ** USD_PLACES)
+    if len(values) and np.abs(values).max() >= INT64_MAX:
+        raise FixedPointOverflowError("USD value too large for int64 cents: {}".format(np.abs(values).max()))
+    return np.rint(values).astype(np.int64)
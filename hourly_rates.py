@@ -0,0 +1,143 @@
+import hashlib
+import os
+import numpy as np
+from decimal import Decimal
+
+EPOCH = np.datetime64('1970-01-01T00:00:00', 'us')
+
+
+def to_seconds(moments):
+    # Epoch seconds of naive UTC datetimes, as a float array
+    return (np.array(moments, dtype='datetime64[us]') - EPOCH).astype(np.int64) / 1e6
+
+
+class HourlyRateTable(object):
+    """
+      Intraday exchange rates from the hourly candles of the Coinbase Pro API (see CandleFetcher).
+
+      For each currency the table holds two arrays sorted by time: the middle of each candle in epoch
+      seconds, and the candle's midpoint price in USD ((open + close) / 2, as for the daily rates). get()
+      finds the candles on either side of a time by binary search, so a lookup is O(log n), and rates()
+      looks up a whole column of times with one np.searchsorted. With "interpolate" the price is
+      interpolated linearly between those two candles; otherwise the nearest one is used. A time further
+      than "max_gap" seconds from every candle has no rate, and callers fall back to the daily RateTable.
+
+      Rates are returned like RateTable rates: Decimal units of currency per USD, rounded to 15 places.
+
+      params
+      granularity : Candle length in seconds
+      interpolate : Interpolate between candles instead of taking the nearest one
+      max_gap     : Most seconds between a time and the nearest candle
+    """
+    def __init__(self, times=None, prices=None, granularity=3600, interpolate=True, max_gap=2 * 3600):
+        self.times = times or {}
+        self.prices = prices or {}
+        self.granularity = granularity
+        self.interpolate = interpolate
+        self.max_gap = max_gap
+
+    def __contains__(self, currency):
+        return currency in self.times
+
+    def __len__(self):
+        return sum(len(_) for _ in self.times.values())
+
+    def add_candles(self, currency, candles):
+        """
+          Merges [time, low, high, open, close, volume] candles into the currency's arrays. A candle
+          replaces a stored one of the same time.
+        """
+        if not candles:
+            return
+        new = np.array([[_[0] + self.granularity / 2., (_[3] + _[4]) / 2.] for _ in candles], dtype=float)
+        if currency in self.times:
+            # Stored candles first, so a stable sort and keeping the last of each time prefers new candles
+            new = np.concatenate([np.column_stack([self.times[currency], self.prices[currency]]), new])
+        new = new[new[:, 0].argsort(kind='mergesort')]
+        last = np.r_[new[1:, 0] != new[:-1, 0], True]
+        self.times[currency] = new[last, 0]
+        self.prices[currency] = new[last, 1]
+
+    def prices_at(self, currency, seconds):
+        """
+          Returns the USD prices of currency at each of the epoch seconds, NaN where there is no candle near.
+        """
+        seconds = np.asarray(seconds, dtype=float)
+        times = self.times.get(currency)
+        if times is None or not len(times):
+            return np.full(seconds.shape, np.nan)
+        prices = self.prices[currency]
+        after = np.searchsorted(times, seconds)
+        left = np.clip(after - 1, 0, len(times) - 1)
+        right = np.clip(after, 0, len(times) - 1)
+        t0, t1 = times[left], times[right]
+        if self.interpolate:
+            span = t1 - t0
+            weight = np.clip((seconds - t0) / np.where(span > 0, span, 1), 0, 1)
+            result = prices[left] + (prices[right] - prices[left]) * weight
+        else:
+            result = np.where(np.abs(t1 - seconds) < np.abs(seconds - t0), prices[right], prices[left])
+        result[np.minimum(np.abs(seconds - t0), np.abs(seconds - t1)) > self.max_gap] = np.nan
+        return result
+
+    def rates(self, currency, moments):
+        """
+          Returns the rate of currency at each datetime of moments, None where there is none.
+        """
+        if not len(moments):
+            return []
+        return [None if np.isnan(_) else self.to_rate(_) for _ in self.prices_at(currency, to_seconds(moments))]
+
+    def get(self, moment, currency):
+        """
+          Returns the Decimal rate of currency at moment (a datetime). Raises KeyError if there is none.
+        """
+        rate = self.rates(currency, [moment])[0]
+        if rate is None:
+            raise KeyError("No {} hourly exchange rate near {}".format(currency, moment))
+        return rate
+
+    def digest(self, first, last, currencies):
+        """
+          Returns a hash of the candles of currencies that rates between the first and last datetimes are looked up
+          from: those within max_gap of the range, and the nearest one on either side. Candles added outside of
+          it do not change the hash.
+        """
+        start, end = to_seconds([first, last])
+        digest = hashlib.sha1(repr((self.interpolate, self.max_gap)))
+        for currency in sorted(currencies):
+            digest.update(currency + '\0')
+            times = self.times.get(currency)
+            if times is None or not len(times):
+                continue
+            left = max(np.searchsorted(times, start - self.max_gap) - 1, 0)
+            right = np.searchsorted(times, end + self.max_gap, side='right') + 1
+            digest.update(np.ascontiguousarray(times[left:right]).tobytes())
+            digest.update(np.ascontiguousarray(self.prices[currency][left:right]).tobytes())
+        return digest.hexdigest()
+
+    def to_rate(self, price):
+        # Same rounding as ExchangeRates.calculate_exchange_rate
+        return Decimal(repr(round(1 / price, 15)))
+
+    @classmethod
+    def load(cls, filename):
+        """
+          Returns the table saved in filename, or an empty table if there is no such file.
+        """
+        if not os.path.exists(filename):
+            return cls()
+        with np.load(filename) as data:
+            currencies = set(_.rpartition('_')[0] for _ in data.files)
+            return cls(dict((_, data[_ + '_times']) for _ in currencies),
+                       dict((_, data[_ + '_prices']) for _ in currencies))
+
+    def save(self, filename):
+        arrays = {}
+        for currency in self.times:
+            arrays[currency + '_times'] = self.times[currency]
+            arrays[currency + '_prices'] = self.prices[currency]
+        tmp = filename + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.rename(tmp, filename)
@@ -0,0 +1,196 @@
+import cProfile
+import json
+import os
+import re
+import time
+import pandas as pd
+try:
+    import resource
+except ImportError:
+    # Not available on Windows, memory is then not recorded
+    resource = None
+
+
+def cpu_time():
+    # User and system time of this process and of its finished child processes (e.g. parsing pools)
+    return sum(os.times()[:4])
+
+
+def peak_memory_mb():
+    if resource is None:
+        return None
+    # ru_maxrss is in kilobytes on Linux (bytes on macOS)
+    return max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+               resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) / 1024.
+
+
+class Stage(object):
+    """
+      The measurements of one stage of a run.
+
+      name        : e.g. "rates.update", "parse:data/kraken/trades.csv", "lifo:BTC", "write:pnl"
+      depth       : Nesting level. Stages run inside another stage (a file inside "trades") have depth 1.
+      wall        : Wall time in seconds
+      cpu         : CPU time in seconds, including child processes which finished during the stage
+      rows        : Rows (trades, lots, lines) the stage handled, if it has a meaningful count
+      peak_memory : Peak resident memory of the process at the end of the stage, in MB
+      memory_increase : How much the stage raised the peak resident memory, in MB
+    """
+    fields = ['name', 'depth', 'wall', 'cpu', 'rows', 'rows_per_second', 'peak_memory', 'memory_increase']
+
+    def __init__(self, name, depth=0, wall=None, cpu=None, rows=None, peak_memory=None, memory_increase=None):
+        self.name = name
+        self.depth = depth
+        self.wall = wall
+        self.cpu = cpu
+        self.rows = rows
+        self.peak_memory = peak_memory
+        self.memory_increase = memory_increase
+
+    @property
+    def rows_per_second(self):
+        if self.rows is None or not self.wall:
+            return None
+        return self.rows / self.wall
+
+    def to_dict(self):
+        return dict((_, getattr(self, _)) for _ in self.fields)
+
+
+class Instrumentation(object):
+    """
+      Records the wall time, CPU time, throughput and peak memory of each stage of a tax run.
+
+      Code under measurement wraps each stage in a "with" block:
+
+        with instrumentation.stage('lifo:BTC') as stage:
+            ...
+            stage.rows = len(trades)
+
+      and the finished stages are kept, in the order they finished, in "stages". Taxes.run(report=True)
+      returns the Instrumentation as its report; see to_df() and print_report().
+
+      params
+      jsonl       : Path of a file to append one JSON line to per finished stage, as the run goes
+      profile_dir : Folder to dump a cProfile of every stage to (<name>.prof). Profiles are exclusive:
+                    while a nested stage runs, the profile of the stage around it is paused.
+    """
+    enabled = True
+
+    def __init__(self, jsonl=None, profile_dir=None):
+        self.jsonl = jsonl
+        self.profile_dir = profile_dir
+        self.stages = []
+        self.running = []
+
+    def stage(self, name, rows=None):
+        return StageTimer(self, Stage(name, len(self.running), rows=rows))
+
+    def add(self, name, wall, rows=None):
+        """
+          Records a stage measured elsewhere, e.g. a file parsed in a worker process, where only the
+          wall time is known.
+        """
+        self.finish(Stage(name, len(self.running), wall=wall, rows=rows))
+
+    def finish(self, stage):
+        self.stages.append(stage)
+        if self.jsonl:
+            with open(self.jsonl, 'a') as f:
+                f.write(json.dumps(stage.to_dict()) + '\n')
+
+    def dump_profile(self, stage, profile):
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        filename = re.sub(r'[^A-Za-z0-9_.-]+', '_', stage.name) + '.prof'
+        profile.dump_stats(os.path.join(self.profile_dir, filename))
+
+    def to_df(self):
+        return pd.DataFrame([_.to_dict() for _ in self.stages], columns=Stage.fields)
+
+    def print_report(self):
+        print "\n{n:<60} {w:>9} {c:>9} {r:>10} {t:>12} {m:>9}".format(
+            n='Stage', w='Wall (s)', c='CPU (s)', r='Rows', t='Rows / s', m='Peak MB')
+        for _ in self.stages:
+            print "{n:<60} {w:>9} {c:>9} {r:>10} {t:>12} {m:>9}".format(
+                n='  ' * _.depth + _.name,
+                w='{:.3f}'.format(_.wall) if _.wall is not None else '',
+                c='{:.3f}'.format(_.cpu) if _.cpu is not None else '',
+                r=_.rows if _.rows is not None else '',
+                t='{:.0f}'.format(_.rows_per_second) if _.rows_per_second is not None else '',
+                m='{:.0f}'.format(_.peak_memory) if _.peak_memory is not None else '',
+            )
+
+
+class StageTimer(object):
+    def __init__(self, instrumentation, stage):
+        self.instrumentation = instrumentation
+        self.stage = stage
+        self.profile = None
+
+    def __enter__(self):
+        running = self.instrumentation.running
+        if self.instrumentation.profile_dir:
+            if running and running[-1].profile:
+                running[-1].profile.disable()
+            self.profile = cProfile.Profile()
+        running.append(self)
+        self.memory = peak_memory_mb()
+        self.cpu = cpu_time()
+        self.start = time.time()
+        if self.profile:
+            self.profile.enable()
+        return self.stage
+
+    def __exit__(self, *exc):
+        if self.profile:
+            self.profile.disable()
+        stage = self.stage
+        stage.wall = time.time() - self.start
+        stage.cpu = cpu_time() - self.cpu
+        stage.peak_memory = peak_memory_mb()
+        if stage.peak_memory is not None:
+            stage.memory_increase = stage.peak_memory - self.memory
+
+        running = self.instrumentation.running
+        running.pop()
+        if self.profile:
+            self.instrumentation.dump_profile(stage, self.profile)
+            if running and running[-1].profile:
+                running[-1].profile.enable()
+        self.instrumentation.finish(stage)
+        return False
+
+
+class NullStage(object):
+    # Stands in for both the timer and the Stage when instrumentation is off: entering it does
+    # nothing, and setting "rows" on it is ignored.
+    rows = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+class NullInstrumentation(object):
+    """
+      The default, disabled instrumentation. stage() returns one shared no-op context manager, so
+      instrumented code costs a method call per stage when instrumentation is off.
+    """
+    enabled = False
+    stages = []
+    _stage = NullStage()
+
+    def stage(self, name, rows=None):
+        return self._stage
+
+    def add(self, name, wall, rows=None):
+        pass
+
+
+NULL_INSTRUMENTATION = NullInstrumentation()
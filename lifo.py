@@ -1,7 +1,11 @@
 import pandas as pd
 import numpy as np
-from decimal import Decimal
-from datetime import datetime, timedelta
+from datetime import datetime
+from lot_stack import LotStack, PnlColumns
+from lot_journal import LotJournal, Oversell
+from errors import OversellError
+from instrumentation import NULL_INSTRUMENTATION
+from fixed_point import UnitScale, to_cents
 
 
 class LIFO(object):
@@ -10,30 +14,67 @@ class LIFO(object):
       The run() function cycles through each currency and calculating LIFO for each trade.
 
       The aggregate_pnl() function takes a dataframe of individual
+
+      params
+      checkpoints     : A LotCheckpoints store. When given, each currency resumes from its latest valid year-end
+                        checkpoint instead of replaying its full history, and new year-end checkpoints are saved.
+      instrumentation : An Instrumentation to record a stage per currency ("lifo:<currency>")
+      fixed_point     : Hold lot amounts as exact integers instead of Decimals. Each currency's amounts are converted
+                        to units of the fewest decimal places that hold all of them exactly (see UnitScale, kept in
+                        "scales"), so the amount arithmetic of lot matching and balance checks is integer arithmetic,
+                        and the amounts are converted back to Decimal, with the pnl of each sell, once the currency is
+                        matched. aggregate_pnl() sums pnl as int64 cents. Results are equal to the Decimal path,
+                        and an amount too large for int64 raises FixedPointOverflowError.
+                        Only amounts are fixed-point: matching is still the same per-trade loop over Python ints,
+                        not int64 array operations, and parsing, basis, USD values and clean_data stay Decimal.
+      currencies      : Only match these currencies. Trades of other currencies are only read for their fills.
+      year            : Stop at the end of this year. Later trades are skipped, so the remaining funds are the lots
+                        held at the end of the year.
     """
-    def __init__(self):
-        pass
+    exact_columns = ['proceeds', 'cost']
+
+    def __init__(self, checkpoints=None, instrumentation=None, fixed_point=False, currencies=None, year=None):
+        self.checkpoints = checkpoints
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        self.fixed_point = fixed_point
+        self.currencies = set(currencies) if currencies else None
+        self.year = year
+        self.scales = {}
 
     def run(self, trades):
         print "Generating LIFO profit and loss"
-        pnl = pd.DataFrame()
-        remaining_funds = pd.DataFrame()
+        if self.year is not None:
+            trades = trades[trades['created_at'] < datetime(self.year + 1, 1, 1)]
+        pnl = []
+        remaining_funds = []
         for currency in trades.currency.unique():
+            if self.currencies is not None and currency not in self.currencies:
+                continue
             print "Calculating LIFO for {}".format(currency)
-            curr_trades = self.generate_currency_trades(trades, currency)
-            curr_pnl, curr_rf = self.calc_pnl(curr_trades)
-            pnl = self.append_currency_pnl_to_total_pnl(pnl, curr_pnl, currency)
-            remaining_funds = self.append_curr_rem_funds_to_rem_funds(remaining_funds, curr_rf, currency)
-        pnl = self.clean_data(pnl)
+            with self.instrumentation.stage('lifo:{}'.format(currency)) as stage:
+                curr_trades = self.generate_currency_trades(trades, currency)
+                stage.rows = len(curr_trades)
+                if self.checkpoints:
+                    # Digests of the Decimal amounts, which do not depend on the scale of the other trades
+                    digests = self.checkpoints.digests(curr_trades, 'units' if self.fixed_point else '')
+                if self.fixed_point:
+                    self.scales[currency] = UnitScale.for_amounts(currency, curr_trades['amount'])
+                    curr_trades['amount'] = self.scales[currency].to_units(curr_trades['amount'])
+                if self.checkpoints:
+                    curr_pnl, curr_rf = self.calc_pnl_incremental(curr_trades, currency, digests)
+                else:
+                    curr_pnl, curr_rf = self.calc_pnl(curr_trades)
+                curr_rf = curr_rf.to_df()
+                if self.fixed_point:
+                    curr_pnl, curr_rf = self.from_units(curr_pnl, curr_rf, self.scales[currency])
+            if not curr_pnl.empty:
+                pnl.append(self.add_currency_to_pnl(curr_pnl, currency))
+            if len(curr_rf):
+                remaining_funds.append(curr_rf)
+        pnl = self.clean_data(self.add_proceeds_and_cost(pd.concat(pnl)) if pnl else pd.DataFrame())
+        remaining_funds = pd.concat(remaining_funds, ignore_index=True) if remaining_funds else pd.DataFrame()
         return pnl, remaining_funds
 
-    def append_curr_rem_funds_to_rem_funds(self, remaining_funds, curr_rf, currency):
-        if not curr_rf:
-            return remaining_funds
-        for _ in curr_rf:
-            remaining_funds = remaining_funds.append(_, ignore_index=True)
-        return remaining_funds
-
     def generate_currency_trades(self, df, currency):
         native = df[df['currency'] == currency][[
             'created_at', 'platform', 'currency', 'currency_pair', 'type', 'amount', 'basis']].copy()
@@ -46,15 +87,29 @@ class LIFO(object):
         trades = native.append(fills)
         trades.reset_index(inplace=True)
         del trades['index']
-        trades.sort_values(by=['created_at'], ascending=True, inplace=True)
+        trades.sort_values(by=['created_at'], ascending=True, inplace=True, kind='mergesort')
         return trades
 
-    def append_currency_pnl_to_total_pnl(self, pnl, curr_pnl, currency):
-        if curr_pnl.empty:
-            return pnl
+    def from_units(self, pnl, remaining_funds, scale):
+        """
+          Converts the amounts of a currency's pnl and remaining funds dataframes from scale's units back to
+          Decimal, and calculates the pnl of each sell from them.
+        """
+        if not pnl.empty:
+            amounts = np.array(scale.to_decimals(pnl['amount']), dtype=object)
+            sells = (pnl['type'] == 'sell').values
+            values = pnl['pnl'].values.astype(object)
+            values[sells] = amounts[sells] * (pnl['sell_basis'].values[sells] - pnl['buy_basis'].values[sells])
+            pnl['amount'] = amounts
+            pnl['pnl'] = values
+        if len(remaining_funds):
+            remaining_funds['amount'] = scale.to_decimals(remaining_funds['amount'])
+        return pnl, remaining_funds
+
+    def add_currency_to_pnl(self, curr_pnl, currency):
         curr_pnl['year'] = curr_pnl['date'].apply(lambda _: _.year)
         curr_pnl['currency'] = currency
-        return pnl.append(curr_pnl)
+        return curr_pnl
 
     def aggregate_pnl(self, pnl):
         print "Calculating aggregate LIFO profit and loss"
@@ -62,7 +117,11 @@ class LIFO(object):
         for _ in pnl.year.unique():
             agg_pnl[_] = {}
 
-        grouped_pnl = pnl.groupby(['year', 'long_term']).pnl.sum().transpose()
+        if self.fixed_point:
+            cents = pd.Series(to_cents(pnl['pnl']), index=pnl.index)
+            grouped_pnl = cents.groupby([pnl['year'], pnl['long_term']]).sum() / 100.0
+        else:
+            grouped_pnl = pnl.groupby(['year', 'long_term']).pnl.sum().transpose()
         for _ in grouped_pnl.iteritems():
             if _[0][1]:
                 agg_pnl[_[0][0]]['long_term'] = round(_[1], 2)
@@ -72,48 +131,81 @@ class LIFO(object):
         aggregate_pnl = pd.DataFrame.from_dict(agg_pnl).transpose()
         return aggregate_pnl
 
-    def calc_pnl(self, df, log=False):
+    def calc_pnl(self, df, log=False, stack=None):
         """
           Takes a pandas dataframe of buys and sells and calculates the profit and loss
           from each trade based on LIFO.
 
-          Methodology: Populate a queue with buys and sells as they happen.
-          Buys are added to the queue, sells are deducted from the most recent buys
-          until the sell is exhausted. Any leftover amount is re-added to the queue.
+          Methodology: Populate a stack of lots with buys as they happen.
+          Buys are pushed onto the stack, sells are deducted from the most recent lots
+          until the sell is exhausted. A partially sold lot keeps its leftover amount in place.
+
+          Matching starts from stack (a LotStack) if given, otherwise from no lots.
+          Returns a dataframe of profit and loss rows and the LotStack of remaining lots.
         """
-        pnl = pd.DataFrame()
-        queue = []
-        for _ in df.iterrows():
-            row = _[1]
-            if row.type == 'buy':
-                queue.append(row)
-                pnl = self.add_buy_to_pnl(pnl, row)
-                self.print_statement(log, queue, row, sell_amount=None, buy_amount=row['amount'])
-            elif row.type == 'sell':
-                sell_basis = row['basis']
-                sell_amount = row['amount']
-                self.print_statement(log, queue, row, sell_amount=sell_amount, buy_amount=None)
-                self.validate_sell(sell_amount, queue, row, df, log)
-
-                while True:
-                    buy = queue.pop()
-                    bd = self.buy_details(buy)
-
-                    amount = sell_amount if ((bd['buy_amount'] - sell_amount) >= 0) else bd['buy_amount']
-                    pnl = self.add_sell_to_pnl(pnl, row, bd, amount, sell_basis)
-
-                    leftover = bd['buy_amount'] - sell_amount
-                    if leftover > 0:
-                        self.add_leftover_sell_to_queue(queue, bd, leftover)
-                        break
-                    elif leftover == 0:
-                        break
-                    elif leftover < 0:
-                        sell_amount = abs(leftover)
-                        pass
-
-        remaining_funds = queue
-        return pnl, remaining_funds
+        if stack is None:
+            stack = LotStack(df['currency'].iloc[0] if len(df) else None)
+        pnl = PnlColumns(units=stack.currency in self.scales)
+        journal = LotJournal(stack.currency, stack.balance(), self.scales.get(stack.currency))
+        self.match_lots(df, stack, pnl, journal, log)
+        return pnl.to_df(), stack
+
+    def calc_pnl_incremental(self, df, currency, digests):
+        """
+          Same result as calc_pnl, but resumes from the latest valid year-end checkpoint and only matches
+          the trades made after it. digests are the year digests of df's trades (see LotCheckpoints.digests).
+          A checkpoint is saved at the end of every year that is matched. With a year set, the checkpoints of
+          later years are left as they are.
+        """
+        scale = self.scales.get(currency)
+        year, pnl, stack = self.checkpoints.resume(currency, digests, until=self.year, scale=scale)
+        journal = LotJournal(currency, stack.balance(), scale)
+        years = df['created_at'].dt.year
+        remaining = years > year
+        for _year, year_df in df[remaining].groupby(years[remaining], sort=True):
+            year_pnl = PnlColumns(units=scale is not None)
+            self.match_lots(year_df, stack, year_pnl, journal)
+            pnl.extend(year_pnl)
+            self.checkpoints.add(currency, _year, digests[_year], year_pnl, stack, scale)
+        self.checkpoints.save(currency)
+        return pnl.to_df(), stack
+
+    def match_lots(self, df, stack, pnl, journal, log=False):
+        """
+          Matches the trades in df against the lots in stack, adding profit and loss rows to pnl and
+          each trade with the balance after it to journal (a LotJournal).
+        """
+        rows = zip(df.index, df['created_at'], df['type'], df['amount'].tolist(), df['basis'],
+                   df['platform'], df['currency'], df['currency_pair'])
+        for index, created_at, _type, amount, basis, platform, currency, currency_pair in rows:
+            if _type == 'buy':
+                stack.push(amount, basis, created_at, platform, currency_pair)
+                pnl.add_buy(created_at, currency, currency_pair, platform, amount, basis)
+                self.print_statement(log, stack, created_at, platform, sell_amount=None, buy_amount=amount)
+            elif _type == 'sell':
+                self.print_statement(log, stack, created_at, platform, sell_amount=amount, buy_amount=None)
+                self.validate_sell(amount, stack, index, df, journal)
+
+                for lot_amount, buy_basis, buy_date, buy_platform in stack.consume(amount):
+                    pnl.add_sell(created_at, currency, currency_pair, platform, lot_amount, basis,
+                                 buy_date, buy_basis, buy_platform)
+            else:
+                continue
+            journal.add(created_at, _type, amount, stack.balance(), platform)
+
+    def add_proceeds_and_cost(self, pnl):
+        """
+          Adds the "proceeds" (amount * sell_basis) and "cost" (amount * buy_basis) of each sell, calculated
+          before clean_data rounds the basis columns to cents, so they stay exact for coins worth less than a cent.
+          They are only kept in memory for Form 8949: Taxes leaves these exact_columns out of the files it saves.
+        """
+        sells = (pnl['type'] == 'sell').values
+        amounts = pnl['amount'].values
+        for column, basis in [('proceeds', 'sell_basis'), ('cost', 'buy_basis')]:
+            values = np.full(len(pnl), np.NaN, dtype=object)
+            values[sells] = amounts[sells] * pnl[basis].values[sells]
+            pnl[column] = values
+        return pnl
 
     def clean_data(self, pnl):
         pnl['long_term'] = pnl['long_term'].apply(lambda _: bool(_) if not np.isnan(_) else np.NaN)
@@ -121,116 +213,38 @@ class LIFO(object):
             pnl[_] = pnl[_].apply(lambda _: round(_, 2))
         return pnl
 
-    def buy_details(self, buy):
-        return {
-            'buy_basis': buy['basis'],
-            'buy_amount': buy['amount'],
-            'buy_date': buy['created_at'],
-            'buy_platform': buy['platform'],
-            'buy_currency': buy['currency'],
-            'buy_currency_pair': buy['currency_pair'],
-        }
-
-    def add_buy_to_pnl(self, df, row):
-        return df.append(
-            {
-                'date': row['created_at'],
-                'currency': row['currency'],
-                'currency_pair': row['currency_pair'],
-                'buy_date': row['created_at'],
-                'sell_date': np.NaN,
-                'time_diff': np.NaN,
-                'long_term': np.NaN,
-                'buy_platform': row['platform'],
-                'sell_platform': np.NaN,
-                'amount': row['amount'],
-                'type': 'buy',
-                'buy_basis': row['basis'],
-                'sell_basis': np.NaN,
-                'pnl': np.NaN,
-            }, ignore_index=True
-        )
-
-    def add_sell_to_pnl(self, df, row, bd, amount, sell_basis):
-        return df.append(
-            {
-                'date': row['created_at'],
-                'currency': row['currency'],
-                'currency_pair': row['currency_pair'],
-                'buy_date': bd['buy_date'],
-                'sell_date': row['created_at'],
-                'time_diff': row['created_at'] - bd['buy_date'],
-                'long_term': bool((row['created_at'] - bd['buy_date']) >= timedelta(365)),
-                'buy_platform': bd['buy_platform'],
-                'sell_platform': row['platform'],
-                'amount': amount,
-                'type': 'sell',
-                'buy_basis': bd['buy_basis'],
-                'sell_basis': sell_basis,
-                'pnl': amount * (sell_basis - bd['buy_basis']),
-            }, ignore_index=True
-        )
+    def validate_sell(self, sell_amount, stack, index, df, journal):
+        balance = stack.balance()
+        if sell_amount > balance:
+            self.assertion_error_print_statement(Oversell(journal, df.loc[index], sell_amount, balance))
 
-
-    def add_leftover_sell_to_queue(self, queue, bd, leftover):
-        queue.append(pd.Series(
-            {
-                'created_at': bd['buy_date'],
-                'type': 'buy',
-                'amount': leftover,
-                'basis': bd['buy_basis'],
-                'platform': bd['buy_platform'],
-                'currency': bd['buy_currency'],
-                'currency_pair': bd['buy_currency_pair'],
-            }
-        ))
-
-    def validate_sell(self, sell_amount, queue, row, df, log):
-        try:
-            assert sell_amount <= sum([_.amount for _ in queue])
-        except AssertionError as exc:
-            self.assertion_error_print_statement(sell_amount, queue, row, df, log)
-
-    def assertion_error_print_statement(self, sell_amount, queue, row, df, log):
+    def assertion_error_print_statement(self, oversell):
         """
           If a list of trades ends up attempting to sell more than they have purchased (based on
-          LIFO), this function is called to explicitly explain what happened.
+          LIFO), this function is called to explicitly explain what happened, then raises OversellError.
 
           It is expected that people forget about some trades they have made, or some other ways they have
-          obtained crypto. These errors can be hard to debug, so this function runs through the whole
-          LIFO calculation, calling out the available balance after each trade. This will help the user
-          understand what happened and remember which trades are missing.
+          obtained crypto. These errors can be hard to debug, so the explanation calls out the available
+          balance after each earlier trade of the currency, read from the journal recorded while matching.
+          This will help the user understand what happened and remember which trades are missing.
+
+          The same details are available as structured data on the raised error's "oversell" attribute.
 
           Params:
-          log            : A flag toggling print statements. When true, the log of each trade will be printed.
-                           This is only toggled after this function is called (and an AssertionError has been hit)
-          sell_amount    : The specific amount being sold
-          row            : specific trade data which caused the AssertionError
-          df             : A pandas dataframe of all trades of a specific cryptocurrency
-          queue          : The queue which is populated as part of the LIFO profit and loss calculation
+          oversell       : An Oversell with the trade which oversold and the journal of trades before it
         """
-        if log:
-            raise AssertionError("You are trying to sell more than you have purchased. See above for details")
-        balance = sum([_.amount for _ in queue])
-        print "You are trying to sell more %s than you have purchased" % row['currency']
-        print "Error occured when trying to sell {s} {c}, when you have {a} available to sell".format(
-          s=round(sell_amount, 2),
-          c=row['currency'],
-          a=round(balance, 2) if balance else 0,
-        )
-        print "You must be missing some trade or gift that resulted in more %s\n" % row['currency']
-        print "This is the trade that caused the error: \n%s\n" % row
-        print "Re-creating the history of buys and sells..."
-        self.calc_pnl(df, log=True)
+        for line in oversell.report():
+            print line
+        raise OversellError("You are trying to sell more than you have purchased. See above for details", oversell)
 
-    def print_statement(self, log, queue, row, sell_amount, buy_amount):
+    def print_statement(self, log, stack, created_at, platform, sell_amount, buy_amount):
         if not log:
             return
-        balance = sum([_.amount for _ in queue])
+        balance = stack.balance()
         print "Date {d} selling: {s:<10} purchasing: {p:<10} balance: {b:<10} platform: {e}".format(
-            d=row['created_at'],
+            d=created_at,
             s=round(sell_amount, 2) if sell_amount else '',
             p=round(buy_amount, 2) if buy_amount else '',
             b=round(balance, 2) if balance else '',
-            e=row['platform']
+            e=platform
         )
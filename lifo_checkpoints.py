@@ -0,0 +1,150 @@
+import cPickle
+import hashlib
+import json
+import os
+import numpy as np
+import pandas as pd
+from collections import OrderedDict
+from lot_stack import LotStack, PnlColumns
+from errors import FrozenYearChangedError
+
+
+class LotCheckpoints(object):
+    """
+      Year-end snapshots of the LIFO state of each currency, so LIFO only replays the trades made after
+      the latest year whose history has not changed.
+
+      For each currency and each year with trades, a checkpoint holds:
+      digest : A hash chained over every trade of the currency up to the end of that year
+      pnl    : The PnlColumns rows produced by the trades of that year
+      stack  : The LotStack of open lots at the end of that year
+      scale  : The UnitScale the amounts of pnl and stack are in when matched in fixed-point (see LIFO), or None.
+               Digests are of the Decimal amounts, so a later trade with more decimal places does not change
+               them; the amounts of a checkpoint are converted to the current scale when it is resumed.
+
+      A checkpoint is valid while its digest matches the digest of the current trades. Adding, removing
+      or editing a trade changes the digest of its year and of every later year, so those checkpoints
+      are dropped and recomputed.
+
+      Frozen years are tax years that have already been filed. If the trades of a frozen year (or of any
+      year before it) change, FrozenYearChangedError is raised rather than silently changing a filed
+      year. Unfreeze the year to accept the new numbers.
+    """
+    hash_columns = ['created_at', 'type', 'amount', 'basis', 'platform', 'currency_pair']
+
+    def __init__(self, path=os.path.join('cache', 'lifo')):
+        self.path = path
+        self.stored = {}
+
+    def digests(self, df, salt=''):
+        """
+          Returns an OrderedDict of year -> chained digest for a dataframe of one currency's trades. salt starts
+          the chain, so checkpoints of trades matched in different ways (e.g. fixed-point units) never mix.
+        """
+        hashes = pd.util.hash_pandas_object(df[self.hash_columns].astype(str), index=False).values
+        years = df['created_at'].dt.year.values
+        digests = OrderedDict()
+        digest = salt
+        for year in np.unique(years):
+            digest = hashlib.sha1(digest + str(year) + hashes[years == year].tobytes()).hexdigest()
+            digests[int(year)] = digest
+        return digests
+
+    def resume(self, currency, digests, until=None, scale=None):
+        """
+          Returns (year, pnl, stack) for the latest valid checkpoint of currency: the PnlColumns of every
+          year up to and including "year", and the LotStack at the end of it. Without a valid checkpoint
+          year is 0, and pnl and stack are empty. Stale checkpoints are discarded.
+
+          until is the last year digests were computed for, when trades after it were left out (e.g. a
+          single tax year run). Checkpoints of later years cannot be checked then: they are kept, and saved
+          again untouched, as long as every checkpoint up to until is still valid.
+
+          With scale, the amounts of the resumed checkpoints are converted to it.
+        """
+        stored = self.load(currency)
+        year = 0
+        for _year, digest in digests.items():
+            if _year not in stored or stored[_year][0] != digest:
+                break
+            year = _year
+
+        checked = [_ for _ in stored if until is None or _ <= until]
+        keep_later = until is not None and year == max(digests.keys() or [0]) and \
+            sorted(checked) == list(digests.keys())
+
+        for frozen in self.frozen():
+            if frozen in stored and frozen > year and (not keep_later or frozen <= until):
+                raise FrozenYearChangedError(
+                    "Trades of {c} in or before frozen year {y} have changed. Unfreeze {y} to recompute it".format(
+                        c=currency, y=frozen))
+
+        for _year in stored.keys():
+            if _year > year and not (keep_later and _year > until):
+                del stored[_year]
+        self.stored[currency] = stored
+
+        pnl = PnlColumns(units=scale is not None)
+        for _year in sorted(stored):
+            if _year <= year:
+                stored[_year] = self.rescale(stored[_year], scale)
+                pnl.extend(stored[_year][1])
+        stack = stored[year][2].copy() if year else LotStack(currency)
+        return year, pnl, stack
+
+    def rescale(self, checkpoint, scale):
+        # The checkpoint with its amounts converted from the scale they were saved in to scale
+        digest, pnl, stack, saved = checkpoint
+        if scale is None or saved.places == scale.places:
+            return checkpoint
+        rescaled = PnlColumns(units=True)
+        rescaled.extend(pnl)
+        rescaled.data['amount'] = [scale.rescale(_, saved.places) for _ in pnl.data['amount']]
+        stack = stack.copy()
+        stack.amounts = [scale.rescale(_, saved.places) for _ in stack.amounts]
+        stack.total = scale.rescale(stack.total, saved.places)
+        return digest, rescaled, stack, scale
+
+    def add(self, currency, year, digest, pnl, stack, scale=None):
+        self.stored[currency][year] = (digest, pnl, stack.copy(), scale)
+
+    def filename(self, currency):
+        return os.path.join(self.path, '{}.pkl'.format(currency))
+
+    def load(self, currency):
+        try:
+            with open(self.filename(currency), 'rb') as f:
+                stored = cPickle.load(f)
+        except IOError:
+            return {}
+        # Checkpoints saved without a scale are Decimal ones, or fixed-point ones whose digests were of the units
+        # and cannot be checked any more
+        return dict((year, _ if len(_) == 4 else _ + (None,)) for year, _ in stored.items()
+                    if len(_) == 4 or not _[1].units)
+
+    def save(self, currency):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        filename = self.filename(currency)
+        with open(filename + '.tmp', 'wb') as f:
+            cPickle.dump(self.stored[currency], f, cPickle.HIGHEST_PROTOCOL)
+        os.rename(filename + '.tmp', filename)
+
+    def frozen(self):
+        try:
+            with open(os.path.join(self.path, 'frozen_years.json'), 'r') as f:
+                return set(json.load(f))
+        except IOError:
+            return set()
+
+    def freeze(self, year):
+        self.write_frozen(self.frozen() | set([year]))
+
+    def unfreeze(self, year):
+        self.write_frozen(self.frozen() - set([year]))
+
+    def write_frozen(self, years):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        with open(os.path.join(self.path, 'frozen_years.json'), 'w') as f:
+            json.dump(sorted(years), f)
@@ -0,0 +1,107 @@
+import pandas as pd
+
+
+class LotJournal(object):
+    """
+      A compact journal of the buys and sells matched for a single currency, recorded while LIFO runs.
+
+      Each event is a position in the parallel lists below: date, type, amount, platform and the balance
+      held after the trade. opening_balance is the balance the matching started from (non-zero when LIFO
+      resumes from a checkpoint). The journal is what an Oversell diagnostic is built from, so explaining
+      a missing trade does not require matching the currency's trades a second time.
+
+      When LIFO runs in fixed-point mode, amounts and balances are recorded as int64 units, and "scale"
+      (a UnitScale) converts them back to Decimal in to_df() and in an Oversell.
+    """
+    columns = ['created_at', 'type', 'amount', 'balance', 'platform']
+
+    def __init__(self, currency, opening_balance=0, scale=None):
+        self.currency = currency
+        self.opening_balance = opening_balance
+        self.scale = scale
+        self.dates = []
+        self.types = []
+        self.amounts = []
+        self.balances = []
+        self.platforms = []
+
+    def __len__(self):
+        return len(self.dates)
+
+    def add(self, created_at, _type, amount, balance, platform):
+        self.dates.append(created_at)
+        self.types.append(_type)
+        self.amounts.append(amount)
+        self.balances.append(balance)
+        self.platforms.append(platform)
+
+    def to_df(self):
+        convert = self.scale.to_decimals if self.scale else list
+        return pd.DataFrame({
+            'created_at': self.dates,
+            'type': self.types,
+            'amount': convert(self.amounts),
+            'balance': convert(self.balances),
+            'platform': self.platforms,
+        }, columns=self.columns)
+
+
+class Oversell(object):
+    """
+      Structured details of a sell of more than the available balance, which almost always means a
+      buy, deposit or gift is missing from the trades.
+
+      params
+      currency    : The currency being oversold
+      created_at  : Date of the sell
+      platform    : Platform of the sell
+      sell_amount : Amount the trade tried to sell
+      available   : Balance held just before the sell
+      shortfall   : sell_amount - available, the amount that is missing
+      trade       : The row of the trade which caused the oversell
+      history     : The journal of buys and sells up to the oversell, as a dataframe (see LotJournal)
+    """
+    def __init__(self, journal, trade, sell_amount, available):
+        opening_balance = journal.opening_balance
+        if journal.scale:
+            sell_amount, available, opening_balance = journal.scale.to_decimals([sell_amount, available, opening_balance])
+            trade = trade.copy()
+            trade['amount'] = sell_amount
+        self.currency = journal.currency
+        self.created_at = trade['created_at']
+        self.platform = trade['platform']
+        self.sell_amount = sell_amount
+        self.available = available
+        self.shortfall = sell_amount - available
+        self.trade = trade
+        self.opening_balance = opening_balance
+        self.history = journal.to_df()
+
+    def report(self):
+        """
+          Returns the printable explanation of the oversell, with the balance after each earlier trade.
+        """
+        lines = [
+            "You are trying to sell more %s than you have purchased" % self.currency,
+            "Error occured when trying to sell {s} {c}, when you have {a} available to sell".format(
+                s=round(self.sell_amount, 2),
+                c=self.currency,
+                a=round(self.available, 2) if self.available else 0,
+            ),
+            "You must be missing some trade or gift that resulted in more %s\n" % self.currency,
+            "This is the trade that caused the error: \n%s\n" % self.trade,
+            "History of buys and sells up to the error:",
+        ]
+        if self.opening_balance:
+            lines.append("Opening balance carried from checkpoint: {}".format(round(self.opening_balance, 2)))
+        for created_at, _type, amount, balance, platform in zip(
+                self.history['created_at'], self.history['type'], self.history['amount'],
+                self.history['balance'], self.history['platform']):
+            lines.append("Date {d} selling: {s:<10} purchasing: {p:<10} balance: {b:<10} platform: {e}".format(
+                d=created_at,
+                s=round(amount, 2) if _type == 'sell' else '',
+                p=round(amount, 2) if _type == 'buy' else '',
+                b=round(balance, 2) if balance else '',
+                e=platform,
+            ))
+        return lines
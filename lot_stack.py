@@ -0,0 +1,181 @@
+import pandas as pd
+import numpy as np
+from datetime import timedelta
+
+
+class LotStack(object):
+    """
+      A LIFO stack of open lots for a single currency, stored as parallel arrays.
+
+      Each lot is a position in the arrays below: amounts, basis, dates, platform ids and currency
+      pairs. Buys push a new lot onto the end of the arrays, sells consume lots from the end. A
+      partially consumed lot is reduced in place instead of being popped and re-created.
+
+      Platforms are interned into the "platforms" list and each lot only stores the index into it.
+      The total amount held across all lots is kept as a running balance, so checking a sell
+      against holdings does not walk the stack.
+    """
+    columns = ['amount', 'basis', 'created_at', 'currency', 'currency_pair', 'platform', 'type']
+
+    def __init__(self, currency):
+        self.currency = currency
+        self.amounts = []
+        self.basis = []
+        self.dates = []
+        self.platform_ids = []
+        self.pairs = []
+        self.platforms = []
+        self._platform_index = {}
+        self.total = 0
+
+    def __len__(self):
+        return len(self.amounts)
+
+    def copy(self):
+        stack = LotStack(self.currency)
+        stack.amounts = list(self.amounts)
+        stack.basis = list(self.basis)
+        stack.dates = list(self.dates)
+        stack.platform_ids = list(self.platform_ids)
+        stack.pairs = list(self.pairs)
+        stack.platforms = list(self.platforms)
+        stack._platform_index = dict(self._platform_index)
+        stack.total = self.total
+        return stack
+
+    def platform_id(self, platform):
+        if platform != platform:
+            # Fills carry no platform, so theirs is NaN, which never equals itself as a dict key
+            platform = np.NaN
+        if platform not in self._platform_index:
+            self._platform_index[platform] = len(self.platforms)
+            self.platforms.append(platform)
+        return self._platform_index[platform]
+
+    def push(self, amount, basis, date, platform, pair):
+        self.amounts.append(amount)
+        self.basis.append(basis)
+        self.dates.append(date)
+        self.platform_ids.append(self.platform_id(platform))
+        self.pairs.append(pair)
+        self.total += amount
+
+    def pop(self):
+        self.basis.pop()
+        self.dates.pop()
+        self.platform_ids.pop()
+        self.pairs.pop()
+        amount = self.amounts.pop()
+        self.total -= amount
+        return amount
+
+    def balance(self):
+        return self.total
+
+    def consume(self, sell_amount):
+        """
+          Deducts sell_amount from the most recent lots, yielding (amount, basis, date, platform)
+          for each lot touched. The last lot touched is reduced in place if it is not fully consumed.
+        """
+        while True:
+            i = len(self.amounts) - 1
+            buy_amount = self.amounts[i]
+            amount = sell_amount if ((buy_amount - sell_amount) >= 0) else buy_amount
+            yield amount, self.basis[i], self.dates[i], self.platforms[self.platform_ids[i]]
+
+            leftover = buy_amount - sell_amount
+            if leftover > 0:
+                self.amounts[i] = leftover
+                self.total -= amount
+                break
+            self.pop()
+            if leftover == 0:
+                break
+            sell_amount = abs(leftover)
+
+    def to_df(self):
+        if not self.amounts:
+            return pd.DataFrame()
+        return pd.DataFrame({
+            'amount': self.amounts,
+            'basis': self.basis,
+            'created_at': self.dates,
+            'currency': self.currency,
+            'currency_pair': self.pairs,
+            'platform': [self.platforms[_] for _ in self.platform_ids],
+            'type': 'buy',
+        }, columns=self.columns)
+
+
+class PnlColumns(object):
+    """
+      Column buffers for the LIFO profit and loss rows of a single currency.
+
+      Rows are appended to plain lists, one list per column, and turned into a single DataFrame
+      once all trades have been matched.
+
+      With units set, amounts are int64 fixed-point units (see fixed_point.UnitScale) and the pnl of sells
+      is left as NaN, to be calculated once the amounts are converted back to Decimal.
+    """
+    columns = [
+        'amount', 'buy_basis', 'buy_date', 'buy_platform', 'currency', 'currency_pair', 'date',
+        'long_term', 'pnl', 'sell_basis', 'sell_date', 'sell_platform', 'time_diff', 'type',
+    ]
+
+    def __init__(self, units=False):
+        self.units = units
+        self.data = dict((_, []) for _ in self.columns)
+
+    def __len__(self):
+        return len(self.data['type'])
+
+    def add_buy(self, created_at, currency, currency_pair, platform, amount, basis):
+        self.add_row(
+            date=created_at,
+            currency=currency,
+            currency_pair=currency_pair,
+            buy_date=created_at,
+            sell_date=np.NaN,
+            time_diff=np.NaN,
+            long_term=np.NaN,
+            buy_platform=platform,
+            sell_platform=np.NaN,
+            amount=amount,
+            type='buy',
+            buy_basis=basis,
+            sell_basis=np.NaN,
+            pnl=np.NaN,
+        )
+
+    def add_sell(self, created_at, currency, currency_pair, platform, amount, sell_basis,
+                 buy_date, buy_basis, buy_platform):
+        time_diff = created_at - buy_date
+        self.add_row(
+            date=created_at,
+            currency=currency,
+            currency_pair=currency_pair,
+            buy_date=buy_date,
+            sell_date=created_at,
+            time_diff=time_diff,
+            long_term=bool(time_diff >= timedelta(365)),
+            buy_platform=buy_platform,
+            sell_platform=platform,
+            amount=amount,
+            type='sell',
+            buy_basis=buy_basis,
+            sell_basis=sell_basis,
+            pnl=np.NaN if self.units else amount * (sell_basis - buy_basis),
+        )
+
+    def extend(self, other):
+        for key in self.columns:
+            self.data[key].extend(other.data[key])
+
+    def add_row(self, **row):
+        for key, value in row.items():
+            self.data[key].append(value)
+
+    def to_df(self):
+        if not len(self):
+            return pd.DataFrame()
+        return pd.DataFrame(self.data, columns=self.columns)
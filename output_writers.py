@@ -0,0 +1,180 @@
+import csv
+import json
+import os
+import numpy as np
+import pandas as pd
+from decimal import Decimal
+from multiprocessing import Process
+
+
+class OutputWriter(object):
+    """
+      Writes a result dataframe to a file in one format. Sub-classes set the file "extension" and
+      implement write(). Taxes picks writers by name from the "writers" mapping below, or takes
+      OutputWriter instances directly, so other formats can be plugged in.
+    """
+    extension = None
+
+    def path(self, directory, name):
+        return os.path.join(directory, name + self.extension)
+
+    def write(self, df, path):
+        raise NotImplementedError()
+
+
+class CsvWriter(OutputWriter):
+    extension = '.csv'
+
+    def write(self, df, path):
+        df.to_csv(path)
+
+
+class GzipCsvWriter(OutputWriter):
+    extension = '.csv.gz'
+
+    def write(self, df, path):
+        df.to_csv(path, compression='gzip')
+
+
+class ColumnarWriter(OutputWriter):
+    """
+      A compressed numpy archive with one array per column, plus the index. Reading a column back
+      does not parse the others, and nothing is formatted as text except Decimal values, which are kept
+      as their exact string form. "__schema__" records the name and kind of each column, so
+      read_columnar() restores Decimals, dates, categories and missing values.
+    """
+    extension = '.npz'
+
+    def write(self, df, path):
+        arrays = {}
+        schema = []
+        columns = [('__index__', pd.Series(df.index))] + [(_, df[_]) for _ in df.columns]
+        for i, (name, series) in enumerate(columns):
+            kind, values, nulls = self.encode(series)
+            arrays['c{}'.format(i)] = values
+            if nulls is not None:
+                arrays['n{}'.format(i)] = nulls
+            schema.append([str(name), kind])
+        arrays['__schema__'] = np.array(json.dumps(schema))
+        with open(path, 'wb') as f:
+            np.savez_compressed(f, **arrays)
+
+    def encode(self, series):
+        dtype = series.dtype
+        categorical = pd.api.types.is_categorical_dtype(dtype)
+        if categorical:
+            series = series.astype(object)
+            dtype = series.dtype
+        if dtype != object:
+            if np.issubdtype(dtype, np.datetime64):
+                return 'datetime', series.values.astype('datetime64[ns]'), None
+            if np.issubdtype(dtype, np.timedelta64):
+                return 'timedelta', series.values.astype('timedelta64[ns]'), None
+            return 'numeric', series.values, None
+
+        values = series.values
+        nulls = pd.isnull(values)
+        present = values[~nulls]
+        if categorical:
+            kind = 'category'
+        elif len(present) and all(isinstance(_, Decimal) for _ in present):
+            kind = 'decimal'
+        elif len(present) and all(isinstance(_, bool) for _ in present):
+            kind = 'bool'
+        else:
+            kind = 'string'
+        strings = np.array(['' if null else str(_) for _, null in zip(values, nulls)], dtype=str)
+        return kind, strings, nulls
+
+
+def read_columnar(path):
+    """
+      Reads a file written by ColumnarWriter back into a dataframe.
+    """
+    archive = np.load(path)
+    schema = json.loads(str(archive['__schema__']))
+    columns = []
+    for i, (name, kind) in enumerate(schema):
+        values = archive['c{}'.format(i)]
+        nulls_key = 'n{}'.format(i)
+        if kind in ('decimal', 'bool', 'string', 'category'):
+            nulls = archive[nulls_key]
+            convert = {'decimal': Decimal, 'bool': lambda _: _ == 'True'}.get(kind, str)
+            values = np.array([np.NaN if null else convert(_) for _, null in zip(values, nulls)], dtype=object)
+            if kind == 'category':
+                values = pd.Categorical(values)
+        columns.append((name, values))
+    index = columns[0][1]
+    return pd.DataFrame(dict(columns[1:]), index=index, columns=[_[0] for _ in columns[1:]])
+
+
+class Form8949Writer(OutputWriter):
+    """
+      Writes tax_reporting_data as Form 8949 style rows: description, dates acquired and sold,
+      proceeds, cost basis, gain or loss, and whether the gain is short or long term.
+
+      Rows are formatted and written chunk_size at a time, so no formatted copy of the whole frame
+      is ever held. The cost is the unrounded "cost" column rounded to cents and the gain is the "pnl"
+      column, so gains match the pnl report. Proceeds are their sum, so each row adds up as the form
+      requires, within a cent of the unrounded "proceeds".
+    """
+    extension = '.csv'
+    columns = ['Description of property', 'Date acquired', 'Date sold', 'Proceeds', 'Cost basis',
+               'Gain or (loss)', 'Term']
+
+    def __init__(self, chunk_size=10000):
+        self.chunk_size = chunk_size
+
+    def write(self, df, path):
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.columns)
+            for start in range(0, len(df), self.chunk_size):
+                writer.writerows(self.rows(df.iloc[start:start + self.chunk_size]))
+
+    def rows(self, chunk):
+        for currency, amount, buy_date, sell_date, cost, pnl, long_term in zip(
+                chunk['currency'], chunk['amount'], chunk['buy_date'], chunk['sell_date'],
+                chunk['cost'], chunk['pnl'], chunk['long_term']):
+            cost = round(float(cost), 2)
+            gain = round(float(pnl), 2)
+            yield [
+                '{} {}'.format(amount, currency),
+                buy_date.strftime('%m/%d/%Y'),
+                sell_date.strftime('%m/%d/%Y'),
+                '{:.2f}'.format(cost + gain),
+                '{:.2f}'.format(cost),
+                '{:.2f}'.format(gain),
+                'Long-term' if long_term else 'Short-term',
+            ]
+
+
+writers = {
+    'csv': CsvWriter,
+    'csv.gz': GzipCsvWriter,
+    'columnar': ColumnarWriter,
+}
+
+
+def get_writer(writer):
+    return writers[writer]() if isinstance(writer, basestring) else writer
+
+
+def write_concurrently(jobs, workers):
+    """
+      Runs (writer, df, path) jobs on up to "workers" processes at a time. Formatting output is CPU bound
+      Python code, so processes rather than threads. On platforms with fork, children share the parent's
+      frames instead of receiving pickled copies.
+    """
+    pending = list(jobs)
+    running = []
+    while pending or running:
+        while pending and len(running) < workers:
+            writer, df, path = pending.pop(0)
+            process = Process(target=writer.write, args=(df, path))
+            process.start()
+            running.append((process, path))
+        process, path = running.pop(0)
+        process.join()
+        if process.exitcode != 0:
+            raise IOError("Writing {} failed with exit code {}".format(path, process.exitcode))
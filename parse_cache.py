@@ -0,0 +1,91 @@
+import cPickle
+import hashlib
+import os
+import sys
+import zlib
+
+
+class ParseCache(object):
+    """
+      A persistent cache of parsed export files, so unchanged files are not parsed again.
+
+      Each entry holds the (trades, errors) returned by a parser for one file, stored as a
+      zlib-compressed pickle. Entries are keyed by the SHA-1 of the file's contents, the parser class
+      and the parser's "version" attribute (plus whether "_extras" were kept, the watermark rows were
+      skipped up to, and whether hourly rates were used), so editing a file, moving it to another
+      exchange folder or changing a parser all produce a new key. Trades also stores a digest of the
+      exchange rates the file's trades were valued with in each entry, and parses the file again when
+      those rates have changed (see Trades.rates_digest).
+
+      The cache is bounded by max_bytes. Reading an entry marks it as recently used, and writing a new
+      entry evicts the least recently used entries until the cache fits again.
+
+      Clear it from the command line with: python parse_cache.py clear
+    """
+    extension = '.pkl.z'
+
+    def __init__(self, path=os.path.join('cache', 'parsed'), max_bytes=512 * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def key(self, parser, filename, extras=False, since=None, hourly_rates=False):
+        digest = hashlib.sha1()
+        with open(filename, 'rb') as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b''):
+                digest.update(chunk)
+        return '{}-{}-{}{}{}{}'.format(parser.__name__, parser.version, digest.hexdigest(), '-extras' if extras else '',
+                                       since.strftime('-since%Y%m%dT%H%M%S%f') if since else '',
+                                       '-hourly' if hourly_rates else '')
+
+    def entry(self, key):
+        return os.path.join(self.path, key + self.extension)
+
+    def get(self, key):
+        """
+          Returns the cached (trades, errors) for key, or None if there is no entry.
+        """
+        entry = self.entry(key)
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+        except IOError:
+            return None
+        os.utime(entry, None)
+        return cPickle.loads(zlib.decompress(data))
+
+    def put(self, key, result):
+        if not os.path.isdir(self.path):
+            os.makedirs(self.path)
+        entry = self.entry(key)
+        tmp = entry + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(zlib.compress(cPickle.dumps(result, cPickle.HIGHEST_PROTOCOL)))
+        os.rename(tmp, entry)
+        self.evict()
+
+    def entries(self):
+        if not os.path.isdir(self.path):
+            return []
+        paths = [os.path.join(self.path, _) for _ in os.listdir(self.path) if _.endswith(self.extension)]
+        return [(os.path.getmtime(_), os.path.getsize(_), _) for _ in paths]
+
+    def evict(self):
+        entries = sorted(self.entries())
+        size = sum(_[1] for _ in entries)
+        for mtime, entry_size, entry in entries:
+            if size <= self.max_bytes:
+                break
+            os.remove(entry)
+            size -= entry_size
+
+    def clear(self):
+        for entry in self.entries():
+            os.remove(entry[2])
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] != ['clear']:
+        print "Usage: python parse_cache.py clear"
+        sys.exit(1)
+    ParseCache().clear()
+    print "Parse cache cleared"
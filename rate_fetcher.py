@@ -0,0 +1,121 @@
+import threading
+import time
+import requests
+from multiprocessing.pool import ThreadPool
+from datetime import timedelta
+from errors import ApiError
+
+
+class TokenBucket(object):
+    """
+      A thread-safe token bucket. acquire() blocks until a token is available, so callers across all
+      threads make at most "rate" requests per second on average, with bursts of up to "capacity".
+    """
+    def __init__(self, rate, capacity=None):
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.time()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class CandleFetcher(object):
+    """
+      Fetches historical candles from the Coinbase Pro candles endpoint
+      (<api><currency>-USD/candles?start=...&end=...&granularity=...).
+
+      A date range is split into windows of at most max_candles candles (the API's page size), and the
+      windows are requested concurrently on a thread pool through one pooled requests.Session. Every
+      request first takes a token from a shared TokenBucket, which keeps the whole fetch under the API's
+      rate limit. Failed requests are retried with exponential backoff capped at max_backoff seconds.
+
+      params
+      api          : Base URL of the products API. Point it at a local server to test against a stub.
+      workers      : Number of concurrent requests
+      rate         : Requests per second allowed by the API (3 for the Coinbase Pro public API)
+      granularity  : Candle length in seconds
+      max_candles  : Most candles the API returns for one request
+      retries      : Retries per request before ApiError is raised
+    """
+    def __init__(self, api='https://api.gdax.com/products/', workers=3, rate=3, granularity=3600,
+                 max_candles=300, retries=5, backoff=0.5, max_backoff=8, timeout=30):
+        self.api = api
+        self.workers = workers
+        self.granularity = granularity
+        self.max_candles = max_candles
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.limiter = TokenBucket(rate)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def fetch(self, currencies, start, end):
+        """
+          Returns {currency: {candle time: candle}} for every candle between the start and end datetimes.
+          Candles are [time, low, high, open, close, volume] lists, with time in epoch seconds.
+        """
+        tasks = [(currency, s, e) for currency in currencies for s, e in self.windows(start, end)]
+        print "Requesting {} candle windows".format(len(tasks))
+        pool = ThreadPool(self.workers)
+        try:
+            results = pool.map(self.fetch_window, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+        candles = dict((_, {}) for _ in currencies)
+        for (currency, s, e), window in zip(tasks, results):
+            for candle in window:
+                # Windows share their boundary candle, keyed by time it is only kept once
+                candles[currency][candle[0]] = candle
+        return candles
+
+    def windows(self, start, end):
+        step = timedelta(seconds=self.granularity * self.max_candles)
+        windows = []
+        while start < end:
+            windows.append((start, min(start + step, end)))
+            start += step
+        return windows
+
+    def fetch_window(self, task):
+        currency, start, end = task
+        url = '{api}{currency}-USD/candles?start={start}&end={end}&granularity={granularity}'.format(
+            api=self.api,
+            currency=currency,
+            start=start.isoformat(),
+            end=end.isoformat(),
+            granularity=self.granularity,
+        )
+        return self.get(url).json()
+
+    def get(self, url):
+        for attempt in range(self.retries + 1):
+            self.limiter.acquire()
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except requests.RequestException as exc:
+                error = exc
+            else:
+                if response.status_code == 200:
+                    return response
+                error = "HTTP {}".format(response.status_code)
+            if attempt < self.retries:
+                time.sleep(min(self.max_backoff, self.backoff * 2 ** attempt))
+        raise ApiError("Too many API failures {}: {}".format(url, error))
@@ -0,0 +1,101 @@
+import os
+import struct
+import numpy as np
+
+
+class RateStore(object):
+    """
+      A binary file holding a dense day x currency matrix of exchange rates, the on-disk form of a RateTable.
+
+      The file is a fixed-size header, the currency names, and the table's int64 coefficient and int8
+      exponent arrays in row-major order. read() only parses the header and names and memory-maps the two
+      arrays, so opening the store takes the same time however many days it holds, and pages are only read
+      from disk as rates are looked up.
+
+      The header records the size and modification time of the CSV the store was built from, so is_current()
+      can tell when that CSV has been edited and the store must be rebuilt. write() replaces the file atomically.
+
+      params
+      path : Path of the store, by default the CSV's path with a ".bin" extension (see for_csv)
+    """
+    magic = 'RATESTOR'
+    version = 1
+    name_width = 16
+    header = struct.Struct('<8sHHiIIQd')
+
+    def __init__(self, path):
+        self.path = path
+
+    @classmethod
+    def for_csv(cls, filename):
+        return cls(os.path.splitext(filename)[0] + '.bin')
+
+    @staticmethod
+    def fingerprint(source):
+        stat = os.stat(source)
+        return stat.st_size, stat.st_mtime
+
+    def read_header(self):
+        """
+          Returns (first_day, days, currency count, source size, source mtime, currencies), or None if the
+          store is missing, truncated or was written by another version.
+        """
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read(self.header.size)
+                if len(data) < self.header.size:
+                    return None
+                magic, version, name_width, first_day, days, count, size, mtime = self.header.unpack(data)
+                if magic != self.magic or version != self.version or name_width != self.name_width:
+                    return None
+                names = f.read(count * name_width)
+        except IOError:
+            return None
+        currencies = [names[i:i + name_width].rstrip('\0') for i in range(0, len(names), name_width)]
+        if len(currencies) != count or os.path.getsize(self.path) != self.offset(count) + days * count * 9:
+            return None
+        return first_day, days, count, size, mtime, currencies
+
+    def is_current(self, source):
+        header = self.read_header()
+        return header is not None and header[3:5] == self.fingerprint(source)
+
+    def offset(self, count):
+        # The coefficients start on an 8-byte boundary after the currency names
+        offset = self.header.size + count * self.name_width
+        return offset + -offset % 8
+
+    def read(self):
+        """
+          Returns (first_day, currencies, coefficients, exponents), with both arrays memory-mapped read-only.
+        """
+        header = self.read_header()
+        if header is None:
+            raise ValueError("Not a valid exchange rate store: {}".format(self.path))
+        first_day, days, count, size, mtime, currencies = header
+        offset = self.offset(count)
+        coefficients = np.memmap(self.path, dtype='<i8', mode='r', offset=offset, shape=(days, count))
+        exponents = np.memmap(self.path, dtype='i1', mode='r', offset=offset + days * count * 8, shape=(days, count))
+        return first_day, currencies, coefficients, exponents
+
+    def write(self, table, source):
+        """
+          Writes table (a RateTable) to the store, recording the fingerprint of source (the CSV it was read from).
+        """
+        for currency in table.currencies:
+            if len(currency) > self.name_width:
+                raise ValueError("Currency name too long for the exchange rate store: {}".format(currency))
+        days, count = table.coefficients.shape
+        size, mtime = self.fingerprint(source)
+        header = self.header.pack(self.magic, self.version, self.name_width, table.first_day, days, count, size, mtime)
+        names = ''.join(_.ljust(self.name_width, '\0') for _ in table.currencies)
+        padding = '\0' * (self.offset(count) - len(header) - len(names))
+
+        tmp = self.path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(header + names + padding)
+            f.write(np.ascontiguousarray(table.coefficients, dtype='<i8').tobytes())
+            f.write(np.ascontiguousarray(table.exponents, dtype='i1').tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self.path)
@@ -1,104 +1,392 @@
 import csv
+import ctypes
+import hashlib
 import os
-import time
-import requests
+import sys
 import numpy as np
+from multiprocessing.sharedctypes import RawArray
 from decimal import Decimal
-from datetime import datetime, timedelta
-from errors import ApiError, UpdateExchangeRateException, \
+from datetime import date, datetime, timedelta
+from rate_store import RateStore
+from hourly_rates import HourlyRateTable
+from errors import UpdateExchangeRateException, \
     NoNewExchangeRatesException, ExchangeRatesAlreadyUpToDateException
 
+# Process-wide rate tables, keyed by the absolute path of the file they were loaded from
+_tables = {}
+_hourly_tables = {}
+
+# Hacky addition of stablecoins. Pegging to $1 for now.
+PEGGED_CURRENCIES = ['USDT', 'USDC', 'DAI', 'TUSD', 'GUSD', 'PAX']
+
+
+class RateTable(object):
+    """
+      A read-only table of daily exchange rates, indexed by day number.
+
+      Rows are days (offset from first_day, a date ordinal) and columns are currencies. Each rate is
+      stored exactly as the integer coefficient and base-10 exponent of its Decimal value, in two
+      dense numpy arrays. A missing rate has a coefficient of -1.
+
+      Because the table is two flat numeric arrays, share() can move it into shared memory so pool
+      workers read the same pages instead of each parsing exchange_rates.csv again, and a RateStore can
+      save it to disk and memory-map it back.
+
+      gaps() is the gap index: the days missing a rate for each currency.
+    """
+    missing = -1
+
+    def __init__(self, first_day, currencies, coefficients, exponents):
+        self.first_day = first_day
+        self.currencies = list(currencies)
+        self.index = dict((c, i) for i, c in enumerate(self.currencies))
+        self.coefficients = coefficients
+        self.exponents = exponents
+        self.coefficients.flags.writeable = False
+        self.exponents.flags.writeable = False
+        self._decimals = {}
+
+    def __len__(self):
+        return self.coefficients.shape[0]
+
+    @property
+    def min_date(self):
+        return date.fromordinal(self.first_day)
+
+    @property
+    def max_date(self):
+        return date.fromordinal(self.first_day + len(self) - 1)
+
+    def get(self, day, currency):
+        """
+          Returns the Decimal rate of currency on day (a date). Raises KeyError if there is none.
+        """
+        i = day.toordinal() - self.first_day
+        j = self.index[currency]
+        try:
+            return self._decimals[(i, j)]
+        except KeyError:
+            pass
+        if i < 0 or i >= len(self) or self.coefficients[i, j] == self.missing:
+            raise KeyError("No {} exchange rate on {}".format(currency, day))
+        rate = Decimal(int(self.coefficients[i, j])).scaleb(int(self.exponents[i, j]))
+        self._decimals[(i, j)] = rate
+        return rate
+
+    def latest(self, currency):
+        """
+          Returns (day, rate) of the latest rate of currency. Raises KeyError if there is none.
+        """
+        days = np.flatnonzero(self.coefficients[:, self.index[currency]] != self.missing)
+        if not len(days):
+            raise KeyError("No {} exchange rate".format(currency))
+        day = date.fromordinal(self.first_day + int(days[-1]))
+        return day, self.get(day, currency)
+
+    def digest(self, first, last, currencies):
+        """
+          Returns a hash of the rates of currencies from the first to the last date. It only changes when one of
+          those rates changes or is added, not when days after "last" are appended.
+        """
+        start = max(first.toordinal() - self.first_day, 0)
+        end = min(last.toordinal() - self.first_day + 1, len(self))
+        digest = hashlib.sha1(str(self.first_day + start))
+        for currency in sorted(currencies):
+            digest.update(currency + '\0')
+            if currency in self.index and start < end:
+                j = self.index[currency]
+                digest.update(np.ascontiguousarray(self.coefficients[start:end, j]).tobytes())
+                digest.update(np.ascontiguousarray(self.exponents[start:end, j]).tobytes())
+        return digest.hexdigest()
+
+    def gaps(self, currencies=None):
+        """
+          Returns {currency: [dates]} of the days without a rate for each currency (by default every currency
+          except the pegged ones), from its first rate up to the last day of the table.
+        """
+        gaps = {}
+        for currency in currencies or [_ for _ in self.currencies if _ not in PEGGED_CURRENCIES]:
+            if currency not in self.index:
+                gaps[currency] = []
+                continue
+            present = self.coefficients[:, self.index[currency]] != self.missing
+            first = present.argmax()
+            missing = np.flatnonzero(~present[first:]) + first + self.first_day if present[first] else []
+            gaps[currency] = [date.fromordinal(int(_)) for _ in missing]
+        return gaps
+
+    def share(self):
+        """
+          Returns a copy of this table backed by shared memory, to be handed to pool workers.
+        """
+        shape = self.coefficients.shape
+        coefficients = np.frombuffer(RawArray(ctypes.c_int64, self.coefficients.size), dtype=np.int64).reshape(shape)
+        exponents = np.frombuffer(RawArray(ctypes.c_int8, self.exponents.size), dtype=np.int8).reshape(shape)
+        coefficients[:] = self.coefficients
+        exponents[:] = self.exponents
+        return RateTable(self.first_day, self.currencies, coefficients, exponents)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """
+          Builds a table from (day ordinal, currency, rate string) rows. Later rows for the same
+          day and currency replace earlier ones.
+        """
+        if not rows:
+            raise ValueError("Cannot build an exchange rate table without any rates")
+        first_day = min(_[0] for _ in rows)
+        last_day = max(_[0] for _ in rows)
+        currencies = sorted(set(_[1] for _ in rows) | set(PEGGED_CURRENCIES))
+        index = dict((c, i) for i, c in enumerate(currencies))
+        shape = (last_day - first_day + 1, len(currencies))
+        coefficients = np.full(shape, cls.missing, dtype=np.int64)
+        exponents = np.zeros(shape, dtype=np.int8)
+
+        for day, currency, rate in rows:
+            coefficient, exponent = cls.split_decimal(rate)
+            if coefficient < 0 or coefficient > np.iinfo(np.int64).max:
+                raise ValueError("Exchange rate cannot be stored exactly: {} {} {}".format(
+                    date.fromordinal(day), currency, rate))
+            coefficients[day - first_day, index[currency]] = coefficient
+            exponents[day - first_day, index[currency]] = exponent
+
+        # Stablecoins are pegged to $1 on every day that has a BTC rate
+        has_btc = coefficients[:, index['BTC']] != cls.missing if 'BTC' in index else np.zeros(shape[0], bool)
+        for _ in PEGGED_CURRENCIES:
+            coefficients[has_btc, index[_]] = 1
+            exponents[has_btc, index[_]] = 0
+        return cls(first_day, currencies, coefficients, exponents)
+
+    @staticmethod
+    def split_decimal(text):
+        # Same coefficient and exponent as Decimal(text).as_tuple(), without building the Decimal
+        mantissa, _, exponent = text.strip().lower().partition('e')
+        whole, _, fraction = mantissa.partition('.')
+        return int(whole + fraction), int(exponent or 0) - len(fraction)
+
+
 class ExchangeRates(object):
     """
       This class ingests exchange_rates.csv -- a bare history of [BTC, ETH, USD] exchange rates from 2013 to today.
-      The parse_file() function return a parsed dictionary of exchange-rate data.
+      The parse_file() function returns a RateTable of exchange-rate data. The table() function returns
+      the process-wide RateTable for exchange_rates.csv, which is loaded once on first use and shared
+      by every parser. It is memory-mapped from the binary RateStore next to the CSV (exchange_rates.bin),
+      which is rebuilt from the CSV whenever the CSV has changed, so the CSV stays the import/export format.
+
+      The compact() function rewrites exchange_rates.csv sorted by date and currency, without duplicate rates.
+
+      The update_exchange_rates() function fetches the days after the last date of exchange_rates.csv up to today,
+      and merges them into it. Days a currency misses before that date are often days the API has no candles
+      for (or a currency it no longer lists), so they are only requested with "gaps" set (python rates.py fill), which uses the gap
+      index to fetch every day missing a base currency rate from that currency's first rate up to today.
+      This process uses the Coinbase Pro free API, which is rate-limited to 3 calls per second (see CandleFetcher).
+
+      With "hourly", the hourly candles fetched for the daily rates are also kept, in an HourlyRateTable
+      saved next to the CSV (exchange_rates_hourly.npz), for valuing trades at the rate of their hour.
+      hourly_table() returns it (empty until candles have been fetched), and update_hourly_rates() fills it
+      from a start date.
 
-      The update_exchange_rates() function identifies the most recent date in exchange_rates.csv, and appends 
-      exchange rate data from the most recent date up to today. This process uses the Coinbase Pro free API, 
-      which is rate-limited to 3 calls per second.
+      Compact the file, list or fill its gaps, or fetch hourly rates from the command line with:
+      python rates.py compact|gaps|fill|hourly <start date>
     """
-    def __init__(self):
-        self.path = os.path.join('data', 'exchange_rates.csv')
-        self.api = 'https://api.gdax.com/products/'
+    def __init__(self, api='https://api.gdax.com/products/', path=os.path.join('data', 'exchange_rates.csv'),
+                 hourly=False):
+        self.path = path
+        self.hourly_path = os.path.join(os.path.dirname(path), 'exchange_rates_hourly.npz')
+        self.hourly = hourly
+        self.api = api
         self.base_currencies = ['BTC', 'ETH']
+        self._fetcher = None
+
+    def table(self):
+        key = os.path.abspath(self.path)
+        if key not in _tables:
+            _tables[key] = self.load(self.path)
+        return _tables[key]
+
+    def load(self, filename):
+        """
+          Returns the RateTable of filename, memory-mapped from its RateStore. The store is rebuilt first if it
+          is missing or was built from an older version of filename.
+        """
+        store = RateStore.for_csv(filename)
+        if not store.is_current(filename):
+            table = self.parse_file(filename)
+            try:
+                store.write(table, filename)
+            except (IOError, OSError) as exc:
+                print "Could not write exchange rate store {}: {}".format(store.path, exc)
+                return table
+        return RateTable(*store.read())
+
+    def install_table(self, table, hourly=None):
+        # Used by pool workers to adopt the tables of the parent process
+        _tables[os.path.abspath(self.path)] = table
+        if hourly is not None:
+            _hourly_tables[os.path.abspath(self.hourly_path)] = hourly
+
+    def reset_table(self):
+        _tables.pop(os.path.abspath(self.path), None)
+        _hourly_tables.pop(os.path.abspath(self.hourly_path), None)
+
+    def hourly_table(self):
+        key = os.path.abspath(self.hourly_path)
+        if key not in _hourly_tables:
+            _hourly_tables[key] = HourlyRateTable.load(self.hourly_path)
+        return _hourly_tables[key]
 
     def parse_file(self, filename):
         with open(filename, 'r') as f:
             return self.parse(f)
 
     def parse(self, f_obj):
-        reader = csv.DictReader(f_obj)
-        rates = {}
-        for row in reader:
-            date = self.get_date(row)
-            if date not in rates:
-                rates[date] = {}
-            rates[date][row['currency']] = Decimal(row['rate'])
-            # Hacky addition of stablecoins. Pegging to $1 for now. 
-            if row['currency'] == 'BTC':
-                for _ in ['USDT', 'USDC', 'DAI', 'TUSD', 'GUSD', 'PAX']:
-                    rates[date][_] = Decimal(1)
-        return rates
+        return RateTable.from_rows(self.read_rows(f_obj))
+
+    def read_rows(self, f_obj):
+        return [(self.get_day(row), row['currency'], row['rate']) for row in csv.DictReader(f_obj)]
 
     def update_file(self, filename, rates):
-        with open(filename, 'a') as f:
-            f.write('\n')
-            for key in rates:
-                for currency in rates[key]:
-                    f.write("{},{},{}\n".format(
-                        key,
-                        currency,
-                        rates[key][currency],
-                    ))
+        """
+          Merges rates ({date: {currency: rate}}) into filename, replacing any rate already there for the same
+          day and currency, and compacts it.
+        """
+        with open(filename, 'r') as f:
+            rows = self.read_rows(f)
+        for key in rates:
+            for currency in rates[key]:
+                rows.append((key.toordinal(), currency, "{}".format(rates[key][currency])))
+        self.compact(filename, rows)
+
+    def compact(self, filename=None, rows=None):
+        """
+          Rewrites filename (or the rows given for it) sorted by date and currency, keeping the last rate
+          read for each day and currency, and rebuilds its RateStore. Both files are replaced atomically.
+          Returns the new RateTable.
+        """
+        filename = filename or self.path
+        if rows is None:
+            with open(filename, 'r') as f:
+                rows = self.read_rows(f)
+        latest = dict(((day, currency), rate) for day, currency, rate in rows)
+        rows = [(day, currency, latest[(day, currency)]) for day, currency in sorted(latest)]
+
+        tmp = filename + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('date,currency,rate\n')
+            for day, currency, rate in rows:
+                f.write("{},{},{}\n".format(date.fromordinal(day), currency, rate))
+        os.rename(tmp, filename)
+        _tables.pop(os.path.abspath(filename), None)
+
+        table = RateTable.from_rows(rows)
+        RateStore.for_csv(filename).write(table, filename)
+        return table
 
     def get_date(self, row):
         return datetime.strptime(row['date'], '%Y-%m-%d').date()
 
-    def update_exchange_rates(self):
-        rates = self.parse_file(self.path)
-        try:
-            max_date = self.get_max_date(rates)
-            print "Updating exchange rates from %s" % max_date
-            new_rates = self.get_exchange_rates(max_date)
-        except UpdateExchangeRateException as exc:
-            print exc
+    def get_day(self, row):
+        _date = row['date']
+        return date(int(_date[:4]), int(_date[5:7]), int(_date[8:10])).toordinal()
+
+    def update_exchange_rates(self, gaps=False):
+        ranges = self.missing_ranges(self.table(), gaps)
+        if not ranges:
+            print "Exchange Rates up to date"
             return
-        self.update_file(self.path, new_rates)
+        new_rates = {}
+        for currency, start_date, end_date in ranges:
+            print "Updating {} exchange rates from {} to {}".format(currency, start_date, end_date)
+            try:
+                rates = self.get_exchange_rates(start_date, end_date, [currency])
+            except UpdateExchangeRateException as exc:
+                print exc
+                continue
+            for day in rates:
+                new_rates.setdefault(day, {}).update(rates[day])
+        if new_rates:
+            self.update_file(self.path, new_rates)
+            self.reset_table()
 
-    def get_max_date(self, rates):
-        max_date = max(rates.keys()) + timedelta(1)
-        if max_date >= datetime.today().date():
-            raise UpdateExchangeRateException("Exchange Rates up to date")
-        return max_date
+    def missing_ranges(self, rates, gaps=False):
+        """
+          Returns (currency, first date, last date) for each run of consecutive days missing a base currency
+          rate: the days after the table's last date up to today, and with gaps, the gaps inside the table.
 
-    def get_exchange_rates(self, start_date):
+          The days a currency misses before the table's last date are gaps, even at the end of its rates, so a
+          currency the API no longer returns is not requested again on every update.
+        """
         today = datetime.today().date()
-        daterange = self.date_range(start_date, today)
+        ranges = []
+        missing_days = rates.gaps(self.base_currencies) if gaps else dict((_, []) for _ in self.base_currencies)
+        latest = rates.max_date
+        for currency, missing in sorted(missing_days.items()):
+            if latest + timedelta(1) < today:
+                missing += [latest + timedelta(_) for _ in range(1, (today - latest).days + 1)]
+            for day in missing:
+                if ranges and ranges[-1][0] == currency and ranges[-1][2] + timedelta(1) == day:
+                    ranges[-1] = (currency, ranges[-1][1], day)
+                else:
+                    ranges.append((currency, day, day))
+        return ranges
+
+    def get_exchange_rates(self, start_date, end_date=None, currencies=None):
+        """
+          Returns {date: {currency: rate}} from start_date up to end_date (by default today), for currencies
+          (by default the base currencies). The rate for a date is calculated from the hourly candles of the
+          day before it.
+        """
+        today = end_date or datetime.today().date()
+        first = start_date - timedelta(1)
+        candles = self.fetcher().fetch(
+            currencies or self.base_currencies,
+            datetime(first.year, first.month, first.day),
+            datetime(today.year, today.month, today.day),
+        )
+
+        if self.hourly:
+            self.add_hourly_candles(candles)
+
         rates = {}
-        for date in daterange:
-            if date.weekday() == 0:
-                print "Updating exchange rate data for week of %s..." % date
-            rates[date] = {}
-            for currency in self.base_currencies:
-                url = self.get_url(currency, date)
-                response = self.get_response(url)
-                rate = response.json()
-                rates[date][currency] = self.calculate_exchange_rate(rate)
+        for currency, currency_candles in candles.items():
+            days = {}
+            for candle in currency_candles.values():
+                day = datetime.utcfromtimestamp(candle[0]).date() + timedelta(1)
+                days.setdefault(day, []).append(candle)
+            for day, day_candles in days.items():
+                if start_date <= day <= today:
+                    rates.setdefault(day, {})[currency] = self.calculate_exchange_rate(day_candles)
 
         if not rates:
             raise NoNewExchangeRatesException("New Exchange Rates did not return any values")
         return rates
 
-    def date_range(self, start, end):
-        return [end - timedelta(_) for _ in range(0, (end-start).days + 1)]
+    def update_hourly_rates(self, start_date):
+        """
+          Fetches the hourly candles of the base currencies from start_date (or from the last stored candle
+          if later) up to now into the hourly table.
+        """
+        table = self.hourly_table()
+        now = datetime.utcnow()
+        for currency in self.base_currencies:
+            start = datetime(start_date.year, start_date.month, start_date.day)
+            if currency in table and len(table.times[currency]):
+                start = max(start, datetime.utcfromtimestamp(table.times[currency][-1] - table.granularity / 2.))
+            print "Updating {} hourly rates from {}".format(currency, start)
+            self.add_hourly_candles(self.fetcher().fetch([currency], start, now))
 
-    def get_url(self, currency, date):
-        endpoint = '{}-USD/'.format(currency)
-        params = 'candles?start={start}&end={end}&granularity=3600'.format(
-            start=date - timedelta(days=1),
-            end=date,
-        )
-        return self.api + endpoint + params
+    def add_hourly_candles(self, candles):
+        table = self.hourly_table()
+        for currency, currency_candles in candles.items():
+            table.add_candles(currency, currency_candles.values())
+        table.save(self.hourly_path)
+
+    def fetcher(self):
+        if self._fetcher is None:
+            # Imported here so reading rates does not load requests
+            from rate_fetcher import CandleFetcher
+            self._fetcher = CandleFetcher(self.api)
+        return self._fetcher
 
     def calculate_exchange_rate(self, rate):
         candle_rates = []
@@ -106,19 +394,22 @@ class ExchangeRates(object):
             candle_rates.append((candle[3] + candle[4]) / 2.0)
         return round((1 / np.average(candle_rates)), 15)
 
-    def get_response(self, url):
-        count = 0
-        while True:
-            try:
-                response = requests.get(url)
-                if response.status_code == 200:
-                    break
-                else:
-                    raise
-            except:
-                if count > 5:
-                    raise ApiError("Too many API failures %s" % url)
-                time.sleep(10 * count)
-                count += 1
-                continue
-        return response
+
+if __name__ == '__main__':
+    if sys.argv[1:] not in (['compact'], ['gaps'], ['fill']) and (len(sys.argv) != 3 or sys.argv[1] != 'hourly'):
+        print "Usage: python rates.py compact|gaps|fill|hourly <start date, YYYY-MM-DD>"
+        sys.exit(1)
+    exchange_rates = ExchangeRates()
+    if sys.argv[1] == 'fill':
+        exchange_rates.update_exchange_rates(gaps=True)
+    elif sys.argv[1] == 'hourly':
+        exchange_rates.update_hourly_rates(datetime.strptime(sys.argv[2], '%Y-%m-%d').date())
+        table = exchange_rates.hourly_table()
+        print "{}: {} hourly rates".format(exchange_rates.hourly_path, len(table))
+    elif sys.argv[1] == 'compact':
+        table = exchange_rates.compact()
+        print "Compacted {}: {} days from {} to {}".format(exchange_rates.path, len(table), table.min_date, table.max_date)
+    else:
+        for currency, missing in sorted(exchange_rates.table().gaps().items()):
+            print "{:<6} {:>6} missing days{}".format(
+                currency, len(missing), ': ' + ', '.join(str(_) for _ in missing[:10]) if missing else '')
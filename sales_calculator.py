@@ -1,5 +1,5 @@
 import pandas as pd
-import current_exchange_rates
+import numpy as np
 from decimal import Decimal
 
 
@@ -9,65 +9,91 @@ class SalesCalculator():
     # It provides a comprehensive report to maximize:
     #   (1) Total $ amount sold while not increasing the current PNL
     #   (2) Total $ amount sold that would minimize total PNL
-    def __init__(self, year):
+    sales_columns = ['amount', 'currency', 'pnl', 'rolling_amount', 'rolling_pnl', 'rolling_sales', 'sales']
+
+    def __init__(self, year, offline=False):
+        # offline: Use the latest cached current prices instead of calling the prices API
         self.year = year
+        self.offline = offline
 
     def sales_data(self, pnl, remaining_funds, pnl_threshold):
         # pnl_threshold:     With LIFO,  when simulating selling crypto assets the first few sales could
         #                    increase PNL before it finds some assets that would decrease PNL. This
         #                    threshold allows you increase PNL up to <X> before stopping the process.
-        rates = self.current_exchange_rates()
-        sales = pd.DataFrame()
-        currencies = pnl.currency.unique()
+        #
+        # All currencies are computed in one pass: the lots are sorted by currency and newest-first, the
+        # sales and PNL of every lot are computed column-wise, and the rolling columns are cumulative sums
+        # over each currency's block of lots. Each currency stops before the first lot whose rolling PNL
+        # reaches the threshold.
+        held = remaining_funds['currency'].unique()
+        rates = self.current_exchange_rates(list(held))
+        currencies = [_ for _ in pnl.currency.unique() if _ in set(held)]
         for _ in currencies:
-            rf_copy = self.get_currency_rf_copy(remaining_funds, _)
-            price = rates['{}_USD'.format(_)]
-
-            rolling_pnl = 0
-            rolling_sales = 0
-            rolling_amount = 0
-            while True:
-                for row in rf_copy.iterrows():
-                    basis = Decimal(row[1].basis)
-                    amount = Decimal(row[1].amount)
-                    _pnl = amount * (price - basis)
-                    rolling_sales += (amount * price)
-                    rolling_amount += amount
-
-                    rolling_pnl += _pnl
-                    if rolling_pnl >= pnl_threshold:
-                        break
-
-                    sales = sales.append({
-                        'currency': _,
-                        'amount': amount,
-                        'rolling_amount': rolling_amount,
-                        'sales': amount * price,
-                        'rolling_sales': rolling_sales,
-                        'pnl': _pnl,
-                        'rolling_pnl': rolling_pnl,
-                    }, ignore_index=True)
-                break
-
-        return sales
-
-    def get_currency_rf_copy(self, remaining_funds, currency):
-        return remaining_funds[(remaining_funds['currency'] == currency)].sort_values(
-                by=['created_at'], ascending=False
-            ).copy()
-
-    def current_exchange_rates(self):
-        return current_exchange_rates.ExchangeRates().run()
+            if '{}_USD'.format(_) not in rates:
+                print "No current price for {}, it will not be sold".format(_)
+        currencies = [_ for _ in currencies if '{}_USD'.format(_) in rates]
+        prices = dict((_, rates['{}_USD'.format(_)]) for _ in currencies)
+        lots = self.sorted_lots(remaining_funds, currencies)
+        if lots.empty:
+            return pd.DataFrame()
+
+        currency = lots['currency'].values
+        amount = np.array([Decimal(_) for _ in lots['amount'].values], dtype=object)
+        basis = np.array([Decimal(_) for _ in lots['basis'].values], dtype=object)
+        price = lots['currency'].map(prices).values
+        sales = amount * price
+        _pnl = amount * (price - basis)
+
+        rolling_amount = np.empty(len(lots), dtype=object)
+        rolling_sales = np.empty(len(lots), dtype=object)
+        rolling_pnl = np.empty(len(lots), dtype=object)
+        keep = np.empty(len(lots), dtype=bool)
+        for start, end in self.currency_blocks(currency):
+            block = slice(start, end)
+            rolling_amount[block] = np.cumsum(amount[block])
+            rolling_sales[block] = np.cumsum(sales[block])
+            rolling_pnl[block] = np.cumsum(_pnl[block])
+            keep[block] = ~np.logical_or.accumulate(
+                np.array([_ >= pnl_threshold for _ in rolling_pnl[block]], dtype=bool))
+
+        return pd.DataFrame({
+            'currency': currency[keep],
+            'amount': amount[keep],
+            'rolling_amount': rolling_amount[keep],
+            'sales': sales[keep],
+            'rolling_sales': rolling_sales[keep],
+            'pnl': _pnl[keep],
+            'rolling_pnl': rolling_pnl[keep],
+        }, columns=self.sales_columns)
+
+    def sorted_lots(self, remaining_funds, currencies):
+        # Lots of the given currencies, grouped in the order of currencies and newest-first within each
+        order = dict((_, i) for i, _ in enumerate(currencies))
+        lots = remaining_funds[remaining_funds['currency'].isin(currencies)]
+        lots = lots.sort_values(by=['created_at'], ascending=False, kind='mergesort')
+        return lots.iloc[lots['currency'].map(order).values.argsort(kind='mergesort')]
+
+    def currency_blocks(self, currency):
+        # (start, end) positions of each run of equal currencies in a currency-sorted array
+        starts = np.flatnonzero(np.r_[True, currency[1:] != currency[:-1]])
+        return zip(starts, np.r_[starts[1:], len(currency)])
+
+    def current_exchange_rates(self, currencies=None):
+        # Current prices of currencies, cached for a few minutes (see current_exchange_rates.ExchangeRates)
+        import current_exchange_rates
+        return current_exchange_rates.ExchangeRates(offline=self.offline).run(currencies)
 
     def find_min_max_pnl(self, sales):
         print "Max sales while not impacting current capital gains (PNL):"
         summary = {}
+        blocks = sales.groupby('currency', sort=False).indices
+        amount, _sales, pnl = sales['amount'].values, sales['sales'].values, sales['pnl'].values
         for _ in sales.currency.unique():
-            copy = sales[sales['currency'] == _].copy()
+            rows = blocks[_]
             summary[_] = {
-                'max_sales_usd': round(copy.sales.sum()),
-                'max_sales_amt': round(copy.amount.sum(), 2),
-                'max_sales_pnl': round(copy.pnl.sum()),
+                'max_sales_usd': round(_sales[rows].sum()),
+                'max_sales_amt': round(amount[rows].sum(), 2),
+                'max_sales_pnl': round(pnl[rows].sum()),
             }
 
             print "{:<6}".format(_), "Total Sales: ", "{:<10}".format(summary[_]['max_sales_usd']), "Amount to sell: ", \
@@ -84,11 +110,11 @@ class SalesCalculator():
         r_s = 0
         r_p = 0
         for _ in sales.currency.unique():
-            copy = sales[sales['currency'] == _].copy()
-            min_pnl_index = copy.rolling_pnl.idxmin()
-            rolling_sales = round(copy.loc[min_pnl_index].rolling_sales, 0)
-            rolling_amount = round(copy.loc[min_pnl_index].rolling_amount, 2)
-            rolling_pnl = round(copy.loc[min_pnl_index].rolling_pnl, 0)
+            rows = blocks[_]
+            min_pnl_row = rows[sales['rolling_pnl'].values[rows].argmin()]
+            rolling_sales = round(sales['rolling_sales'].values[min_pnl_row], 0)
+            rolling_amount = round(sales['rolling_amount'].values[min_pnl_row], 2)
+            rolling_pnl = round(sales['rolling_pnl'].values[min_pnl_row], 0)
             r_s += rolling_sales
             r_p += rolling_pnl
 
@@ -111,7 +137,7 @@ class SalesCalculator():
         # Pull in a dict of coins that you want to sell, the total PNL calculations from taxes.py,
         # and the summary sales data from min_max_pnl
         sales = 0
-        pnl = total_pnl[total_pnl['year'] == 2018].pnl.sum()
+        pnl = total_pnl[total_pnl['year'] == self.year].pnl.sum()
         print "Current capital gains (PNL): ", pnl, "\n"
 
         print "Selling assets in order to minimize current capital gains (PNL):"
@@ -124,7 +150,7 @@ class SalesCalculator():
 
         print "Selling assets in order to maximize sales while not impacting current capital gains (PNL)"
         sales = 0
-        pnl = total_pnl[total_pnl['year'] == 2018].pnl.sum()
+        pnl = total_pnl[total_pnl['year'] == self.year].pnl.sum()
         for _ in coins_to_sell:
             sales += summary[_]['max_sales_usd']
             pnl += summary[_]['max_sales_pnl']
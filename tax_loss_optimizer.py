@@ -0,0 +1,196 @@
+import pandas as pd
+import numpy as np
+from decimal import Decimal
+from sales_calculator import SalesCalculator
+
+
+class LotCurve():
+    # The open lots of one currency in the order LIFO would sell them (newest first), with the prefix
+    # sums of the USD sales and PNL of selling them at the current price.
+    #
+    # Selling any amount of the currency realizes a prefix of these lots, so (cum_sales[i], cum_pnl[i])
+    # are the only choices. hull holds the indexes of the prefixes on the lower convex hull of those
+    # points: walking from one hull point to the next realizes the most PNL reduction (or least PNL
+    # increase) per dollar of sales available at that point.
+    #
+    # The prefix sums only decide the selling order, so they are floats. What is actually sold is
+    # accumulated exactly, in Decimal, one lot at a time (see TaxLossOptimizer.sell).
+    def __init__(self, currency, price, amounts, basis):
+        self.currency = currency
+        self.price = price
+        self.amounts = amounts
+        self.basis = basis
+        float_amounts = amounts.astype(float)
+        self.cum_sales = np.r_[0, np.cumsum(float_amounts * float(price))]
+        self.cum_pnl = np.r_[0, np.cumsum(float_amounts * (float(price) - basis.astype(float)))]
+        self.hull = self.lower_hull()
+
+        # How much has been sold: "position" whole lots plus "fraction" of the next one
+        self.position = 0
+        self.fraction = Decimal(0)
+        self.sold_amount = Decimal(0)
+        self.sold_sales = Decimal(0)
+        self.sold_pnl = Decimal(0)
+
+    def lower_hull(self):
+        s, q = self.cum_sales.tolist(), self.cum_pnl.tolist()
+        hull = [0]
+        for i in range(1, len(s)):
+            while len(hull) >= 2:
+                o, a = hull[-2], hull[-1]
+                if (s[a] - s[o]) * (q[i] - q[o]) - (q[a] - q[o]) * (s[i] - s[o]) > 0:
+                    break
+                hull.pop()
+            hull.append(i)
+        return hull
+
+    def segments(self):
+        # (slope, start, end) for each hull segment, in selling order. Slopes are increasing.
+        s, q = self.cum_sales, self.cum_pnl
+        return [((q[b] - q[a]) / (s[b] - s[a]), a, b) for a, b in zip(self.hull, self.hull[1:])]
+
+    def lot(self, k):
+        # (amount, sales, pnl) of lot k, in Decimal
+        amount = self.amounts[k]
+        return amount, amount * self.price, amount * (self.price - self.basis[k])
+
+
+class TaxLossOptimizer(SalesCalculator):
+    # Chooses how much of each currency to sell to harvest losses for a tax year, across every currency
+    # held in the remaining funds from LIFO.run.
+    #
+    # Every currency is reduced to the lower convex hull of its LIFO (sales, PNL) prefix sums, and the
+    # hull segments of all currencies are merged greedily, cheapest PNL per dollar of sales first. Since
+    # each currency's hull slopes are increasing, the merged order always sells each currency's lots in
+    # LIFO order. A goal that is reached inside a segment is met exactly by walking that segment's lots
+    # and selling part of the last one. The merge is optimal on the hulls; inside a segment of several
+    # lots the real PNL can lie above the hull, so the plan may sell slightly more than strictly needed.
+    #
+    # params
+    # year        : The tax year whose PNL is being reduced
+    # pnl_target  : PNL to bring the year down to. None harvests every loss available.
+    # pnl_cap     : Highest the year's PNL may end at, when more sales are needed to reach min_sales.
+    #               Defaults to the year's current PNL (extra sales never increase the tax owed).
+    # min_sales   : USD of sales to raise, even after the PNL target is reached
+    # exclude     : Currencies which are never sold
+    plan_columns = ['currency', 'price', 'amount', 'lots', 'sales', 'pnl']
+
+    def __init__(self, year, pnl_target=None, pnl_cap=None, min_sales=0, exclude=('USD',), offline=False):
+        SalesCalculator.__init__(self, year, offline)
+        self.pnl_target = self.to_decimal(pnl_target)
+        self.pnl_cap = self.to_decimal(pnl_cap)
+        self.min_sales = self.to_decimal(min_sales)
+        self.exclude = set(exclude)
+
+    def run(self, pnl, remaining_funds, rates=None):
+        # Returns the plan, a dataframe with one row per currency to sell, and a summary dict
+        rates = rates or self.current_exchange_rates(
+            [_ for _ in remaining_funds['currency'].unique() if _ not in self.exclude])
+        year_pnl = pnl[pnl['year'] == self.year].pnl.sum() if len(pnl) else 0
+        current_pnl = self.to_decimal(round(year_pnl, 2))
+        curves = self.lot_curves(remaining_funds, rates)
+        plan, summary = self.optimize(curves, current_pnl)
+        self.print_plan(plan, summary)
+        return plan, summary
+
+    def to_decimal(self, value):
+        if value is None or isinstance(value, Decimal):
+            return value
+        return Decimal(str(value))
+
+    def lot_curves(self, remaining_funds, rates):
+        if remaining_funds.empty:
+            return []
+        currencies = [_ for _ in remaining_funds.currency.unique() if _ not in self.exclude]
+        lots = self.sorted_lots(remaining_funds, currencies)
+        lots = lots[lots['amount'] > 0]
+        currency = lots['currency'].values
+        amounts = np.array([Decimal(_) for _ in lots['amount'].values], dtype=object)
+        basis = np.array([Decimal(_) for _ in lots['basis'].values], dtype=object)
+
+        curves = []
+        for start, end in self.currency_blocks(currency):
+            price = rates.get('{}_USD'.format(currency[start]))
+            if not price:
+                print "No current price for {}, it will not be sold".format(currency[start])
+                continue
+            curves.append(LotCurve(currency[start], price, amounts[start:end], basis[start:end]))
+        return curves
+
+    def optimize(self, curves, current_pnl):
+        segments = sorted(
+            (slope, i, start, end) for i, curve in enumerate(curves) for slope, start, end in curve.segments())
+        cap = self.pnl_cap if self.pnl_cap is not None else current_pnl
+        totals = {'pnl': current_pnl, 'sales': Decimal(0)}
+
+        for slope, i, start, end in segments:
+            harvesting = slope < 0 and (self.pnl_target is None or totals['pnl'] > self.pnl_target)
+            if harvesting:
+                self.sell(curves[i], end, totals, pnl_floor=self.pnl_target)
+            elif totals['sales'] < self.min_sales:
+                if self.sell(curves[i], end, totals, sales_goal=self.min_sales, pnl_ceiling=cap):
+                    if totals['sales'] < self.min_sales:
+                        # Stopped by the cap, and every remaining segment raises PNL at least as fast
+                        break
+            else:
+                break
+
+        plan = pd.DataFrame([
+            {
+                'currency': curve.currency,
+                'price': curve.price,
+                'amount': curve.sold_amount,
+                'lots': curve.position + (1 if curve.fraction else 0),
+                'sales': curve.sold_sales,
+                'pnl': curve.sold_pnl,
+            } for curve in curves if curve.sold_amount
+        ], columns=self.plan_columns)
+        summary = {
+            'year': self.year,
+            'current_pnl': current_pnl,
+            'final_pnl': totals['pnl'],
+            'total_sales': totals['sales'],
+        }
+        return plan, summary
+
+    def sell(self, curve, end, totals, pnl_floor=None, pnl_ceiling=None, sales_goal=None):
+        # Sells curve's lots up to prefix "end", stopping part way through a lot as soon as the PNL falls
+        # to pnl_floor, the sales reach sales_goal or the PNL would rise above pnl_ceiling.
+        # Returns True if it stopped early.
+        take = []
+        while curve.position < end:
+            k = curve.position
+            remaining = 1 - curve.fraction
+            amount, lot_sales, lot_pnl = curve.lot(k)
+            lot_sales *= remaining
+            lot_pnl *= remaining
+
+            take = []
+            if pnl_floor is not None and lot_pnl < 0 and totals['pnl'] + lot_pnl <= pnl_floor:
+                take.append((pnl_floor - totals['pnl']) / lot_pnl)
+            if pnl_ceiling is not None and lot_pnl > 0 and totals['pnl'] + lot_pnl > pnl_ceiling:
+                take.append(max(Decimal(0), (pnl_ceiling - totals['pnl']) / lot_pnl))
+            if sales_goal is not None and totals['sales'] + lot_sales >= sales_goal:
+                take.append((sales_goal - totals['sales']) / lot_sales)
+            share = min(take) if take else Decimal(1)
+
+            curve.sold_amount += amount * remaining * share
+            curve.sold_sales += lot_sales * share
+            curve.sold_pnl += lot_pnl * share
+            totals['sales'] += lot_sales * share
+            totals['pnl'] += lot_pnl * share
+            if share < 1:
+                curve.fraction += remaining * share
+                return True
+            curve.position += 1
+            curve.fraction = Decimal(0)
+        return bool(take)
+
+    def print_plan(self, plan, summary):
+        print "Current capital gains (PNL) for {}: ".format(self.year), round(summary['current_pnl'], 2), "\n"
+        print "Selling assets in order to harvest losses:"
+        for _ in plan.itertuples():
+            print "{:<10}".format(_.currency), "Amount to sell: ", "{:<14}".format(round(_.amount, 8)), \
+                "${:<12} in sales".format(round(_.sales, 2)), "Impact to PNL: ", "{:<10}".format(round(_.pnl, 2))
+        print "Total sold (USD): {:<10} Final PNL: ".format(round(summary['total_sales'], 2)), \
+            "{:<}\n".format(round(summary['final_pnl'], 2))
@@ -1,9 +1,12 @@
 import pandas as pd
 import os
+from datetime import datetime
 from trades import Trades
 from lifo import LIFO
 from rates import ExchangeRates
-from errors import NotATradeException, TradeTooSmallException
+from errors import NotATradeException, TradeTooSmallException, DuplicateTradeException
+from instrumentation import Instrumentation, NULL_INSTRUMENTATION
+from output_writers import Form8949Writer, get_writer, write_concurrently
 
 
 class Taxes():
@@ -20,52 +23,154 @@ class Taxes():
       total_pnl           : Aggregate information on profit and loss for each year, by short term vs long term
       tax_reporting_data  : A spreadsheet intended to be sent to the IRS or a tax accountant which
                           : details every trade and the profit-and-loss associated with each.
+
+      params
+      workers             : Number of processes used to parse exchange files (see Trades). Parses serially if unset.
+      cache               : A ParseCache, or True for the default one, to skip re-parsing unchanged files (see Trades).
+      checkpoints         : A LotCheckpoints store to resume LIFO from year-end checkpoints (see LIFO).
+      instrumentation     : An Instrumentation, or True for one without JSON lines or profiles, to record the
+                          : time, CPU, throughput and memory of every stage of the run. run() prints its report
+                          : (see Instrumentation.print_report), and run(report=True) also returns it.
+      output_dir          : Folder the result files are written to
+      formats             : Output formats, by name ('csv', 'csv.gz', 'columnar'; see output_writers.writers)
+                          : or as OutputWriter instances. Every result frame is written in each format.
+      form_8949           : Also write tax_reporting_data as Form 8949 style rows to form_8949.csv
+      output_workers      : Number of processes writing files at once. Files are written one by one if unset.
+      fixed_point         : Match lots with exact integer amounts and aggregate pnl as int64 cents (see LIFO).
+      update_rates        : Update exchange_rates.csv from the API before parsing. Set False to run offline.
+      year                : Only compute this tax year. Trades made after it are dropped while parsing, LIFO
+                          : stops at its end, and tax_reporting_data only holds its sales.
+      currencies          : Only compute these currencies. Other trades are dropped while parsing, except the
+                          : ones that fill a selected currency.
+      exchanges           : Only parse the files of these exchanges
+      hourly_rates        : Value crypto fills at the hourly rate of their time rather than the day's rate (see
+                          : HourlyRateTable). Updating the rates then also keeps the hourly candles.
     """
-    def __init__(self, *args, **kwargs):
-        pass
+    def __init__(self, workers=None, cache=None, checkpoints=None, instrumentation=None, output_dir='output',
+                 formats=('csv',), form_8949=False, output_workers=None, fixed_point=False, update_rates=True,
+                 year=None, currencies=None, exchanges=None, hourly_rates=False, *args, **kwargs):
+        self.workers = workers
+        self.cache = cache
+        self.checkpoints = checkpoints
+        self.instrumentation = Instrumentation() if instrumentation is True else \
+            instrumentation or NULL_INSTRUMENTATION
+        self.output_dir = output_dir
+        self.writers = [get_writer(_) for _ in formats]
+        self.form_8949 = form_8949
+        self.output_workers = output_workers
+        self.fixed_point = fixed_point
+        self.update_rates = update_rates
+        self.year = year
+        self.currencies = currencies
+        self.exchanges = exchanges
+        self.hourly_rates = hourly_rates
 
-    def run(self, trades=None, errors=None):
-        rates = ExchangeRates().update_exchange_rates()
+    def run(self, trades=None, errors=None, report=False):
+        """
+          Returns trades, errors, pnl, total_pnl, tax_reporting_data and remaining_funds. With report, the
+          Instrumentation of the run is returned as a seventh value, the structured report of every stage (see
+          Instrumentation.to_df). Stages are then recorded even if Taxes was created without instrumentation.
+        """
+        if report and not self.instrumentation.enabled:
+            self.instrumentation = Instrumentation()
+        if self.update_rates:
+            with self.instrumentation.stage('rates.update'):
+                ExchangeRates(hourly=self.hourly_rates).update_exchange_rates()
         print "running Trades"
-        trades, errors = self.run_trades()
+        with self.instrumentation.stage('trades') as stage:
+            trades, errors = self.run_trades()
+            stage.rows = len(trades)
         self.print_trade_info(trades)
         self.print_errors(errors)
         pnl, total_pnl, remaining_funds = self.run_lifo(trades)
-        tax_reporting_data = self.tax_reporting_data(pnl)
+        with self.instrumentation.stage('taxes.tax_reporting_data', rows=len(pnl)):
+            tax_reporting_data = self.tax_reporting_data(pnl)
         self.write_files(trades, errors, pnl, total_pnl, tax_reporting_data)
+        if self.instrumentation.enabled:
+            self.instrumentation.print_report()
+        if report:
+            return trades, errors, pnl, total_pnl, tax_reporting_data, remaining_funds, self.instrumentation
         return trades, errors, pnl, total_pnl, tax_reporting_data, remaining_funds
 
     def run_trades(self):
-        return Trades().run()
+        until = datetime(self.year + 1, 1, 1) if self.year is not None else None
+        return Trades(workers=self.workers, cache=self.cache, instrumentation=self.instrumentation,
+                      exchanges=self.exchanges, currencies=self.currencies, until=until,
+                      hourly_rates=self.hourly_rates).run()
 
     def run_lifo(self, trades):
-        pnl, remaining_funds = LIFO().run(trades)
-        total_pnl = LIFO().aggregate_pnl(pnl)
+        with self.instrumentation.stage('lifo', rows=len(trades)):
+            pnl, remaining_funds = LIFO(checkpoints=self.checkpoints, instrumentation=self.instrumentation,
+                                        fixed_point=self.fixed_point, currencies=self.currencies,
+                                        year=self.year).run(trades)
+        with self.instrumentation.stage('lifo.aggregate_pnl', rows=len(pnl)):
+            total_pnl = LIFO(fixed_point=self.fixed_point).aggregate_pnl(pnl)
         return pnl, total_pnl, remaining_funds
 
-    def tax_reporting_data(self, pnl):
+    def tax_reporting_data(self, pnl, exact=False):
+        """
+          Returns the sales of pnl, by sell date. With exact, they also hold the unrounded "proceeds" and "cost"
+          of each sale (see LIFO.exact_columns), as Form8949Writer needs.
+        """
         columns = ['currency', 'amount', 'buy_date', 'sell_date', 'buy_basis', 'sell_basis', 'pnl', 'long_term']
-        df = pnl[pnl['type'] == 'sell'][columns].copy()
+        if exact:
+            columns += LIFO.exact_columns
+        sells = pnl['type'] == 'sell'
+        if self.year is not None:
+            sells &= pnl['year'] == self.year
+        df = pnl[sells][columns].copy()
         df.sort_values(by=['sell_date'], ascending=True, inplace=True)
         df.reset_index(inplace=True)
         del df['index']
         return df
 
     def write_files(self, trades, errors, pnl, total_pnl, tax_reporting_data):
-        print "Writing final data to files in output/ folder"
-        for _ in ['trades', 'pnl', 'total_pnl', 'tax_reporting_data']:
-            eval("{f}.to_csv(os.path.join('output', '{f}.csv'))".format(f=_))
+        frames = [
+            ('trades', trades),
+            ('pnl', pnl),
+            ('total_pnl', total_pnl),
+            ('tax_reporting_data', tax_reporting_data),
+        ]
+        jobs = []
+        if self.form_8949:
+            writer = Form8949Writer()
+            jobs.append((writer, self.tax_reporting_data(pnl, exact=True), writer.path(self.output_dir, 'form_8949')))
+        self.write_frames(frames, errors, jobs)
+
+    def write_frames(self, frames, errors=None, jobs=()):
+        """
+          Writes each (name, dataframe) in frames in every output format, then any other (writer, dataframe, path)
+          jobs, and errors to errors.csv unless errors is None.
+        """
+        print "Writing final data to files in {}/ folder".format(self.output_dir)
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        # The exact proceeds and cost LIFO keeps for Form 8949 are not part of the saved pnl
+        frames = [(name, df.drop([_ for _ in LIFO.exact_columns if _ in df.columns], axis=1)) for name, df in frames]
+        jobs = [(writer, df, writer.path(self.output_dir, name)) for name, df in frames for writer in self.writers] + \
+            list(jobs)
+
+        if self.output_workers and self.output_workers > 1 and hasattr(os, 'fork'):
+            with self.instrumentation.stage('write', rows=sum(len(_[1]) for _ in jobs)):
+                write_concurrently(jobs, self.output_workers)
+        else:
+            for writer, df, path in jobs:
+                with self.instrumentation.stage('write:{}'.format(os.path.basename(path)), rows=len(df)):
+                    writer.write(df, path)
 
-        with open(os.path.join('output', 'errors.csv'), 'w') as f:
-            for _ in errors:
-                f.write("%s\n" % _)
+        if errors is None:
+            return
+        with self.instrumentation.stage('write:errors', rows=len(errors)):
+            with open(os.path.join(self.output_dir, 'errors.csv'), 'w') as f:
+                for _ in errors:
+                    f.write("%s\n" % _)
 
     def update_file(self, filename, tax_reporting_data):
         tax_reporting_data.to_csv(os.path.join('data', 'tax_reporting_data.csv'))
 
     def print_errors(self, errors):
         print "\nTrades not included:"
-        for exception in [TradeTooSmallException, NotATradeException]:
+        for exception in [TradeTooSmallException, NotATradeException, DuplicateTradeException]:
             count = len([_ for _ in errors if isinstance(_, exception)])
             print "{e:<25} {c}".format(e=exception.__name__, c=count)
         print "\n"
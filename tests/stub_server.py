@@ -0,0 +1,48 @@
+import json
+import threading
+import time
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+
+
+class StubServer(object):
+    """
+      A local HTTP server answering every GET with respond(path, query), which returns (status, body).
+      The body is sent as JSON. Each request is recorded in "requests" as (time, path, query), with the
+      query as a dict of single values.
+
+      Use it as a context manager; "url" is the server's base URL, ending with a slash.
+    """
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse.urlparse(self.path)
+                query = dict((k, v[0]) for k, v in urlparse.parse_qs(url.query).items())
+                stub.requests.append((time.time(), url.path, query))
+                status, body = stub.respond(url.path, query)
+                data = json.dumps(body)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = HTTPServer(('127.0.0.1', 0), Handler)
+        self.url = 'http://127.0.0.1:{}/'.format(self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.daemon = True
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,82 @@
+import os
+import shutil
+import tempfile
+import unittest
+from decimal import Decimal
+import current_exchange_rates
+from current_exchange_rates import ExchangeRates
+from stub_server import StubServer
+
+# Listings by market cap, as CoinMarketCap pages them
+LISTINGS = [('BTC', 10000.5), ('ETH', 200.25), ('XRP', 0.25), ('BCH', 300.0), ('ZRX', 0.5)]
+
+
+def listings(path, query):
+    start, limit = int(query['start']), int(query['limit'])
+    page = LISTINGS[start - 1:start - 1 + limit]
+    return 200, {
+        'status': {'error_code': 0, 'error_message': None},
+        'data': [{'symbol': symbol, 'quote': {'USD': {'price': price}}} for symbol, price in page],
+    }
+
+
+class CurrentExchangeRatesTest(unittest.TestCase):
+    def setUp(self):
+        # Each test has its own cache file, and its own data/exchange_rates.csv for the historical fallback
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        os.makedirs('data')
+        with open(os.path.join('data', 'exchange_rates.csv'), 'w') as f:
+            f.write('date,currency,rate\n2019-01-01,LTC,0.04\n2019-01-02,LTC,0.025\n')
+        self.cache_path = os.path.join(self.directory, 'current_prices.json')
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def rates(self, api, **kwargs):
+        return ExchangeRates(api=api, cache_path=self.cache_path, limit=2, **kwargs)
+
+    def test_pages_until_every_symbol_is_found(self):
+        with StubServer(listings) as server:
+            rates = self.rates(server.url).run(['BTC', 'BCH'])
+        self.assertEqual([_[2]['start'] for _ in server.requests], ['1', '3'])
+        self.assertEqual(rates['BTC_USD'], Decimal(10000.5))
+        self.assertEqual(rates['BCH_USD'], Decimal(300.0))
+        self.assertEqual(rates['USD_USD'], 1)
+
+    def test_prices_are_reused_within_ttl(self):
+        with StubServer(listings) as server:
+            self.rates(server.url).run(['ETH'])
+            self.assertEqual(len(server.requests), 1)
+            # From memory, then from the cache file in a fresh process
+            self.assertEqual(self.rates(server.url).run(['ETH'])['ETH_USD'], Decimal(200.25))
+            current_exchange_rates._prices.clear()
+            self.assertEqual(self.rates(server.url).run(['ETH', 'BTC'])['BTC_USD'], Decimal(10000.5))
+            self.assertEqual(len(server.requests), 1)
+
+            # Once the ttl has passed, prices are fetched again
+            self.rates(server.url, ttl=0).run(['ETH'])
+            self.assertEqual(len(server.requests), 2)
+
+    def test_unreachable_api_falls_back_to_cached_then_historical_prices(self):
+        with StubServer(listings) as server:
+            self.rates(server.url).run(['XRP'])
+        for rates in [self.rates(server.url, ttl=0), self.rates(server.url, ttl=0, offline=True)]:
+            # The stub server is shut down, so the API cannot be reached
+            prices = rates.run(['XRP', 'LTC', 'NOPE'])
+            self.assertEqual(prices['XRP_USD'], Decimal(0.25))
+            self.assertEqual(prices['LTC_USD'], Decimal(40))
+            self.assertNotIn('NOPE_USD', prices)
+
+    def test_symbols_without_a_price_are_left_out(self):
+        with StubServer(listings) as server:
+            rates = self.rates(server.url).run(['ZRX', 'NOPE'])
+        # Every page was fetched looking for NOPE
+        self.assertEqual([_[2]['start'] for _ in server.requests], ['1', '3', '5'])
+        self.assertEqual(sorted(rates), ['USD_USD', 'ZRX_USD'])
+
+
+if __name__ == '__main__':
+    unittest.main()
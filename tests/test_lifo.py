@@ -0,0 +1,89 @@
+import unittest
+import pandas as pd
+from decimal import Decimal
+from datetime import datetime
+from lifo import LIFO
+
+COLUMNS = ['created_at', 'platform', 'currency', 'currency_pair', 'type', 'amount', 'basis',
+           'fill_currency', 'fill_type', 'fill_amount', 'fill_basis']
+
+# BTC bought in two lots, partly sold, partly paid for ETH and refilled by selling ETH, then sold across
+# every lot it holds, down to an exact lot boundary.
+TRADES = [
+    (datetime(2017, 1, 10), 'gdax', 'BTC', 'BTC-USD', 'buy', '2', '1000', 'USD', 'sell', '2000', '1'),
+    (datetime(2017, 3, 1), 'gdax', 'BTC', 'BTC-USD', 'buy', '1.5', '1200', 'USD', 'sell', '1800', '1'),
+    (datetime(2017, 6, 1), 'gdax', 'BTC', 'BTC-USD', 'sell', '0.5', '2500', 'USD', 'buy', '1250', '1'),
+    (datetime(2017, 8, 1), 'binance', 'ETH', 'ETH-BTC', 'buy', '10', '120', 'BTC', 'sell', '0.4', '3000'),
+    (datetime(2017, 10, 1), 'binance', 'ETH', 'ETH-BTC', 'sell', '5', '300', 'BTC', 'buy', '0.3', '5000'),
+    (datetime(2018, 2, 1), 'gdax', 'BTC', 'BTC-USD', 'sell', '2', '9000', 'USD', 'buy', '18000', '1'),
+    (datetime(2018, 6, 1), 'gdax', 'BTC', 'BTC-USD', 'sell', '0.9', '7000', 'USD', 'buy', '6300', '1'),
+    (datetime(2018, 7, 1), 'gdax', 'BTC', 'BTC-USD', 'buy', '0.1', '6500', 'USD', 'sell', '650', '1'),
+]
+
+# The results of the original, queue based LIFO for TRADES:
+# type, currency, currency_pair, amount, buy_date, sell_date, buy_basis, sell_basis, pnl, long_term, buy/sell platform
+PNL = [
+    ('buy', 'BTC', 'BTC-USD', '2', datetime(2017, 1, 10), None, 1000.0, None, None, None, 'gdax', None),
+    ('buy', 'BTC', 'BTC-USD', '1.5', datetime(2017, 3, 1), None, 1200.0, None, None, None, 'gdax', None),
+    ('sell', 'BTC', 'BTC-USD', '0.5', datetime(2017, 3, 1), datetime(2017, 6, 1), 1200.0, 2500.0, 650.0, False,
+     'gdax', 'gdax'),
+    ('sell', 'BTC', 'ETH-BTC', '0.4', datetime(2017, 3, 1), datetime(2017, 8, 1), 1200.0, 3000.0, 720.0, False,
+     'gdax', None),
+    ('buy', 'BTC', 'ETH-BTC', '0.3', datetime(2017, 10, 1), None, 5000.0, None, None, None, None, None),
+    ('sell', 'BTC', 'BTC-USD', '0.3', datetime(2017, 10, 1), datetime(2018, 2, 1), 5000.0, 9000.0, 1200.0, False,
+     None, 'gdax'),
+    ('sell', 'BTC', 'BTC-USD', '0.6', datetime(2017, 3, 1), datetime(2018, 2, 1), 1200.0, 9000.0, 4680.0, False,
+     'gdax', 'gdax'),
+    ('sell', 'BTC', 'BTC-USD', '1.1', datetime(2017, 1, 10), datetime(2018, 2, 1), 1000.0, 9000.0, 8800.0, True,
+     'gdax', 'gdax'),
+    ('sell', 'BTC', 'BTC-USD', '0.9', datetime(2017, 1, 10), datetime(2018, 6, 1), 1000.0, 7000.0, 5400.0, True,
+     'gdax', 'gdax'),
+    ('buy', 'BTC', 'BTC-USD', '0.1', datetime(2018, 7, 1), None, 6500.0, None, None, None, 'gdax', None),
+    ('buy', 'ETH', 'ETH-BTC', '10', datetime(2017, 8, 1), None, 120.0, None, None, None, 'binance', None),
+    ('sell', 'ETH', 'ETH-BTC', '5', datetime(2017, 8, 1), datetime(2017, 10, 1), 120.0, 300.0, 900.0, False,
+     'binance', 'binance'),
+]
+PNL_COLUMNS = ['type', 'currency', 'currency_pair', 'amount', 'buy_date', 'sell_date', 'buy_basis', 'sell_basis',
+               'pnl', 'long_term', 'buy_platform', 'sell_platform']
+
+# amount, basis, created_at, currency, currency_pair, platform, type
+REMAINING_FUNDS = [
+    ('0.1', '6500', datetime(2018, 7, 1), 'BTC', 'BTC-USD', 'gdax', 'buy'),
+    ('5', '120', datetime(2017, 8, 1), 'ETH', 'ETH-BTC', 'binance', 'buy'),
+]
+
+
+def trades():
+    df = pd.DataFrame(TRADES, columns=COLUMNS)
+    for _ in ['amount', 'basis', 'fill_amount', 'fill_basis']:
+        df[_] = df[_].apply(Decimal)
+    return df
+
+
+def rows(df, columns):
+    # Rows as tuples, with Decimal amounts and missing values (NaN, NaT) as None so they compare equal
+    values = []
+    for row in df[columns].itertuples(index=False):
+        values.append(tuple(None if pd.isnull(_) else _.to_pydatetime() if isinstance(_, pd.Timestamp) else _
+                            for _ in row))
+    return values
+
+
+class LIFOTest(unittest.TestCase):
+    def check(self, pnl, remaining_funds):
+        expected = [(_[0], _[1], _[2], Decimal(_[3])) + _[4:] for _ in PNL]
+        self.assertEqual(rows(pnl, PNL_COLUMNS), expected)
+        self.assertEqual(rows(remaining_funds, list(remaining_funds.columns)),
+                         [(Decimal(_[0]), Decimal(_[1])) + _[2:] for _ in REMAINING_FUNDS])
+        self.assertEqual(list(remaining_funds.columns),
+                         ['amount', 'basis', 'created_at', 'currency', 'currency_pair', 'platform', 'type'])
+
+    def test_matches_original_results(self):
+        self.check(*LIFO().run(trades()))
+
+    def test_fixed_point_matches_original_results(self):
+        self.check(*LIFO(fixed_point=True).run(trades()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from decimal import Decimal
+from datetime import datetime
+from errors import FrozenYearChangedError
+from lifo import LIFO
+from lifo_checkpoints import LotCheckpoints
+from test_lifo import COLUMNS, PNL_COLUMNS, trades, rows
+
+# A buy the year after the last year of the fixture, with more decimal places than any of its amounts
+LATER_TRADE = (datetime(2019, 3, 1), 'gdax', 'BTC', 'BTC-USD', 'buy', '0.123456789', '4000', 'USD', 'sell',
+               '493.827156', '1')
+
+
+def with_later_trade(df):
+    later = pd.DataFrame([LATER_TRADE], columns=COLUMNS)
+    for _ in ['amount', 'basis', 'fill_amount', 'fill_basis']:
+        later[_] = later[_].apply(Decimal)
+    return pd.concat([df, later], ignore_index=True)
+
+
+class LotCheckpointsTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def run_lifo(self, df, fixed_point=False, checkpoints=True):
+        store = LotCheckpoints(path=self.directory) if checkpoints else None
+        return LIFO(checkpoints=store, fixed_point=fixed_point).run(df)
+
+    def assertSameResults(self, results, expected):
+        self.assertEqual(rows(results[0], PNL_COLUMNS), rows(expected[0], PNL_COLUMNS))
+        self.assertEqual(rows(results[1], list(results[1].columns)), rows(expected[1], list(expected[1].columns)))
+
+    def check_resume(self, fixed_point):
+        full = self.run_lifo(trades(), fixed_point, checkpoints=False)
+        self.assertSameResults(self.run_lifo(trades(), fixed_point), full)
+        # Every year is resumed from the checkpoints saved by the first run
+        self.assertSameResults(self.run_lifo(trades(), fixed_point), full)
+
+    def test_resume_matches_full_run(self):
+        self.check_resume(fixed_point=False)
+
+    def test_fixed_point_resume_matches_full_run(self):
+        self.check_resume(fixed_point=True)
+
+    def test_editing_a_frozen_year_raises(self):
+        self.run_lifo(trades())
+        LotCheckpoints(path=self.directory).freeze(2017)
+        df = trades()
+        df.loc[1, 'amount'] = Decimal('1.4')
+        with self.assertRaises(FrozenYearChangedError):
+            self.run_lifo(df)
+
+    def check_later_trade(self, fixed_point):
+        self.run_lifo(trades(), fixed_point)
+        LotCheckpoints(path=self.directory).freeze(2018)
+        df = with_later_trade(trades())
+        # The later trade changes the fixed-point scale, which must not invalidate the frozen years
+        self.assertSameResults(self.run_lifo(df, fixed_point), self.run_lifo(df, fixed_point, checkpoints=False))
+
+    def test_adding_a_later_trade_does_not_raise(self):
+        self.check_later_trade(fixed_point=False)
+
+    def test_fixed_point_adding_a_later_trade_does_not_raise(self):
+        self.check_later_trade(fixed_point=True)
+
+
+if __name__ == '__main__':
+    unittest.main()
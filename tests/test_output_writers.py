@@ -0,0 +1,41 @@
+import os
+import shutil
+import tempfile
+import unittest
+import pandas as pd
+from decimal import Decimal
+from datetime import datetime
+from lifo import LIFO
+from taxes import Taxes
+
+
+class Form8949Test(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_sub_cent_coins_and_saved_schema(self):
+        trades = pd.DataFrame([
+            (datetime(2018, 1, 5), 'binance', 'XRP', 'XRP-USD', 'buy', Decimal('12345.67'), Decimal('0.0025')),
+            (datetime(2018, 3, 5), 'binance', 'XRP', 'XRP-USD', 'sell', Decimal('10000'), Decimal('0.0041')),
+        ], columns=['created_at', 'platform', 'currency', 'currency_pair', 'type', 'amount', 'basis'])
+        for _ in ['fill_currency', 'fill_type', 'fill_amount', 'fill_basis']:
+            trades[_] = None
+        taxes = Taxes(update_rates=False, output_dir=self.directory, form_8949=True)
+        pnl, remaining_funds = LIFO().run(trades)
+        taxes.write_files(trades, [], pnl, LIFO().aggregate_pnl(pnl), taxes.tax_reporting_data(pnl))
+
+        with open(os.path.join(self.directory, 'form_8949.csv')) as f:
+            rows = f.read().splitlines()
+        # Basis rounded to cents is 0.00 for both sides, the gain still matches pnl
+        self.assertEqual(rows[1], '10000 XRP,01/05/2018,03/05/2018,41.00,25.00,16.00,Short-term')
+
+        for name in ['pnl', 'tax_reporting_data']:
+            columns = pd.read_csv(os.path.join(self.directory, name + '.csv'), index_col=0).columns
+            self.assertFalse(set(LIFO.exact_columns) & set(columns))
+
+
+if __name__ == '__main__':
+    unittest.main()
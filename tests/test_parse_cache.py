@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+import unittest
+from parse_cache import ParseCache
+from rates import ExchangeRates
+from trades import Trades
+
+TRADES = 'created_at,platform,amount,type,currency_pair,fill_amount,price\n' \
+         '1/5/2018,ico,100,buy,BAT-ETH,1,0.01\n' \
+         '1/6/2018,ico,50,sell,BAT-ETH,0.6,0.012\n'
+
+
+class ParseCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        os.makedirs(os.path.join('data', 'manual_trades'))
+        with open(os.path.join('data', 'manual_trades', 'trades.csv'), 'w') as f:
+            f.write(TRADES)
+        self.write_rates(['2018-01-04,ETH,0.001', '2018-01-05,ETH,0.001', '2018-01-06,ETH,0.001'])
+        self.cache = ParseCache(os.path.join(self.directory, 'cache'))
+
+    def tearDown(self):
+        ExchangeRates().reset_table()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def write_rates(self, rows):
+        with open(os.path.join('data', 'exchange_rates.csv'), 'w') as f:
+            f.write('date,currency,rate\n' + ''.join(_ + '\n' for _ in rows))
+        ExchangeRates().reset_table()
+
+    def run_trades(self):
+        trades = Trades(cache=self.cache, exchanges=['manual_trades'])
+        df, errors = trades.run()
+        return df, [_[5] for _ in trades.timings]
+
+    def test_cached_until_the_rates_used_change(self):
+        df, cached = self.run_trades()
+        self.assertEqual(cached, [False])
+        self.assertEqual(list(df['native_value']), [1000, 600])
+
+        # Days after the last trade do not affect its values
+        self.write_rates(['2018-01-04,ETH,0.001', '2018-01-05,ETH,0.001', '2018-01-06,ETH,0.001',
+                          '2018-01-07,ETH,0.0005', '2018-01-08,ETH,0.0005'])
+        df, cached = self.run_trades()
+        self.assertEqual(cached, [True])
+
+        # A rate of a day with trades does
+        self.write_rates(['2018-01-04,ETH,0.001', '2018-01-05,ETH,0.001', '2018-01-06,ETH,0.0002',
+                          '2018-01-07,ETH,0.0005', '2018-01-08,ETH,0.0005'])
+        df, cached = self.run_trades()
+        self.assertEqual(cached, [False])
+        self.assertEqual(list(df['native_value']), [1000, 3000])
+
+
+if __name__ == '__main__':
+    unittest.main()
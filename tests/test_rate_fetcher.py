@@ -0,0 +1,78 @@
+import calendar
+import unittest
+from datetime import datetime, timedelta
+from rate_fetcher import CandleFetcher
+from errors import ApiError
+from stub_server import StubServer
+
+GRANULARITY = 3600
+
+
+def epoch(value):
+    return calendar.timegm(datetime.strptime(value, '%Y-%m-%dT%H:%M:%S').utctimetuple())
+
+
+def candles(path, query):
+    # Every candle from start to end inclusive, newest first like the API, so windows share their boundary
+    start, end = epoch(query['start']), epoch(query['end'])
+    return 200, [[t, 1.0, 2.0, 1.0, 2.0, 10.0] for t in range(end, start - 1, -GRANULARITY)]
+
+
+class CandleFetcherTest(unittest.TestCase):
+    def fetcher(self, server, **kwargs):
+        options = dict(workers=2, rate=1000, granularity=GRANULARITY, max_candles=10, backoff=0.05, max_backoff=0.2)
+        options.update(kwargs)
+        return CandleFetcher(server.url, **options)
+
+    def test_windows_and_boundary_candles(self):
+        start = datetime(2018, 1, 1)
+        end = start + timedelta(hours=25)
+        with StubServer(candles) as server:
+            result = self.fetcher(server).fetch(['BTC', 'ETH'], start, end)
+
+        windows = sorted((_[1], _[2]['start'], _[2]['end']) for _ in server.requests)
+        self.assertEqual(windows, [
+            ('/BTC-USD/candles', '2018-01-01T00:00:00', '2018-01-01T10:00:00'),
+            ('/BTC-USD/candles', '2018-01-01T10:00:00', '2018-01-01T20:00:00'),
+            ('/BTC-USD/candles', '2018-01-01T20:00:00', '2018-01-02T01:00:00'),
+            ('/ETH-USD/candles', '2018-01-01T00:00:00', '2018-01-01T10:00:00'),
+            ('/ETH-USD/candles', '2018-01-01T10:00:00', '2018-01-01T20:00:00'),
+            ('/ETH-USD/candles', '2018-01-01T20:00:00', '2018-01-02T01:00:00'),
+        ])
+        self.assertTrue(all(_[2]['granularity'] == str(GRANULARITY) for _ in server.requests))
+
+        first = calendar.timegm(start.utctimetuple())
+        for currency in ['BTC', 'ETH']:
+            # 26 hourly candles; the two window boundaries were returned twice but are kept once
+            self.assertEqual(sorted(result[currency]), range(first, first + 26 * GRANULARITY, GRANULARITY))
+
+    def test_retries_with_backoff(self):
+        failures = [503, 500]
+
+        def flaky(path, query):
+            if failures:
+                return failures.pop(0), {'message': 'unavailable'}
+            return candles(path, query)
+
+        start = datetime(2018, 1, 1)
+        with StubServer(flaky) as server:
+            result = self.fetcher(server).fetch(['BTC'], start, start + timedelta(hours=5))
+
+        self.assertEqual(len(result['BTC']), 6)
+        times = [_[0] for _ in server.requests]
+        self.assertEqual(len(times), 3)
+        # Waits 0.05s after the first failure and 0.1s after the second
+        self.assertGreaterEqual(times[1] - times[0], 0.05)
+        self.assertGreaterEqual(times[2] - times[1], 0.1)
+
+    def test_api_error_once_retries_run_out(self):
+        start = datetime(2018, 1, 1)
+        with StubServer(lambda path, query: (500, {'message': 'error'})) as server:
+            fetcher = self.fetcher(server, retries=2)
+            with self.assertRaises(ApiError):
+                fetcher.fetch(['BTC'], start, start + timedelta(hours=5))
+        self.assertEqual(len(server.requests), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from datetime import date, timedelta
+from rates import ExchangeRates, RateTable
+
+
+class MissingRangesTest(unittest.TestCase):
+    def setUp(self):
+        # BTC misses 2018-01-03, ETH misses 2018-01-02 and its last day
+        self.today = date.today()
+        last = self.today - timedelta(5)
+        first = last - timedelta(4)
+        rows = [((first + timedelta(_)).toordinal(), 'BTC', '0.001') for _ in range(5) if _ != 2]
+        rows += [((first + timedelta(_)).toordinal(), 'ETH', '0.01') for _ in range(4) if _ != 1]
+        self.table = RateTable.from_rows(rows)
+        self.first, self.last = first, last
+
+    def test_routine_update_only_fetches_after_the_last_date(self):
+        # ETH's missing last day is a gap, as for a currency the API stopped returning
+        self.assertEqual(ExchangeRates().missing_ranges(self.table), [
+            ('BTC', self.last + timedelta(1), self.today),
+            ('ETH', self.last + timedelta(1), self.today),
+        ])
+
+    def test_gaps_are_fetched_on_request(self):
+        self.assertEqual(ExchangeRates().missing_ranges(self.table, gaps=True), [
+            ('BTC', self.first + timedelta(2), self.first + timedelta(2)),
+            ('BTC', self.last + timedelta(1), self.today),
+            ('ETH', self.first + timedelta(1), self.first + timedelta(1)),
+            ('ETH', self.last, self.today),
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
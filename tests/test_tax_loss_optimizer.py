@@ -0,0 +1,71 @@
+import unittest
+import pandas as pd
+from decimal import Decimal
+from datetime import datetime
+from tax_loss_optimizer import TaxLossOptimizer
+
+RATES = {'BTC_USD': Decimal('100'), 'ETH_USD': Decimal('100')}
+
+# At $100, the newest BTC lot has a $10 gain and the older one a $100 loss, so BTC's losses cost $200 of
+# sales for -$90 of PNL, while the ETH lot gives -$50 of PNL for $100 of sales.
+LOTS = [
+    (Decimal('1'), Decimal('90'), datetime(2018, 6, 1), 'BTC'),
+    (Decimal('1'), Decimal('200'), datetime(2018, 1, 1), 'BTC'),
+    (Decimal('1'), Decimal('150'), datetime(2018, 3, 1), 'ETH'),
+]
+
+
+def remaining_funds(lots=LOTS):
+    return pd.DataFrame(lots, columns=['amount', 'basis', 'created_at', 'currency'])
+
+
+def year_pnl(value):
+    return pd.DataFrame({'year': [2018], 'pnl': [value]})
+
+
+class TaxLossOptimizerTest(unittest.TestCase):
+    def run_optimizer(self, funds, pnl_target=None, current_pnl=0.0):
+        optimizer = TaxLossOptimizer(2018, pnl_target=pnl_target, offline=True)
+        return optimizer.run(year_pnl(current_pnl), funds, RATES)
+
+    def sold(self, plan):
+        return dict((_.currency, (_.amount, _.sales, _.pnl)) for _ in plan.itertuples())
+
+    def test_lower_hull_skips_the_gain_lot(self):
+        curves = TaxLossOptimizer(2018, offline=True).lot_curves(remaining_funds(), RATES)
+        btc = [_ for _ in curves if _.currency == 'BTC'][0]
+        # Selling BTC's losing lot means selling the gain lot in front of it: one segment from 0 to both lots
+        self.assertEqual(btc.hull, [0, 2])
+        self.assertAlmostEqual(btc.segments()[0][0], -0.45)
+
+    def test_reaches_the_target_with_the_least_sales(self):
+        # Both currencies can bring PNL down to -50: ETH with $100 of sales, BTC only with $160
+        plan, summary = self.run_optimizer(remaining_funds(), pnl_target=-50)
+        self.assertEqual(self.sold(plan), {'ETH': (Decimal(1), Decimal(100), Decimal(-50))})
+        self.assertEqual(summary['final_pnl'], Decimal(-50))
+        self.assertEqual(summary['total_sales'], Decimal(100))
+
+    def test_sells_part_of_a_lot_to_meet_the_target(self):
+        plan, summary = self.run_optimizer(remaining_funds(), pnl_target=-20)
+        self.assertEqual(self.sold(plan), {'ETH': (Decimal('0.4'), Decimal(40), Decimal(-20))})
+        self.assertEqual(summary['final_pnl'], Decimal(-20))
+
+    def test_never_sells_more_than_is_held(self):
+        # The target is beyond every loss available: all lots are sold once, and no more
+        plan, summary = self.run_optimizer(remaining_funds(), pnl_target=-1000, current_pnl=500.0)
+        self.assertEqual(self.sold(plan), {
+            'BTC': (Decimal(2), Decimal(200), Decimal(-90)),
+            'ETH': (Decimal(1), Decimal(100), Decimal(-50)),
+        })
+        self.assertEqual(summary['final_pnl'], Decimal(360))
+        self.assertEqual(summary['total_sales'], Decimal(300))
+
+    def test_no_remaining_funds(self):
+        plan, summary = self.run_optimizer(remaining_funds([]), pnl_target=-50, current_pnl=100.0)
+        self.assertTrue(plan.empty)
+        self.assertEqual(summary['final_pnl'], Decimal(100))
+        self.assertEqual(summary['total_sales'], Decimal(0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,45 @@
+import os
+import shutil
+import tempfile
+import unittest
+from instrumentation import Instrumentation
+from rates import ExchangeRates
+from taxes import Taxes
+
+TRADES = 'created_at,platform,amount,type,currency_pair,fill_amount,price\n' \
+         '1/5/2018,in-person,1,buy,BTC-USD,10000,10000\n' \
+         '3/5/2018,in-person,0.5,sell,BTC-USD,6000,12000\n'
+
+
+class TaxesTest(unittest.TestCase):
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.mkdtemp()
+        os.chdir(self.directory)
+        os.makedirs(os.path.join('data', 'manual_trades'))
+        with open(os.path.join('data', 'manual_trades', 'trades.csv'), 'w') as f:
+            f.write(TRADES)
+        with open(os.path.join('data', 'exchange_rates.csv'), 'w') as f:
+            f.write('date,currency,rate\n2018-01-05,BTC,0.0001\n')
+
+    def tearDown(self):
+        ExchangeRates().reset_table()
+        os.chdir(self.cwd)
+        shutil.rmtree(self.directory)
+
+    def test_run_returns_the_report_on_request(self):
+        results = Taxes(update_rates=False, exchanges=['manual_trades']).run()
+        self.assertEqual(len(results), 6)
+        self.assertEqual(list(results[4]['pnl']), [1000.0])
+
+        results = Taxes(update_rates=False, exchanges=['manual_trades']).run(report=True)
+        self.assertEqual(len(results), 7)
+        report = results[6]
+        self.assertIsInstance(report, Instrumentation)
+        names = list(report.to_df()['name'])
+        self.assertIn('trades', names)
+        self.assertIn('lifo', names)
+
+
+if __name__ == '__main__':
+    unittest.main()
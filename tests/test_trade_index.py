@@ -0,0 +1,56 @@
+import unittest
+from decimal import Decimal
+from datetime import datetime
+from errors import DuplicateTradeException
+from trade_index import TradeIndex, fingerprint
+from trade_record import Trade
+
+
+def trade(created_at, amount, platform='gdax'):
+    return Trade(created_at=created_at, amount=Decimal(amount), fill_amount=Decimal(amount) * 1000,
+                 price=Decimal('1000'), currency_pair='BTC-USD', type='buy', platform=platform)
+
+
+class TradeIndexTest(unittest.TestCase):
+    def test_drops_trades_of_an_earlier_file(self):
+        index = TradeIndex()
+        year = [trade(datetime(2018, 3, 1), '1'), trade(datetime(2018, 11, 1), '0.5')]
+        quarter = [trade(datetime(2018, 11, 1), '0.50'), trade(datetime(2018, 12, 1), '2')]
+
+        kept, errors = index.add_file('gdax', 'gdax_2018.csv', year)
+        self.assertEqual(kept, year)
+        self.assertEqual(errors, [])
+
+        # The same trade exported as "0.50" in the overlapping file is a duplicate
+        kept, errors = index.add_file('gdax', 'gdax_q4.csv', quarter)
+        self.assertEqual(kept, quarter[1:])
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], DuplicateTradeException)
+        self.assertEqual(index.duplicates, 1)
+        self.assertEqual(index.watermarks['gdax'], datetime(2018, 12, 1))
+
+    def test_keeps_a_trade_repeated_within_a_file(self):
+        index = TradeIndex()
+        # Two fills of the same size in the same second are distinct trades
+        fills = [trade(datetime(2018, 3, 1), '1'), trade(datetime(2018, 3, 1), '1')]
+        kept, errors = index.add_file('gdax', 'gdax_2018.csv', fills)
+        self.assertEqual(kept, fills)
+        self.assertEqual(errors, [])
+
+        # An overlapping file listing them twice adds none, and a third copy is kept
+        again = fills + [trade(datetime(2018, 3, 1), '1')]
+        kept, errors = index.add_file('gdax', 'gdax_q1.csv', again)
+        self.assertEqual(kept, again[2:])
+        self.assertEqual(len(errors), 2)
+
+    def test_fingerprint_of_missing_and_unicode_fields(self):
+        self.assertEqual(fingerprint(trade(datetime(2018, 3, 1), '1', platform=None)),
+                         fingerprint(trade(datetime(2018, 3, 1), '1', platform=None)))
+        self.assertEqual(fingerprint(trade(datetime(2018, 3, 1), '1', platform=u'gdax')),
+                         fingerprint(trade(datetime(2018, 3, 1), '1', platform='gdax')))
+        self.assertNotEqual(fingerprint(trade(datetime(2018, 3, 1), '1', platform=u'b\xf6rse')),
+                            fingerprint(trade(datetime(2018, 3, 1), '1', platform=None)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import hashlib
+import json
+import os
+from collections import defaultdict
+from datetime import datetime
+from errors import DuplicateTradeException
+
+WATERMARK_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def canonical(amount):
+    # "1.50" and "1.5" are the same amount. Cheaper than Decimal.normalize(), which matters per trade.
+    text = str(amount)
+    if '.' in text and 'E' not in text:
+        text = text.rstrip('0').rstrip('.')
+    return text
+
+
+def text(value):
+    # Fields may be missing (None) or unicode, e.g. read from an xlsx file, and are hashed as UTF-8 bytes
+    return value if isinstance(value, str) else unicode(value).encode('utf-8')
+
+
+def fingerprint(trade):
+    """
+      Returns a stable fingerprint of a parsed Trade: the SHA-1 of its exchange, time, pair, side and amounts,
+      so the same trade exported as "1.50" or "1.5" has the same fingerprint in every file and every run.
+    """
+    return hashlib.sha1('|'.join((
+        text(trade.platform),
+        str(trade.created_at),
+        text(trade.currency_pair),
+        text(trade.type),
+        canonical(trade.amount),
+        canonical(trade.fill_amount),
+        canonical(trade.price),
+    ))).digest()
+
+
+class TradeIndex(object):
+    """
+      Drops trades that were already ingested from another file, in one pass over the trades, and tracks
+      the latest trade time of each exchange (its watermark).
+
+      Overlapping exports (e.g. a full-year file and a Q4 file of the same exchange) repeat the same
+      trades. Each file's trades are looked up by fingerprint in a hash index of the trades kept so far.
+      Identical trades can also be genuinely distinct (two fills of the same size in the same second), so
+      a file only adds the copies of a fingerprint beyond the most any earlier file held: a trade listed
+      twice in one file and twice in an overlapping one is kept twice.
+    """
+    def __init__(self):
+        self.counts = defaultdict(int)
+        self.files = {}
+        self.watermarks = {}
+        self.duplicates = 0
+
+    def add_file(self, exchange, path, trades):
+        """
+          Returns the trades of one file which are not in an earlier file, and a DuplicateTradeException for
+          each trade which is.
+        """
+        counts = self.counts
+        seen = defaultdict(int)
+        kept = []
+        errors = []
+        for trade in trades:
+            key = fingerprint(trade)
+            seen[key] += 1
+            if seen[key] > counts[key]:
+                kept.append(trade)
+                self.files.setdefault(key, path)
+            else:
+                errors.append(DuplicateTradeException("Trade is already in {}".format(self.files[key]), trade))
+        for key, count in seen.iteritems():
+            if count > counts[key]:
+                counts[key] = count
+        self.duplicates += len(errors)
+        self.advance(exchange, kept)
+        return kept, errors
+
+    def advance(self, exchange, trades):
+        # Moves the watermark of exchange to its latest trade
+        if trades:
+            latest = max(_.created_at for _ in trades)
+            if exchange not in self.watermarks or latest > self.watermarks[exchange]:
+                self.watermarks[exchange] = latest
+
+
+class Watermarks(object):
+    """
+      The watermark of each exchange, stored as JSON: the time of the latest trade ingested from its files.
+      Trades(incremental=True) skips the rows at or before the watermark, so only the rows appended to
+      an export since the last run are parsed in full.
+    """
+    def __init__(self, path=os.path.join('cache', 'watermarks.json')):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path, 'r') as f:
+                stored = json.load(f)
+        except IOError:
+            return {}
+        return dict((str(k), datetime.strptime(v, WATERMARK_FORMAT)) for k, v in stored.items())
+
+    def get(self, exchange):
+        return self.load().get(exchange)
+
+    def update(self, watermarks):
+        """
+          Moves each exchange's stored watermark forward to the one in watermarks (never back).
+        """
+        stored = self.load()
+        for exchange, latest in watermarks.items():
+            if exchange not in stored or latest > stored[exchange]:
+                stored[exchange] = latest
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict((k, v.strftime(WATERMARK_FORMAT)) for k, v in stored.items()), f, indent=2, sort_keys=True)
+        os.rename(tmp, self.path)
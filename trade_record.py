@@ -0,0 +1,72 @@
+def _intern(value):
+    return intern(value) if type(value) is str else value
+
+
+class Trade(object):
+    """
+      A compact record of one parsed trade: the required fields read from the export, and the implied
+      fields generated by the parser's FieldPipeline.
+
+      Trades use __slots__ instead of a dict per trade, and the short repeated strings (platform, currencies,
+      pair and trade types) are interned, so every trade of a platform shares the same string objects.
+      "_extras" (the unused columns of the source row) is only kept when the parser is asked for it, and
+      is None otherwise.
+
+      Fields can be read as attributes or with trade['field'].
+    """
+    fields = (
+        'created_at', 'amount', 'fill_amount', 'price', 'currency_pair', 'type', 'platform', 'currency',
+        'fill_currency', 'fill_type', 'native_value', 'native_currency', 'basis', 'fill_basis', '_extras',
+    )
+    interned = ('currency_pair', 'type', 'platform', 'currency', 'fill_currency', 'fill_type', 'native_currency')
+    __slots__ = fields
+
+    def __init__(self, created_at=None, amount=None, fill_amount=None, price=None, currency_pair=None,
+                 type=None, platform=None, currency=None, fill_currency=None, fill_type=None,
+                 native_value=None, native_currency=None, basis=None, fill_basis=None, _extras=None):
+        self.created_at = created_at
+        self.amount = amount
+        self.fill_amount = fill_amount
+        self.price = price
+        self.currency_pair = _intern(currency_pair)
+        self.type = _intern(type)
+        self.platform = _intern(platform)
+        self.currency = _intern(currency)
+        self.fill_currency = _intern(fill_currency)
+        self.fill_type = _intern(fill_type)
+        self.native_value = native_value
+        self.native_currency = _intern(native_currency)
+        self.basis = basis
+        self.fill_basis = fill_basis
+        self._extras = _extras
+
+    @classmethod
+    def from_dict(cls, trade, extras=False):
+        values = dict((_, trade.get(_)) for _ in cls.fields)
+        if not extras:
+            values['_extras'] = None
+        return cls(**values)
+
+    def values(self):
+        return tuple(getattr(self, _) for _ in self.fields)
+
+    def __getitem__(self, key):
+        try:
+            return getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+
+    def __reduce__(self):
+        return (Trade, self.values())
+
+    def __eq__(self, other):
+        return isinstance(other, Trade) and self.values() == other.values()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def __repr__(self):
+        return 'Trade({})'.format(', '.join(
+            '{}={!r}'.format(_, getattr(self, _)) for _ in self.fields if getattr(self, _) is not None))
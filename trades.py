@@ -1,31 +1,38 @@
 import pandas as pd
 import glob
 import os
-from exchange_parsers.coinbase import CoinbaseParser
-from exchange_parsers.coinbase_pro import CoinbaseProParser
-from exchange_parsers.binance_csv import BinanceCsvParser
-from exchange_parsers.binance_xlsx import BinanceXlsxParser
-from exchange_parsers.bitfinex import BitfinexParser
-from exchange_parsers.bittrex import BittrexParser
-from exchange_parsers.poloniex import PoloniexParser
-from exchange_parsers.kraken import KrakenParser
-from exchange_parsers.gemini import GeminiParser
-from exchange_parsers.circle import CircleParser
-from exchange_parsers.manual_trades import ManualTradesParser
-
-parsers = {
-    'binance_csv': BinanceCsvParser,
-    'binance_xlsx': BinanceXlsxParser,
-    'bitfinex': BitfinexParser,
-    'bittrex': BittrexParser,
-    'circle': CircleParser,
-    'coinbase': CoinbaseParser,
-    'coinbase_pro': CoinbaseProParser,
-    'gemini': GeminiParser,
-    'kraken': KrakenParser,
-    'poloniex': PoloniexParser,
-    'manual_trades': ManualTradesParser,
-}
+import time
+from operator import attrgetter
+from multiprocessing import Pool
+from rates import ExchangeRates
+from parse_cache import ParseCache
+from trade_index import TradeIndex, Watermarks
+from instrumentation import NULL_INSTRUMENTATION
+from exchange_parsers import parsers
+
+# Schema of the trades dataframe. Amounts, prices, values and basis stay exact Decimal objects
+# (object dtype) because LIFO matches lots with Decimal arithmetic; dates are datetime64 and the
+# low-cardinality name columns are categoricals.
+TRADE_COLUMNS = [
+    'amount', 'basis', 'created_at', 'currency', 'currency_pair', 'fill_amount', 'fill_basis',
+    'fill_currency', 'fill_type', 'native_currency', 'native_value', 'platform', 'price', 'type',
+]
+CATEGORICAL_COLUMNS = ['currency', 'fill_currency', 'platform']
+
+
+def parse_file(task):
+    """
+      Parses one export file with its exchange's parser. Module-level so pool workers can run it.
+      Returns the trades, the errors, and the wall time spent parsing.
+    """
+    exchange, path, extras, since, hourly_rates = task
+    start = time.time()
+    trade, error = parsers[exchange](extras=extras, since=since, hourly_rates=hourly_rates).run(path)
+    return trade, error, time.time() - start
+
+
+def init_worker(table, hourly=None):
+    ExchangeRates().install_table(table, hourly)
 
 
 class Trades():
@@ -33,31 +40,190 @@ class Trades():
       This class obtains all trades from each exchange.
 
       The run() function obtains all files in each data/<exchange>/ folder, and parses data in
-      each one according to that exchange's unique parser (Based on the "parsers" dictionary).
+      each one according to that exchange's unique parser (Based on the "parsers" registry, which only
+      imports the parsers of exchanges that have files).
       Each exchange's data is coalesced into a single dataframe, along with any errors captured
       in the process.
+
+      params
+      workers         : Number of processes used to parse files. By default files are parsed one after another
+                        in this process. With workers set, files are parsed on a process pool which shares the
+                        exchange rate table, and results are merged in the same order as a serial run.
+      extras          : Keep the "_extras" column (every unused column of the source file) in the trades dataframe.
+      cache           : A ParseCache (or True for the default one). Files whose contents and parser, and the exchange
+                        rates their trades were valued with, are unchanged since they were last parsed are loaded
+                        from the cache instead of being parsed again.
+      instrumentation : An Instrumentation to record a stage per file parsed ("parse:<file>") or loaded from
+                        the cache ("cache:<file>"), and for building the dataframe. Files parsed on the pool
+                        only record their wall time.
+      exchanges       : Only parse the files of these exchanges. The other data/<exchange> folders are not read.
+      currencies      : Only keep trades of these currencies, and the trades that fill them (e.g. an ETH-BTC
+                        trade is kept for BTC), which LIFO needs to match them.
+      until           : Only keep trades made before this datetime
+      dedup           : Drop the trades of a file which an earlier file already had (see TradeIndex), e.g. when
+                        exports overlap. The dropped trades are returned as DuplicateTradeExceptions.
+      watermarks      : A Watermarks store (or True for the default one). After run() it holds each exchange's
+                        latest parsed trade time.
+      incremental     : Only return the trades made after each exchange's stored watermark. Earlier rows are
+                        skipped as soon as their date is read, without generating the rest of the trade.
+      hourly_rates    : Value crypto fills at the hourly rate of their time (see DocumentParser)
+
+      After run(), "timings" holds (exchange, filename, seconds, trade count, error count, cached) for each file.
+      Counts are of the parsed file, before deduplication and the currencies and until filters.
     """
-    def __init__(self, *args, **kwargs):
-        pass
+    def __init__(self, workers=None, extras=False, cache=None, instrumentation=None, exchanges=None,
+                 currencies=None, until=None, dedup=True, watermarks=None, incremental=False, hourly_rates=False,
+                 *args, **kwargs):
+        self.workers = workers
+        self.extras = extras
+        self.cache = ParseCache() if cache is True else cache
+        self.instrumentation = instrumentation or NULL_INSTRUMENTATION
+        for _ in exchanges or []:
+            if _ not in parsers:
+                raise ValueError("Unknown exchange: {} (expected one of {})".format(_, ', '.join(sorted(parsers))))
+        self.exchanges = set(exchanges) if exchanges else None
+        self.currencies = set(currencies) if currencies else None
+        self.until = until
+        self.dedup = dedup
+        self.watermarks = Watermarks() if watermarks is True or (incremental and watermarks is None) else watermarks
+        self.incremental = incremental
+        self.hourly_rates = hourly_rates
+        self.since = {}
+        self.timings = []
 
     def run(self):
+        tasks = self.collect_files()
+        results = self.parse_files(tasks)
+
         trades = []
         errors = []
+        self.timings = []
+        index = TradeIndex()
+        for (exchange, path), (trade, error, seconds, cached) in zip(tasks, results):
+            self.timings.append((exchange, path, seconds, len(trade), len(error), cached))
+            errors.extend(error)
+            if self.dedup:
+                trade, duplicates = index.add_file(exchange, path, trade)
+                errors.extend(duplicates)
+            else:
+                index.advance(exchange, trade)
+            trades.extend(self.select(trade))
+        self.print_timings()
+        if index.duplicates:
+            print "Dropped {} trades already in another file".format(index.duplicates)
+        if self.watermarks:
+            self.watermarks.update(index.watermarks)
+
+        with self.instrumentation.stage('trades.dict_to_df', rows=len(trades)):
+            df = self.dict_to_df(trades)
+        with self.instrumentation.stage('trades.process_df', rows=len(df)):
+            df = self.process_df(df)
+        return df, errors
+
+    def collect_files(self):
+        tasks = []
+        self.since = self.watermarks.load() if self.incremental else {}
         for exchange in parsers.keys():
+            if self.exchanges and exchange not in self.exchanges:
+                continue
             print "Processing trades from {}".format(exchange)
             for _file in glob.glob('./data/{}/*'.format(exchange)):
                 filename = self.process_filename(_file)
                 if filename[0] == '.':
                     print "Skipping folder in {}".format(exchange)
                     continue
-                else:
-                    trade, error = parsers[exchange]().run(os.path.join('data', exchange, filename))
-                trades.extend(trade)
-                errors.extend(error)
+                tasks.append((exchange, os.path.join('data', exchange, filename)))
+        return tasks
 
-        df = self.dict_to_df(trades)
-        df = self.process_df(df)
-        return df, errors
+    def select(self, trades):
+        # The parsed trades which pass the currencies and until filters
+        if self.currencies is None and self.until is None:
+            return trades
+        currencies, until = self.currencies, self.until
+        return [_ for _ in trades
+                if (currencies is None or _.currency in currencies or _.fill_currency in currencies) and
+                (until is None or _.created_at < until)]
+
+    def parse_files(self, tasks):
+        """
+          Returns (trades, errors, seconds, cached) for each task, in task order. Cached files are
+          loaded, the rest are parsed (on the pool if workers is set) and added to the cache.
+        """
+        since = [self.since.get(exchange) for exchange, path in tasks]
+        keys = [self.cache.key(parsers[exchange], path, self.extras, _since, self.hourly_rates) if self.cache else None
+                for (exchange, path), _since in zip(tasks, since)]
+        results = [self.load_cached(_) for _ in keys]
+        misses = [(exchange, path, self.extras, _since, self.hourly_rates)
+                  for (exchange, path), _since, result in zip(tasks, since, results) if result is None]
+        pooled = bool(self.workers and misses)
+        if pooled:
+            parsed = iter(self.parse_parallel(misses))
+        else:
+            parsed = (self.parse_serial(_) for _ in misses)
+
+        for i, key in enumerate(keys):
+            path = tasks[i][1]
+            if results[i] is None:
+                trade, error, seconds = next(parsed)
+                if pooled:
+                    self.instrumentation.add('parse:{}'.format(path), seconds, len(trade) + len(error))
+                if self.cache:
+                    self.cache.put(key, (trade, error, self.rates_digest(trade)))
+                results[i] = (trade, error, seconds, False)
+            else:
+                trade, error, seconds, cached = results[i]
+                self.instrumentation.add('cache:{}'.format(path), seconds, len(trade) + len(error))
+        return results
+
+    def parse_serial(self, task):
+        with self.instrumentation.stage('parse:{}'.format(task[1])) as stage:
+            trade, error, seconds = parse_file(task)
+            stage.rows = len(trade) + len(error)
+        return trade, error, seconds
+
+    def load_cached(self, key):
+        if key is None:
+            return None
+        start = time.time()
+        result = self.cache.get(key)
+        if result is None:
+            return None
+        if len(result) != 3 or result[2] != self.rates_digest(result[0]):
+            return None
+        trade, error, rates = result
+        return trade, error, time.time() - start, True
+
+    def rates_digest(self, trades):
+        """
+          Returns a digest of the exchange rates of the fill currencies of trades, from the day of the first trade
+          to the day of the last, and of their hourly rates in hourly mode. Rates of days after the last trade,
+          such as the days a routine update appends, are left out.
+        """
+        if not trades:
+            return None
+        dates = [_.created_at for _ in trades]
+        first, last = min(dates), max(dates)
+        currencies = set(_.fill_currency for _ in trades if _.fill_currency)
+        digest = ExchangeRates().table().digest(first.date(), last.date(), currencies)
+        if self.hourly_rates:
+            digest += ExchangeRates().hourly_table().digest(first, last, currencies)
+        return digest
+
+    def parse_parallel(self, tasks):
+        table = ExchangeRates().table().share()
+        hourly = ExchangeRates().hourly_table() if self.hourly_rates else None
+        pool = Pool(self.workers, initializer=init_worker, initargs=(table, hourly))
+        try:
+            return pool.map(parse_file, tasks, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    def print_timings(self):
+        print "\nFile parsing times"
+        for exchange, path, seconds, trade_count, error_count, cached in self.timings:
+            print "{f:<50} {s:>8.2f}s {t:>8} trades {e:>8} errors{c}".format(
+                f=path, s=seconds, t=trade_count, e=error_count, c=' (cached)' if cached else '')
 
     def process_filename(self, _file):
         body = _file.split(".")[-2].split("/")[-1]
@@ -65,15 +231,20 @@ class Trades():
         return body + '.' + filetype
 
     def dict_to_df(self, _dict):
+        """
+          Builds the trades dataframe from the parsed Trade records in one pass, following TRADE_COLUMNS.
+        """
         print "Finalizing trades"
-        df = pd.DataFrame()
-        for trade in _dict:
-            df = df.append(trade, ignore_index=True)
+        columns = (['_extras'] if self.extras else []) + TRADE_COLUMNS
+        df = pd.DataFrame.from_records(map(attrgetter(*columns), _dict), columns=columns)
+        df['created_at'] = pd.to_datetime(df['created_at'])
+        for _ in CATEGORICAL_COLUMNS:
+            df[_] = df[_].astype('category')
         return df
 
     def process_df(self, df):
-        df.sort_values(by=['created_at'], ascending=True, inplace=True)
+        # Stable, so trades made at the same time keep their file order, with or without filters
+        df.sort_values(by=['created_at'], ascending=True, inplace=True, kind='mergesort')
         df.reset_index(inplace=True)
         del df['index']
-        del df['_extras']
         return df
@@ -0,0 +1,188 @@
+import posixpath
+import re
+import zipfile
+from datetime import datetime, timedelta
+from xml.etree import cElementTree
+
+RELATIONSHIP = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id'
+
+# Built-in number formats which display a date or time
+DATE_FORMAT_IDS = set(range(14, 23)) | set(range(27, 37)) | set(range(45, 48)) | set(range(50, 59))
+
+
+def local(tag):
+    # Tag name without its XML namespace
+    return tag.rpartition('}')[2]
+
+
+def is_date_format(code):
+    # A custom format is a date if it has date or time codes outside quoted text, escapes and [colors]
+    code = re.sub(r'"[^"]*"|\\.|\[[^\]]*\]', '', code)
+    return bool(re.search(r'[dmyhs]', code, re.I))
+
+
+def column_index(reference):
+    # "AB12" -> 27
+    index = 0
+    for char in reference:
+        if not char.isalpha():
+            break
+        index = index * 26 + ord(char.upper()) - 64
+    return index - 1
+
+
+class XlsxReader(object):
+    """
+      Reads the rows of an xlsx workbook lazily, without loading the workbook.
+
+      Each sheet's XML is parsed as a stream and every row is dropped once it has been yielded, so memory
+      holds the shared strings table and one row at a time, however many rows the sheets have. Rows are
+      lists of cell values, like xlrd's row_values(): text (unicode), numbers (float, as xlrd returns
+      them), u'' for empty cells, every row padded to the sheet's width, and an empty row for each row
+      without values before the last one that has values.
+
+      params
+      filename : The xlsx file
+      dates    : Return cells with a date number format as datetimes instead of spreadsheet serial numbers
+    """
+    def __init__(self, filename, dates=False):
+        self.filename = filename
+        self.dates = dates
+        self.zip = zipfile.ZipFile(filename)
+        self.names = set(self.zip.namelist())
+        self.date1904 = False
+        self.strings = self.shared_strings()
+        self.date_styles = self.read_date_styles() if dates else set()
+
+    def close(self):
+        self.zip.close()
+
+    def iterparse(self, name):
+        return cElementTree.iterparse(self.zip.open(name), events=('start', 'end'))
+
+    def shared_strings(self):
+        strings = []
+        if 'xl/sharedStrings.xml' not in self.names:
+            return strings
+        for event, elem in self.iterparse('xl/sharedStrings.xml'):
+            if event == 'end' and local(elem.tag) == 'si':
+                # Rich text is split across several <t> elements
+                strings.append(u''.join(_.text or u'' for _ in elem.iter() if local(_.tag) == 't'))
+                elem.clear()
+        return strings
+
+    def read_date_styles(self):
+        # Indexes of the cell styles (the "s" of a cell) with a date number format
+        if 'xl/styles.xml' not in self.names:
+            return set()
+        root = cElementTree.fromstring(self.zip.read('xl/styles.xml'))
+        custom = {}
+        styles = set()
+        for elem in root.iter():
+            if local(elem.tag) == 'numFmt':
+                custom[int(elem.get('numFmtId'))] = elem.get('formatCode', '')
+            elif local(elem.tag) == 'cellXfs':
+                for i, xf in enumerate(_ for _ in elem if local(_.tag) == 'xf'):
+                    format_id = int(xf.get('numFmtId', 0))
+                    if format_id in custom and is_date_format(custom[format_id]) or \
+                            format_id not in custom and format_id in DATE_FORMAT_IDS:
+                        styles.add(i)
+        return styles
+
+    def sheets(self):
+        """
+          Returns (name, path in the archive) for each sheet, in workbook order.
+        """
+        workbook = cElementTree.fromstring(self.zip.read('xl/workbook.xml'))
+        relationships = cElementTree.fromstring(self.zip.read('xl/_rels/workbook.xml.rels'))
+        targets = dict((_.get('Id'), _.get('Target')) for _ in relationships)
+        sheets = []
+        for elem in workbook.iter():
+            if local(elem.tag) == 'workbookPr':
+                self.date1904 = elem.get('date1904') in ('1', 'true')
+            elif local(elem.tag) == 'sheet':
+                target = targets[elem.get(RELATIONSHIP)]
+                path = target.lstrip('/') if target.startswith('/') else posixpath.normpath(posixpath.join('xl', target))
+                sheets.append((elem.get('name'), path))
+        return sheets
+
+    def rows(self, path):
+        """
+          Yields the rows of the sheet at path.
+        """
+        width = 0
+        pending = 0
+        number = 0
+        sheet_data = None
+        for event, elem in self.iterparse(path):
+            tag = local(elem.tag)
+            if event == 'start':
+                if tag == 'sheetData':
+                    sheet_data = elem
+                continue
+            if tag == 'dimension':
+                last = elem.get('ref', 'A1').split(':')[-1]
+                width = column_index(last) + 1
+            elif tag == 'row':
+                # Rows without any cells may be left out of the file
+                previous, number = number, int(elem.get('r', number + 1))
+                pending += number - previous - 1
+                row = self.row_values(elem)
+                if sheet_data is not None:
+                    # Rows already yielded are not kept by the parser
+                    sheet_data.clear()
+                else:
+                    elem.clear()
+                if not any(_ != u'' for _ in row):
+                    pending += 1
+                    continue
+                width = max(width, len(row))
+                for _ in range(pending):
+                    yield [u''] * width
+                pending = 0
+                yield row + [u''] * (width - len(row))
+
+    def row_values(self, row):
+        values = []
+        for cell in row:
+            if local(cell.tag) != 'c':
+                continue
+            reference = cell.get('r')
+            index = column_index(reference) if reference else len(values)
+            if index > len(values):
+                values.extend([u''] * (index - len(values)))
+            values.append(self.cell_value(cell))
+        while values and values[-1] == u'':
+            values.pop()
+        return values
+
+    def cell_value(self, cell):
+        _type = cell.get('t', 'n')
+        if _type == 'inlineStr':
+            return u''.join(_.text or u'' for _ in cell.iter() if local(_.tag) == 't')
+        value = None
+        for child in cell:
+            if local(child.tag) == 'v':
+                value = child.text
+        if value is None:
+            return u''
+        if _type == 's':
+            return self.strings[int(value)]
+        if _type in ('str', 'e'):
+            return value
+        if _type == 'b':
+            return int(value)
+        if _type == 'd':
+            return datetime.strptime(value[:19], '%Y-%m-%dT%H:%M:%S')
+        number = float(value)
+        if self.dates and int(cell.get('s', 0)) in self.date_styles:
+            return self.to_datetime(number)
+        return number
+
+    def to_datetime(self, serial):
+        # Same rounding to the millisecond as xlrd.xldate_as_datetime
+        epoch = datetime(1904, 1, 1) if self.date1904 else datetime(1899, 12, 30)
+        days = int(serial)
+        milliseconds = int(round((serial - days) * 86400000.0))
+        seconds, milliseconds = divmod(milliseconds, 1000)
+        return epoch + timedelta(days, seconds, 0, milliseconds)